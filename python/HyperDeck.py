@@ -26,6 +26,8 @@
 import asyncio
 import logging
 
+from hyperdeck_protocol import HyperDeckProtocol
+
 class HyperDeck:
 	logger = logging.getLogger(__name__)
 
@@ -38,7 +40,7 @@ class HyperDeck:
 		self._loop = loop or asyncio.get_event_loop()
 		self._transport = None
 		self._callback = None
-		self._response_future = None
+		self._protocol = HyperDeckProtocol()
 
 	async def set_callback(self, callback):
 		# This callback is invoked each time the HyperDeck's state changes.
@@ -165,17 +167,14 @@ class HyperDeck:
 		if not self._transport:
 			return None
 
-		# We need to wait here if another command is currently in progress,
-		# as the HyperDeck processes all commands and gives all response in
-		# sequence.
-		if self._response_future:
-			await self._response_future
-
-		# Set up a future to receive the response from the HyperDeck, and send
-		# the command.
-		self._response_future = asyncio.Future(loop=self._loop)
+		# The HyperDeck processes all commands and gives all responses in
+		# sequence, so there is no need to wait for a command in progress.
+		# The protocol matches each response back to the future for its
+		# command, allowing several commands in flight at once.
+		response_future = self._loop.create_future()
+		self._protocol.sent(response_future)
 		await self._send(command)
-		response = await self._response_future
+		response = await response_future
 
 		if self._callback is not None:
 			transcript = {
@@ -197,83 +196,43 @@ class HyperDeck:
 	async def _parse_responses(self):
 		while True:
 			try:
-				response_lines = await self._receive()
-
-				# Ignore an empty responses, just discard and continue waiting
-				# for new data.
-				if len(response_lines) == 0:
-					continue
+				data = await self._transport[0].read(4096)
 			except Exception as e:
 				self.logger.error("Connection failed: {}".format(e))
 				return
 
-			try:
-				# Response code is the first number in the first response line
-				# from the HyperDeck. Abort if we receive a malformed response.
-				response_code = int(response_lines[0].split(' ', 1)[0])
-			except Exception as e:
-				self.logger.error("Malformed response: {}".format(e))
+			if not data:
+				self.logger.error("Connection closed")
 				return
 
-			# Special ranges of response codes indicates errors, or asynchronous
-			# responses that arrive at any time (without an explicit command
-			# being sent first).
-			is_error_response = response_code >= 100 and response_code < 200
-			is_async_response = response_code >= 500 and response_code < 600
-
-			# The 502 response code indicates a slot information change; a disk/card
-			# has been inserted or removed.
-			if response_code == 502:
-				# Short delay to give the HyperDeck enough time to update its
-				# internal clip state.
-				asyncio.sleep(300)
-
-				# 502 Slot Info responses require us to refresh our local clip
-				# cache, since the available disk(s) have changed. Run this
-				# on the event loop outside this function, so we don't deadlock.
-				self._loop.create_task(self.update_clips())
-
-			# Only signal the completion of a command that is in progress, if
-			# this is not an asynchronous response.
-			if not is_async_response and self._response_future is not None:
-				response = {
-					'error': is_error_response,
-					'code': response_code,
-					'lines': response_lines,
-				}
+			for response in self._protocol.feed(data):
+				self.logger.debug('Received: {} {}'.format(response, response.lines))
 
-				self._response_future.set_result(response)
-				self._response_future = None
+				# The 502 response code indicates a slot information change; a disk/card
+				# has been inserted or removed.  This requires us to refresh our local
+				# clip cache, since the available disk(s) have changed. Run this
+				# on the event loop outside this function, so we don't deadlock.
+				if response.code == 502:
+					self._loop.create_task(self._refresh_clips())
+
+				# Asynchronous responses arrive at any time without an explicit command
+				# being sent first, and are not matched to a request.
+				response_future = response.request
+				if response_future is not None and not response_future.done():
+					response_future.set_result({
+						'error': response.is_error(),
+						'code': response.code,
+						'lines': ['{} {}'.format(response.code, response.message)] + response.lines,
+					})
+
+	async def _refresh_clips(self):
+		# Short delay to give the HyperDeck enough time to update its
+		# internal clip state.
+		await asyncio.sleep(0.3)
+		await self.update_clips()
 
 	async def _send(self, data):
 		self.logger.debug('Sent: {}'.format([data]))
 
 		data += '\r\n'
 		return self._transport[1].write(data.encode('utf-8'))
-
-	async def _receive(self):
-		if not self._transport:
-			return
-
-		async def _read_line():
-			line = await self._transport[0].readline()
-			return bytes(line).decode('utf-8').rstrip()
-
-		lines = []
-
-		# Get first response line from the HyperDeck, this will contain the
-		# status code followed by the textual description of the response.
-		lines.append(await _read_line())
-
-		# Multi-line responses end with a colon on the first line; we need to
-		# keep reading from the device in this cause until we hit an empty line.
-		if str.endswith(lines[0], ':'):
-			while True:
-				line = await _read_line()
-				if not len(line):
-					break
-
-				lines.append(line)
-
-		self.logger.debug('Received: {}'.format(lines))
-		return lines
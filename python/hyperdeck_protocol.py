@@ -0,0 +1,112 @@
+import re
+import time
+from collections import deque
+
+
+class HyperDeckResponse:
+    """ A single response from the deck.  request is whatever was passed to
+        HyperDeckProtocol.sent() for the command this answers, or None for an
+        asynchronous notification. """
+
+    def __init__(self, code, message, lines=None):
+        self.code = code
+        self.message = message
+        self.lines = lines or []
+        self.request = None
+        self.elapsed = None
+
+    def is_error(self):
+        return 100 <= self.code < 200
+
+    def is_async(self):
+        return 500 <= self.code < 600
+
+    def __str__(self):
+        return f"{self.code} {self.message}"
+
+
+class HyperDeckProtocol:
+    """ Frames the HyperDeck ethernet protocol and matches responses to requests.
+
+        The deck answers commands strictly in the order they were sent, so several
+        commands can be written without waiting and the responses are matched to a
+        fifo of outstanding requests.  5xx responses are notifications and are not
+        matched to anything.
+
+        Call sent() for each command written to the socket, then feed() with the
+        data as it arrives to get back the completed responses.
+
+        Multi-line messages are:
+            <code> <message>:
+            <line>
+            <line>
+            <blank line>
+    """
+
+    STATUS_RE = re.compile(r"^([0-9]{3}) (.*)")
+
+    def __init__(self):
+        self.pending = deque()
+        self.buffer = ""
+        self.response = None
+
+    def clear(self):
+        """ Forget everything in flight, e.g. when the connection is reset """
+        self.pending.clear()
+        self.buffer = ""
+        self.response = None
+
+    def sent(self, request):
+        """ A command has been written, request is returned with its response """
+        self.pending.append((request, time.monotonic()))
+
+    def in_flight(self, match=None):
+        """ Number of requests waiting for a response, optionally only those equal to match """
+        if match is None:
+            return len(self.pending)
+        return sum(1 for request, _ in self.pending if request == match)
+
+    def feed(self, data):
+        """ Add data read from the socket, returns a list of complete responses """
+        if isinstance(data, bytes):
+            data = data.decode("utf8", errors="replace")
+
+        self.buffer += data
+        ret = []
+
+        # Keep any partial line for the next read
+        *lines, self.buffer = self.buffer.split("\n")
+
+        for raw in lines:
+            line = raw.strip()
+
+            if self.response is not None:
+                if line:
+                    self.response.lines.append(line)
+                else:
+                    ret.append(self.complete(self.response))
+                    self.response = None
+                continue
+
+            if not line:
+                continue
+
+            m = self.STATUS_RE.match(line)
+            if not m:
+                print("HyperDeck unparsed line: " + line)
+                continue
+
+            response = HyperDeckResponse(int(m.group(1)), m.group(2))
+            if response.message.endswith(":"):
+                # Multi-line, wait for the blank line
+                self.response = response
+            else:
+                ret.append(self.complete(response))
+
+        return ret
+
+    def complete(self, response):
+        if not response.is_async() and self.pending:
+            response.request, sent = self.pending.popleft()
+            response.elapsed = time.monotonic() - sent
+        return response
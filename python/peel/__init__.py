@@ -24,7 +24,7 @@
 
 
 from peel_devices import epiciphone, DeviceCollection
-from peel import harvest
+from peel import harvest, background_harvest
 from PySide6 import QtWidgets, QtCore
 
 try:
@@ -46,6 +46,7 @@ DEVICES = DeviceCollection()
 SUBJECTS = {}
 SETTINGS = None
 HARVEST = None
+BACKGROUND = None
 DIALOG_LOCK = False
 
 
@@ -69,6 +70,8 @@ def file_new():
 def teardown():
     """ UI-ACTION - main window has closed """
     print("Shutting down")
+    if BACKGROUND is not None:
+        BACKGROUND.teardown()
     DEVICES.teardown()
 
 
@@ -386,6 +389,7 @@ def show_harvest():
         QtWidgets.QMessageBox.warning(cmd.getMainWindow(), "Harvest", "No supported devices available")
         return
     HARVEST = harvest.HarvestDialog(SETTINGS, harvest_devices, cmd.getMainWindow())
+    HARVEST.harvest_started.connect(cancel_background)
     HARVEST.show()
 
 
@@ -473,3 +477,27 @@ def do_stop():
     """ Called shortly after stop event to update devices """
     global DEVICES
     DEVICES.update_all("STOP")
+
+    if background_harvest.enabled(SETTINGS) and not harvest_running():
+        background().take_stopped(DEVICES)
+
+
+def harvest_running():
+    """ True while the harvest dialog is downloading """
+    return bool(HARVEST and HARVEST.running)
+
+
+def cancel_background():
+    """ The harvest dialog is starting, it gets any files the background harvest had left """
+    if BACKGROUND is not None and BACKGROUND.is_busy():
+        cmd.writeLog("Stopping the background harvest for the harvest\n")
+        BACKGROUND.cancel()
+
+
+def background():
+    """ The background (trickle) harvest, harvests the last take after each stop when
+        turned on in the harvest dialog """
+    global BACKGROUND
+    if BACKGROUND is None:
+        BACKGROUND = background_harvest.BackgroundHarvest(SETTINGS, harvest_running)
+    return BACKGROUND
@@ -0,0 +1,159 @@
+from PySide6 import QtCore
+from PeelApp import cmd
+from peel_devices import DownloadThread
+from peel_devices.ledger import HarvestLedger
+from peel.harvest import HarvestScheduler, BACKGROUND_RATE, recording_rate
+from peel import post_harvest
+import os.path
+
+
+START_DELAY = 5000  # ms after a stop, for the devices to finish writing the take
+
+
+def enabled(settings):
+    return settings is not None and settings.value("harvestBackground") == "True"
+
+
+class BackgroundHarvest(QtCore.QObject):
+
+    """ Trickle harvest - after each stop the take that was just recorded is copied from the
+        devices that support it (see PeelDeviceBase.has_background_harvest) into the data
+        directory.  Runs one device at a time on low priority threads with its own bandwidth
+        limit, and slows down or pauses during the next take like the harvest dialog, so it
+        stays out of the way of the shoot.  Files go in the harvest ledger, the
+        harvest at the end of the day skips them and only has to catch up on the rest.
+    """
+
+    def __init__(self, settings, harvest_running=None, parent=None):
+        super(BackgroundHarvest, self).__init__(parent)
+        self.settings = settings
+        self.harvest_running = harvest_running  # callable, True while the harvest dialog is running
+        self.scheduler = HarvestScheduler(max_devices=1, thread_priority=QtCore.QThread.LowestPriority,
+                                          parent=self)
+        self.workers = []
+        self.ledger = None
+        self.ledger_directory = None
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(False)
+        self.timer.setInterval(1000)
+        self.timer.timeout.connect(self.do_update)
+
+    def rate(self):
+        return int(self.settings.value("harvestBackgroundRate", BACKGROUND_RATE))
+
+    def take_stopped(self, devices):
+        """ Called after a stop, queues the last take on each device once they have had time
+            to close the files """
+        devices = list(devices)
+        QtCore.QTimer.singleShot(START_DELAY, lambda: self.queue(devices))
+
+    def queue(self, devices):
+        if self.harvest_running is not None and self.harvest_running():
+            # The harvest dialog was started since the stop, it will get this take
+            cmd.writeLog("Background harvest: skipped, the harvest is running\n")
+            return
+
+        directory = None
+        if "DataDirectory" in cmd.currentConfig:
+            directory = cmd.currentConfig["DataDirectory"]
+        if not directory:
+            cmd.writeLog("Background harvest: no data directory\n")
+            return
+
+        self.open_ledger(directory)
+
+        for device in devices:
+            if not device.enabled or not device.has_background_harvest():
+                continue
+
+            try:
+                worker = self.make_worker(device, directory)
+            except Exception as e:
+                cmd.writeLog(f"Background harvest: could not start {device.name}: {e}\n")
+                continue
+
+            self.workers.append(worker)
+            self.scheduler.add(worker)
+
+        self.scheduler.set_limits(1, self.rate())
+        self.scheduler.set_recording_rate(recording_rate(self.settings))
+        self.scheduler.schedule()
+        if self.workers:
+            self.timer.start()
+
+    def make_worker(self, device, directory):
+        worker = device.harvest(os.path.join(directory, device.name))
+        if not isinstance(worker, DownloadThread):
+            raise RuntimeError("Not a download thread object: " + str(worker))
+
+        worker.set_download_mode("Last Take")
+        worker.set_match_mode(self.settings.value("harvestFilesMatch") or "Exact")
+        worker.set_create_selects_folders(self.settings.value("harvestSelectsFolders") == "True")
+        if self.ledger is not None:
+            worker.set_ledger(self.ledger, device.name)
+
+        worker.file_done.connect(self.file_done, QtCore.Qt.QueuedConnection)
+        worker.file_saved.connect(self.file_saved, QtCore.Qt.QueuedConnection)
+        worker.message.connect(self.log_message, QtCore.Qt.QueuedConnection)
+        return worker
+
+    def open_ledger(self, directory):
+        if self.ledger is not None and self.ledger_directory == directory:
+            return
+
+        self.close_ledger()
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            self.ledger = HarvestLedger(directory)
+            self.ledger_directory = directory
+        except Exception as e:
+            cmd.writeLog(f"Background harvest: could not open the ledger: {e}\n")
+
+    def close_ledger(self):
+        if self.ledger is not None:
+            self.ledger.close()
+            self.ledger = None
+            self.ledger_directory = None
+
+    def is_busy(self):
+        return bool(self.workers)
+
+    def do_update(self):
+        self.scheduler.schedule()
+
+        for worker in [w for w in self.workers if w.status == DownloadThread.STATUS_FINISHED]:
+            # Releases what the worker holds on to, e.g. listening sockets or device signals
+            worker.teardown()
+            self.workers.remove(worker)
+
+        if not self.workers:
+            self.timer.stop()
+            # Nothing to do until the next stop, let the threads and the last worker go
+            self.scheduler.teardown()
+
+    def file_done(self, name, copy_state, error):
+        if copy_state == DownloadThread.COPY_FAIL:
+            cmd.writeLog(f"Background harvest failed: {name} {error}\n")
+        elif copy_state == DownloadThread.COPY_OK:
+            cmd.writeLog(f"Background harvest: {name}\n")
+
+    def file_saved(self, path):
+        if self.settings.value("harvestMakeProxies") == "True":
+            post_harvest.processor().add(path)
+
+    def log_message(self, message):
+        cmd.writeLog(f"Background harvest: {message}\n")
+
+    def cancel(self):
+        """ Stop the downloads, waiting for the threads so no file is left half written """
+        self.timer.stop()
+        for worker in self.workers:
+            worker.teardown()
+        self.scheduler.teardown()
+        self.workers = []
+
+    def teardown(self):
+        self.cancel()
+        self.close_ledger()
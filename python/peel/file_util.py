@@ -30,4 +30,16 @@ def pretty_bytes(size, decimal_places=2):
         if size < 1024.0 or unit == 'PiB':
             break
         size /= 1024.0
-    return f"{size:.{decimal_places}f} {unit}"
\ No newline at end of file
+    return f"{size:.{decimal_places}f} {unit}"
+
+
+def pretty_time(seconds):
+    """ Short duration for the ui, e.g. 45s, 3m 20s, 1h 05m """
+    seconds = int(max(0, seconds))
+    if seconds < 60:
+        return f"{seconds}s"
+    minutes, seconds = divmod(seconds, 60)
+    if minutes < 60:
+        return f"{minutes}m {seconds:02d}s"
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h {minutes:02d}m"
@@ -24,22 +24,35 @@
 
 
 from PySide6 import QtWidgets, QtCore, QtGui
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import os.path
 from PeelApp import cmd
-from peel_devices import DownloadThread
-from peel import file_util
+from peel_devices import DownloadThread, RECORDING
+from peel_devices.ledger import HarvestLedger
+from peel_devices.harvest_priority import HarvestPriority, ORDERS
+from peel import file_util, post_harvest
+
+
+MB = 1024 * 1024  # bytes in the MB/s used by the bandwidth limits
+BACKGROUND_RATE = 5  # MB/s default for the background harvest
+
+
+def recording_rate(settings):
+    """ HarvestScheduler.recording_rate from the harvest settings """
+    if settings.value("harvestRecordingThrottle", "True") != "True":
+        return None
+    return int(settings.value("harvestRecordingRate", 0))
 
 
 class TimeSeriesWidget(QtWidgets.QWidget):
     def __init__(self, parent=None):
         super().__init__(parent)
-        self.samples = []  # List of integer sample values
+        self.samples = deque(maxlen=100)  # Integer sample values, oldest drop off
 
     def append(self, value):
         self.samples.append(value)
-        if len(self.samples) > 100:
-            self.samples.pop(0)
-        self.repaint()
+        self.update()
 
     def paintEvent(self, event):
 
@@ -72,9 +85,163 @@ class TimeSeriesWidget(QtWidgets.QWidget):
         painter.end()
 
 
+class HarvestScheduler(QtCore.QObject):
+
+    """ Runs the harvest workers with a limit on the number of devices downloading at once
+        and on the total bandwidth.  Workers wait in a queue for a free slot, threads are
+        created when they are first needed and reused once their worker has finished.
+
+        The bandwidth cap is shared fairly: a device that is not able to use its share keeps
+        what it is using (plus some headroom) and the rest is split between the others.
+        schedule() should be called regularly, e.g. from the dialog update timer.
+
+        With a priority (harvest_priority.HarvestPriority) the queued device with the most
+        important file goes next instead of the first in the queue.
+
+        While any device is recording (see peel_devices.RECORDING) the total is held to
+        recording_rate, or the downloads are paused if it is 0, so the harvest does not
+        compete with the capture.  Full speed resumes when the devices stop.
+    """
+
+    def __init__(self, max_devices=4, max_rate=0, thread_priority=QtCore.QThread.InheritPriority, parent=None):
+        super(HarvestScheduler, self).__init__(parent)
+        self.max_devices = max_devices
+        self.max_rate = max_rate  # MB/s, 0 for no limit
+        self.thread_priority = thread_priority  # for the worker threads
+        self.recording_rate = None  # MB/s while devices are recording, 0 to pause, None for no change
+        self.file_priority = None  # HarvestPriority, or None to run the queue in order
+        RECORDING.changed.connect(self.recording_changed, QtCore.Qt.QueuedConnection)
+        self.queue = deque()
+        self.active = []
+        self.threads = {}  # QThread -> worker last started on it
+
+    def set_limits(self, max_devices, max_rate):
+        self.max_devices = max(1, max_devices)
+        self.max_rate = max_rate
+
+    def set_recording_rate(self, rate):
+        self.recording_rate = rate
+        self.share_bandwidth()
+
+    def recording_changed(self, recording):
+        if self.active:
+            self.share_bandwidth()
+
+    def recording_limit(self):
+        """ The MB/s limit for recording, 0 when paused, or None if not limited right now """
+        if self.recording_rate is None or not RECORDING.is_recording():
+            return None
+        return self.recording_rate
+
+    def recording_text(self):
+        """ Describes any recording pause or limit for the ui, or an empty string """
+        limit = self.recording_limit()
+        if limit is None or not self.active:
+            return ""
+        names = ", ".join(RECORDING.names())
+        if limit == 0:
+            return f"Paused while recording: {names}"
+        return f"Limited to {limit} MB/s while recording: {names}"
+
+    def add(self, worker):
+        self.queue.append(worker)
+
+    def is_queued(self, worker):
+        return worker in self.queue
+
+    def pending(self):
+        """ Workers waiting for a slot or started but not yet running """
+        starting = sum(1 for w in self.active if w.status == DownloadThread.STATUS_NONE)
+        return len(self.queue) + starting
+
+    def get_thread(self):
+        """ A thread that is not busy, or a new one """
+        for thread, worker in self.threads.items():
+            if worker is None or worker.status == DownloadThread.STATUS_FINISHED:
+                return thread
+
+        thread = QtCore.QThread()
+        thread.start(self.thread_priority)
+        self.threads[thread] = None
+        return thread
+
+    def schedule(self):
+        """ Start queued workers while there are free slots and update the bandwidth shares """
+
+        # Workers still waiting for process() to be called have STATUS_NONE
+        self.active = [w for w in self.active
+                       if w.status in (DownloadThread.STATUS_NONE, DownloadThread.STATUS_RUNNING)]
+
+        if self.file_priority is not None and self.queue and len(self.active) < self.max_devices:
+            # Devices that have not listed their files yet keep their place behind the others
+            keys = {id(w): w.best_priority() for w in self.queue}
+            self.queue = deque(sorted(self.queue, key=lambda w: (keys[id(w)] is None, keys[id(w)] or ())))
+
+        while self.queue and len(self.active) < self.max_devices:
+            worker = self.queue.popleft()
+            thread = self.get_thread()
+            self.threads[thread] = worker
+            worker.moveToThread(thread)
+            worker.start_requested.connect(worker.process, QtCore.Qt.QueuedConnection)
+            self.active.append(worker)
+            worker.start_requested.emit()
+
+        self.share_bandwidth()
+
+    def share_bandwidth(self):
+        max_rate = self.max_rate
+        limit = self.recording_limit()
+
+        for worker in self.active:
+            worker.set_paused(limit == 0)
+
+        if limit:
+            max_rate = min(max_rate, limit) if max_rate else limit
+
+        if not max_rate:
+            for worker in self.active:
+                worker.set_rate_limit(None)
+            return
+
+        budget = max_rate * MB
+        remaining = list(self.active)
+
+        while remaining:
+            share = budget / len(remaining)
+            slow = [w for w in remaining if (w.bandwidth or 0) < share * 0.8]
+            if not slow or len(slow) == len(remaining):
+                break
+
+            for worker in slow:
+                allowance = min(share, max((worker.bandwidth or 0) * 1.25, share / 4))
+                worker.set_rate_limit(allowance)
+                budget -= allowance
+                remaining.remove(worker)
+
+        for worker in remaining:
+            worker.set_rate_limit(budget / len(remaining))
+
+    def cancel(self):
+        """ Stop the running workers and drop the ones that have not started """
+        self.queue.clear()
+        for worker in self.active:
+            worker.set_paused(False)
+            worker.teardown()
+        self.active = []
+
+    def teardown(self):
+        self.cancel()
+        for thread in self.threads:
+            thread.quit()
+        for thread in self.threads:
+            thread.wait()
+        self.threads = {}
+
+
 class HarvestDialog(QtWidgets.QDialog):
 
-    start_processing = QtCore.Signal()
+    plan_finished = QtCore.Signal(object, object)  # worker, list of files / None / exception
+    harvest_started = QtCore.Signal()  # before the workers start, see peel.show_harvest
 
     def __init__(self, settings, devices, parent):
         super(HarvestDialog, self).__init__(parent)
@@ -86,7 +253,16 @@ class HarvestDialog(QtWidgets.QDialog):
         self.total_skipped = 0
         self.running = None
         self.workers = []
-        self.threads = []
+        self.scheduler = HarvestScheduler(parent=self)
+        self.ledger = None
+        self.plan_key = None  # settings the workers in self.workers were planned with
+        self.planning = 0  # devices still listing
+        self.plan_finished.connect(self.show_plan, QtCore.Qt.QueuedConnection)
+        self.priority = None  # HarvestPriority for the running harvest
+        self.priority_timer = QtCore.QTimer()
+        self.priority_timer.setSingleShot(False)
+        self.priority_timer.setInterval(2000)
+        self.priority_timer.timeout.connect(self.refresh_priority)
         self.update_timer = QtCore.QTimer()
         self.update_timer.setSingleShot(False)
         self.update_timer.setInterval(500)
@@ -143,9 +319,6 @@ class HarvestDialog(QtWidgets.QDialog):
             self.device_list.addTopLevelItem(item)
             self.device_list.setItemWidget(item, 1, pb)
             self.device_list.setItemWidget(item, 3, ts)
-            thread = QtCore.QThread()
-            thread.start()
-            self.threads.append(thread)
 
         self.splitter.addWidget(self.device_list)
         self.splitter.setSizes([1, 3])
@@ -170,6 +343,9 @@ class HarvestDialog(QtWidgets.QDialog):
         # Buttons
         self.go_button = QtWidgets.QPushButton("Get Files")
         self.go_button.released.connect(self.go)
+        self.plan_button = QtWidgets.QPushButton("Plan")
+        self.plan_button.setToolTip("List the files on the devices and show what would be copied, without copying")
+        self.plan_button.released.connect(self.plan)
         self.browse_button = QtWidgets.QPushButton("Browse Files")
         self.browse_button.released.connect(self.browse_files)
         self.stop_button = QtWidgets.QPushButton("Stop")
@@ -181,6 +357,20 @@ class HarvestDialog(QtWidgets.QDialog):
         else:
             self.selects_folders.setCheckState(QtCore.Qt.Unchecked)
 
+        self.verify_existing = QtWidgets.QCheckBox("Verify Existing")
+        self.verify_existing.setToolTip("Hash files that have already been harvested and check they have not changed")
+        if settings.value("harvestVerifyExisting") == "True":
+            self.verify_existing.setCheckState(QtCore.Qt.Checked)
+        else:
+            self.verify_existing.setCheckState(QtCore.Qt.Unchecked)
+
+        self.make_proxies = QtWidgets.QCheckBox("Make Proxies")
+        self.make_proxies.setToolTip("Make the h264 proxy, thumbnail and probe for each movie as it arrives")
+        if settings.value("harvestMakeProxies") == "True":
+            self.make_proxies.setCheckState(QtCore.Qt.Checked)
+        else:
+            self.make_proxies.setCheckState(QtCore.Qt.Unchecked)
+
         # Take Matching
 
         self.all_files = QtWidgets.QComboBox()
@@ -203,6 +393,13 @@ class HarvestDialog(QtWidgets.QDialog):
 
         self.all_files.setCurrentText(str(settings.value("harvestFilesMode")))
 
+        # Download order
+        self.order = QtWidgets.QComboBox()
+        self.order.setToolTip("Which files to download first")
+        for name in ORDERS:
+            self.order.addItem(name)
+        self.order.setCurrentText(str(settings.value("harvestOrder", "Device Order")))
+
         # Match Mode
         self.match_mode = QtWidgets.QComboBox()
         self.match_mode.addItem("Exact")
@@ -213,19 +410,84 @@ class HarvestDialog(QtWidgets.QDialog):
         button_layout = QtWidgets.QHBoxLayout()
         button_layout.addWidget(self.go_button)
         button_layout.addSpacing(3)
+        button_layout.addWidget(self.plan_button)
+        button_layout.addSpacing(3)
         button_layout.addWidget(self.browse_button)
         button_layout.addSpacing(3)
         button_layout.addWidget(self.stop_button)
         button_layout.addStretch(5)
         button_layout.addWidget(self.selects_folders)
+        button_layout.addSpacing(3)
+        button_layout.addWidget(self.verify_existing)
+        button_layout.addSpacing(3)
+        button_layout.addWidget(self.make_proxies)
         button_layout.addStretch(1)
         button_layout.addWidget(self.all_files)
         button_layout.addStretch(1)
         button_layout.addWidget(self.match_mode)
         button_layout.addSpacing(3)
+        button_layout.addWidget(self.order)
+        button_layout.addSpacing(3)
 
         layout.addItem(button_layout)
 
+        # Limits
+        self.max_devices = QtWidgets.QSpinBox()
+        self.max_devices.setRange(1, 64)
+        self.max_devices.setValue(int(self.settings.value("harvestMaxDevices", 4)))
+
+        self.max_rate = QtWidgets.QSpinBox()
+        self.max_rate.setRange(0, 10000)
+        self.max_rate.setSuffix(" MB/s")
+        self.max_rate.setSpecialValueText("Unlimited")
+        self.max_rate.setValue(int(self.settings.value("harvestMaxRate", 0)))
+
+        # Background harvest after each stop, see background_harvest
+        self.background = QtWidgets.QCheckBox("Harvest After Each Take")
+        self.background.setToolTip("Copy the last take from each device in the background after every stop")
+        if settings.value("harvestBackground") == "True":
+            self.background.setCheckState(QtCore.Qt.Checked)
+        else:
+            self.background.setCheckState(QtCore.Qt.Unchecked)
+        self.background.toggled.connect(self.background_changed)
+
+        self.background_rate = QtWidgets.QSpinBox()
+        self.background_rate.setRange(1, 10000)
+        self.background_rate.setSuffix(" MB/s")
+        self.background_rate.setValue(int(self.settings.value("harvestBackgroundRate", BACKGROUND_RATE)))
+        self.background_rate.valueChanged.connect(self.background_changed)
+
+        # Slow down or pause while any device is recording
+        self.recording_throttle = QtWidgets.QCheckBox("While Recording")
+        self.recording_throttle.setToolTip("Limit the harvest while any device is recording")
+        if settings.value("harvestRecordingThrottle", "True") == "True":
+            self.recording_throttle.setCheckState(QtCore.Qt.Checked)
+        else:
+            self.recording_throttle.setCheckState(QtCore.Qt.Unchecked)
+        self.recording_throttle.toggled.connect(self.recording_throttle_changed)
+
+        self.recording_rate = QtWidgets.QSpinBox()
+        self.recording_rate.setRange(0, 10000)
+        self.recording_rate.setSuffix(" MB/s")
+        self.recording_rate.setSpecialValueText("Pause")
+        self.recording_rate.setValue(int(self.settings.value("harvestRecordingRate", 0)))
+        self.recording_rate.valueChanged.connect(self.recording_throttle_changed)
+
+        limits_layout = QtWidgets.QHBoxLayout()
+        limits_layout.addWidget(QtWidgets.QLabel("Devices at once"))
+        limits_layout.addWidget(self.max_devices)
+        limits_layout.addSpacing(3)
+        limits_layout.addWidget(QtWidgets.QLabel("Total bandwidth"))
+        limits_layout.addWidget(self.max_rate)
+        limits_layout.addSpacing(3)
+        limits_layout.addWidget(self.recording_throttle)
+        limits_layout.addWidget(self.recording_rate)
+        limits_layout.addStretch(1)
+        limits_layout.addWidget(self.background)
+        limits_layout.addWidget(self.background_rate)
+
+        layout.addItem(limits_layout)
+
         self.setLayout(layout)
 
         self.resize(500, 400)
@@ -241,15 +503,42 @@ class HarvestDialog(QtWidgets.QDialog):
     def closeEvent(self, e):
         self.teardown()
 
+    def recording_throttle_changed(self, *_):
+        """ Applies to a running harvest straight away """
+        self.settings.setValue("harvestRecordingThrottle", str(self.recording_throttle.isChecked()))
+        self.settings.setValue("harvestRecordingRate", self.recording_rate.value())
+        self.scheduler.set_recording_rate(recording_rate(self.settings))
+
+    def background_changed(self, *_):
+        """ Background harvest settings take effect from the next stop """
+        self.settings.setValue("harvestBackground", str(self.background.isChecked()))
+        self.settings.setValue("harvestBackgroundRate", self.background_rate.value())
+
     def teardown(self):
         self.running = False
+        self.priority_timer.stop()
         cmd.writeLog("Harvest teardown\n")
         for worker in self.workers:
             worker.teardown()
-        for thread in self.threads:
-            thread.quit()
-        for thread in self.threads:
-            thread.wait()
+        self.scheduler.teardown()
+        self.close_ledger()
+
+    def open_ledger(self):
+        """ Open the ledger of files already harvested to the data directory """
+        self.close_ledger()
+        try:
+            directory = self.path.text()
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            self.ledger = HarvestLedger(directory)
+        except Exception as e:
+            self.log_message("Could not open the harvest ledger, all files will be checked: " + str(e))
+            self.ledger = None
+
+    def close_ledger(self):
+        if self.ledger is not None:
+            self.ledger.close()
+            self.ledger = None
 
     def __del__(self):
         self.teardown()
@@ -263,12 +552,18 @@ class HarvestDialog(QtWidgets.QDialog):
         self.settings.setValue("harvestSplitterGeometry", self.splitter.sizes())
         self.settings.setValue("harvestFilesMode", self.all_files.currentText())
         self.settings.setValue("harvestFilesMatch", self.match_mode.currentText())
+        self.settings.setValue("harvestOrder", self.order.currentText())
         self.settings.setValue("harvestSelectsFolders", str(self.selects_folders.isChecked()))
+        self.settings.setValue("harvestVerifyExisting", str(self.verify_existing.isChecked()))
+        self.settings.setValue("harvestMakeProxies", str(self.make_proxies.isChecked()))
+        self.settings.setValue("harvestMaxDevices", self.max_devices.value())
+        self.settings.setValue("harvestMaxRate", self.max_rate.value())
 
         if self.running is True:
 
             # Already running, lets stop
             self.running = False
+            self.scheduler.cancel()
             for worker in self.workers:
                 worker.teardown()
                 del worker
@@ -279,13 +574,33 @@ class HarvestDialog(QtWidgets.QDialog):
 
         # let's start
 
-        self.workers = []
+        # Stops the background harvest, so the two do not write the same files
+        self.harvest_started.emit()
 
-        for i in range(self.device_list.topLevelItemCount()):
-            item = self.device_list.topLevelItem(i)
-            if item.checkState(0) == QtCore.Qt.Checked:
-                # adds to self.workers and self.threads
-                self.make_worker(i)
+        self.scheduler.set_limits(self.max_devices.value(), self.max_rate.value())
+        self.scheduler.set_recording_rate(recording_rate(self.settings))
+
+        if self.planning or self.plan_key is None or self.plan_key != self.current_plan_key():
+            self.workers = []
+            self.open_ledger()
+            for i in range(self.device_list.topLevelItemCount()):
+                item = self.device_list.topLevelItem(i)
+                if item.checkState(0) == QtCore.Qt.Checked:
+                    # adds to self.workers
+                    self.make_worker(i)
+        else:
+            # Run the plan, workers with a recent listing use it instead of listing again
+            self.log_message("Using the harvest plan")
+
+        self.plan_key = None
+
+        keys = ORDERS.get(self.order.currentText())
+        self.priority = HarvestPriority(keys) if keys else None
+        self.scheduler.file_priority = self.priority
+
+        for worker in self.workers:
+            worker.set_priority(self.priority)
+            self.scheduler.add(worker)
 
         if len(self.workers) == 0:
             self.log_message("No devices to collect files")
@@ -301,11 +616,13 @@ class HarvestDialog(QtWidgets.QDialog):
         self.info_label.setText("")
 
         self.update_timer.start()
+        if self.priority is not None:
+            self.priority_timer.start()
 
         self.update_gui()
 
-        # Start workers
-        self.start_processing.emit()
+        # Start workers, up to the device limit
+        self.scheduler.schedule()
 
     def make_worker(self, device_id: int):
 
@@ -328,24 +645,129 @@ class HarvestDialog(QtWidgets.QDialog):
 
         worker.set_create_selects_folders(self.selects_folders.isChecked())
 
+        worker.set_verify_existing(self.verify_existing.isChecked())
+
         worker.device_id = device_id
+        if self.ledger is not None:
+            worker.set_ledger(self.ledger, device.name)
         worker.file_done.connect(self.file_done, QtCore.Qt.QueuedConnection)
         worker.all_done.connect(self.all_done, QtCore.Qt.QueuedConnection)
         worker.message.connect(self.log_message, QtCore.Qt.QueuedConnection)
-        self.start_processing.connect(worker.process)
+        worker.file_saved.connect(self.file_saved, QtCore.Qt.QueuedConnection)
         self.workers.append(worker)
-        worker.moveToThread(self.threads[device_id])
+
+    def current_plan_key(self):
+        """ The settings a plan depends on, if any change the plan is made again """
+        checked = tuple(i for i in range(self.device_list.topLevelItemCount())
+                        if self.device_list.topLevelItem(i).checkState(0) == QtCore.Qt.Checked)
+        return (checked, self.path.text(), self.all_files.currentText(), self.match_mode.currentText(),
+                self.selects_folders.isChecked())
+
+    def plan(self):
+        """ List the files on the selected devices, all at once, and show how much a harvest
+            would copy and how long it should take.  Nothing is downloaded, Get Files then uses
+            the listings if it is pressed soon after. """
+
+        if self.running or self.planning:
+            return
+
+        self.workers = []
+        self.open_ledger()
+
+        for i in range(self.device_list.topLevelItemCount()):
+            item = self.device_list.topLevelItem(i)
+            if item.checkState(0) == QtCore.Qt.Checked:
+                self.make_worker(i)
+
+        if not self.workers:
+            self.log_message("No devices to plan")
+            return
+
+        self.plan_key = self.current_plan_key()
+        self.planning = len(self.workers)
+        self.plan_totals = []
+        self.plan_button.setEnabled(False)
+        self.log_message(f"Listing files on {len(self.workers)} devices")
+
+        pool = ThreadPoolExecutor(max_workers=len(self.workers))
+        for worker in self.workers:
+            self.device_list.topLevelItem(worker.device_id).setText(2, "Listing...")
+            pool.submit(self.plan_worker, worker)
+        pool.shutdown(wait=False)
+
+    def plan_worker(self, worker):
+        # Runs on the pool
+        try:
+            result = worker.plan()
+        except Exception as e:
+            result = e
+        self.plan_finished.emit(worker, result)
+
+    def device_rate(self, worker):
+        """ Average download speed the last time this device was harvested, or None """
+        value = self.settings.value("harvestRate/" + self.devices[worker.device_id].name)
+        return float(value) if value else None
+
+    def show_plan(self, worker, result):
+        self.planning -= 1
+        item = self.device_list.topLevelItem(worker.device_id)
+        name = self.devices[worker.device_id].name
+
+        if isinstance(result, Exception):
+            self.log_message(f"{name}: could not list files: {result}")
+            item.setText(2, "Listing failed")
+        elif result is None:
+            self.log_message(f"{name}: files are listed when the harvest starts")
+            item.setText(2, "Not listed")
+        else:
+            count, present, size = worker.plan_summary()
+            rate = self.device_rate(worker)
+            eta = size / rate if size is not None and rate else None
+            self.plan_totals.append((size, eta))
+
+            text = f"{count - present} of {count} files"
+            if size is not None:
+                text += ", " + file_util.pretty_bytes(size)
+            if eta is not None:
+                text += ", ~" + file_util.pretty_time(eta)
+            self.log_message(f"{name}: {text} ({present} already harvested)")
+            item.setText(2, text)
+
+        if self.planning:
+            return
+
+        self.plan_button.setEnabled(True)
+
+        sizes = [size for size, _ in self.plan_totals]
+        if not sizes or None in sizes:
+            self.log_message("Plan complete, the total size is not known for all devices")
+            return
+
+        total = sum(sizes)
+        msg = "Plan complete: " + file_util.pretty_bytes(total) + " to copy"
+
+        etas = [eta for _, eta in self.plan_totals]
+        if None not in etas:
+            # Devices run max_devices at a time, limited by the total bandwidth
+            eta = max(max(etas, default=0), sum(etas) / self.max_devices.value())
+            if self.max_rate.value():
+                eta = max(eta, total / (self.max_rate.value() * MB))
+            msg += ", about " + file_util.pretty_time(eta)
+
+        self.log_message(msg)
 
     def update_gui(self):
         if self.running:
             self.device_list.setEnabled(False)
             self.path.setEnabled(False)
             self.path_button.setEnabled(False)
+            self.plan_button.setEnabled(False)
             self.go_button.setText("Cancel")
         else:
             self.device_list.setEnabled(True)
             self.path.setEnabled(True)
             self.path_button.setEnabled(True)
+            self.plan_button.setEnabled(not self.planning)
             self.go_button.setText("Get Files")
 
     def do_update(self):
@@ -357,9 +779,13 @@ class HarvestDialog(QtWidgets.QDialog):
 
         if self.is_done():
             self.update_timer.stop()
+            self.priority_timer.stop()
             msg = "Download Complete\n\nFiles copied: %d\nFiles skipped: %d\nFiles failed: %d" % \
                   (self.total_copied, self.total_skipped, self.total_failed)
             self.log.appendPlainText(msg)
+            busy = post_harvest.processor().busy()
+            if busy:
+                self.log.appendPlainText(f"Making proxies for {busy} movies in the background")
             self.running = False
             self.update_gui()
 
@@ -373,10 +799,18 @@ class HarvestDialog(QtWidgets.QDialog):
             item = self.device_list.topLevelItem(row)
 
             val = worker.progress() * 100
-            item.setText(1, f"{val:.2%}")
+            eta = worker.eta()
+            if eta is not None:
+                item.setText(1, f"{val:.1f}% {file_util.pretty_time(eta)}")
+            else:
+                item.setText(1, f"{val:.1f}%")
             file = worker.current_file()
-            if file:
+            if worker.paused and worker.status == DownloadThread.STATUS_RUNNING:
+                item.setText(2, "Paused")
+            elif file:
                 item.setText(2, str(file))
+            elif self.scheduler.is_queued(worker):
+                item.setText(2, "Queued")
             else:
                 item.setText(2, "")
 
@@ -391,7 +825,7 @@ class HarvestDialog(QtWidgets.QDialog):
             # Progress Bar
             pb = self.device_list.itemWidget(item, 1)
             if pb:
-                pb.setValue(val)
+                pb.setValue(int(val))
                 pb.setMaximum(100)
 
             # Time Series
@@ -405,7 +839,16 @@ class HarvestDialog(QtWidgets.QDialog):
                 item.setBackground(i, brush)
                 item.setForeground(i, fg)
 
-        self.progress_bar.setValue(total // len(self.workers))
+        self.progress_bar.setValue(int(total // len(self.workers)))
+
+        if self.running:
+            self.scheduler.schedule()
+            self.info_label.setText(self.scheduler.recording_text())
+
+    def refresh_priority(self):
+        """ Pick up select status changes, the files still to download are sorted again """
+        if self.priority is not None and self.priority.refresh():
+            self.log_message("Harvest order updated")
 
     def log_message(self, message):
         self.log.appendPlainText(message)
@@ -415,6 +858,9 @@ class HarvestDialog(QtWidgets.QDialog):
         return sum(1 for worker in self.workers if worker.status == state)
 
     def is_done(self):
+        if self.scheduler.pending():
+            return False
+
         for worker in self.workers:
             if worker.is_running():
                 return False
@@ -433,10 +879,25 @@ class HarvestDialog(QtWidgets.QDialog):
             self.log.appendHtml("<FONT COLOR=\"#933\">FAILED: " + name + ":" + str(error) + "</FONT>")
             self.total_failed += 1
 
+    def file_saved(self, path):
+        # Start on the proxy etc while the rest of the harvest carries on
+        if self.make_proxies.isChecked():
+            post_harvest.processor().add(path)
+
     def all_done(self):
-        pass
-        #device = self.sender()
-        #index = self.workers.index(device)
+        # A worker has finished, remember how fast it was for planning and start the next one waiting
+        worker = self.sender()
+        if isinstance(worker, DownloadThread) and worker.device_id is not None:
+            rate = worker.average_rate()
+            if rate and worker.transferred() > 10000000:
+                key = "harvestRate/" + self.devices[worker.device_id].name
+                previous = self.settings.value(key)
+                if previous:
+                    rate = (float(previous) + rate) / 2
+                self.settings.setValue(key, rate)
+
+        if self.running:
+            self.scheduler.schedule()
 
     def sender_device_id(self):
         ref = self.sender()
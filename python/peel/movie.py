@@ -27,6 +27,7 @@ import subprocess
 import os
 import os.path
 import json
+import hashlib
 import timecode
 import tempfile
 from PySide6 import QtCore
@@ -39,8 +40,11 @@ def ffmpeg():
     return ffmpeg_exe
 
 
+CACHE_DIR = ".peel_cache"
+
+
 def ffprobe():
-    ffprobe_exe = os.path.join(QtCore.QCoreApplication.applicationDirPath(), "ffmpeg.exe")
+    ffprobe_exe = os.path.join(QtCore.QCoreApplication.applicationDirPath(), "ffprobe.exe")
     if not os.path.isfile(ffprobe_exe):
         raise RuntimeError("Error: Could not find ffprobe here: " + ffprobe_exe)
     return ffprobe_exe
@@ -52,37 +56,87 @@ def runthis(cmd):
     out, err = proc.communicate()
     print(out.decode())
     print(err.decode())
+    return proc.returncode
+
+
+def content_key(path):
+    """ Short key for the content of a media file, changes if the file is replaced """
+    st = os.stat(path)
+    value = f"{os.path.basename(path)}:{st.st_size}:{st.st_mtime_ns}"
+    return hashlib.sha1(value.encode("utf8")).hexdigest()[:16]
+
+
+def cache_path(path, suffix):
+    """ Where a file made from the media (proxy, thumbnail etc) is kept, in a hidden
+        folder next to it and named by content so a replaced file is not matched """
+    basedir, filename = os.path.split(path)
+    cache_dir = os.path.join(basedir, CACHE_DIR)
+    os.makedirs(cache_dir, exist_ok=True)
+    basename = os.path.splitext(filename)[0]
+    return os.path.join(cache_dir, f"{basename}_{content_key(path)}{suffix}")
+
+
+def make_cached(path, suffix, make):
+    """ Returns the cached file for path, calling make(temp path) to create it if needed.
+        The file is written to a unique temporary name first, so an interrupted run is not
+        cached and two threads making the same file do not write over each other """
+    dest = cache_path(path, suffix)
+    if os.path.isfile(dest):
+        return dest
+
+    fd, temp = tempfile.mkstemp(suffix=suffix, prefix=".tmp", dir=os.path.dirname(dest))
+    os.close(fd)
+    try:
+        ok = make(temp) == 0 and os.path.getsize(temp) > 0
+    except Exception:
+        os.remove(temp)
+        raise
+
+    if not ok:
+        os.remove(temp)
+        raise RuntimeError(f"Could not make {suffix} for {path}")
+
+    os.replace(temp, dest)
+    return dest
 
 
 def make_h264(source, dest):
-    runthis([ffmpeg(), "-i", source, "-vcodec", "libx264", dest])
+    return runthis([ffmpeg(), "-i", source, "-vcodec", "libx264", "-y", dest])
+
+
+def proxy(source):
+    """ H.264 version of a movie for review / upload, made once and cached """
+    return make_cached(source, ".mp4", lambda dest: make_h264(source, dest))
 
 
 def make_thumb(mov):
-    basedir, filename = os.path.split(mov)
-    thumb_dir = os.path.join(basedir, ".thumb")
-    if not os.path.isdir(thumb_dir):
-        os.mkdir(thumb_dir)
+    """ Thumbnail image for a movie, made once and cached """
+    return make_cached(mov, ".png", lambda dest: runthis(
+        [ffmpeg(), "-i",  mov, "-ss", "00:00:01.000", "-vframes", "1", "-y", dest]))
+
 
-    print(filename)
-    print(os.path.splitext(filename))
-    basename, ext = os.path.splitext(filename)
-    thumb_name = basename + ext.replace(".", "_") + ".png"
+def probe(mov_file):
+    """ ffprobe stream and format information for a movie, cached as json """
 
-    thumb_path = os.path.join(thumb_dir, thumb_name)
-    if os.path.isfile(thumb_path):
-        return thumb_path
+    def run(dest):
+        cmd = [ffprobe(), "-print_format", "json", "-show_streams", "-show_format", mov_file]
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = proc.communicate()
+        if proc.returncode == 0:
+            with open(dest, "wb") as fp:
+                fp.write(out)
+        return proc.returncode
 
-    runthis([ffmpeg(), "-i",  mov, "-ss", "00:00:01.000", "-vframes", "1", thumb_path])
-    return thumb_path
+    with open(make_cached(mov_file, ".json", run), "r") as fp:
+        return json.load(fp)
 
 
 def mov_start(mov_file):
 
-    cmd = [ffprobe(), "-print_format", "json", "-show_streams", mov_file]
-    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    out, err = proc.communicate()
-    data = json.loads(out)
+    try:
+        data = probe(mov_file)
+    except RuntimeError:
+        data = {}
     tc = None
     rate = None
     if 'streams' not in data:
@@ -0,0 +1,57 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from peel import movie
+
+
+class PostProcessor:
+    """ Makes the probe, thumbnail and H.264 proxy for each movie as soon as it
+        has been harvested, while the other files are still downloading.  The work is done by
+        ffmpeg / ffprobe processes, the pool threads just wait on them.  Results are cached
+        next to the media (see movie.cache_path) so publishing only has to upload.
+    """
+
+    EXTENSIONS = (".mov", ".mp4", ".mxf", ".avi")
+
+    def __init__(self, workers=2):
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.lock = threading.Lock()
+        self.pending = set()
+
+    def add(self, path):
+        if os.path.splitext(path)[1].lower() not in self.EXTENSIONS:
+            return
+
+        with self.lock:
+            if path in self.pending:
+                return
+            self.pending.add(path)
+
+        self.pool.submit(self.process, path)
+
+    def process(self, path):
+        try:
+            movie.probe(path)
+            movie.make_thumb(path)
+            movie.proxy(path)
+        except Exception as e:
+            print(f"Post harvest processing failed for {path}: {e}")
+        finally:
+            with self.lock:
+                self.pending.discard(path)
+
+    def busy(self):
+        """ Number of movies waiting or being processed """
+        with self.lock:
+            return len(self.pending)
+
+
+_processor = None
+
+
+def processor():
+    """ The shared post processor, it keeps working after the harvest dialog is closed """
+    global _processor
+    if _processor is None:
+        _processor = PostProcessor()
+    return _processor
@@ -327,15 +327,9 @@ class UploadGui(QtWidgets.QDialog):
                     result = self.sg.create('Version', data)
 
                     if self.compress_cb.isChecked():
-                        # Make a h264
-                        d = os.path.join(movie_dir, ".h264")
-                        if not os.path.isdir(d):
-                            os.mkdir(d)
-
-                        movie_path = os.path.join(movie_dir, ".h264", movie_name + ".mp4")
-                        if not os.path.isfile(movie_path):
-                            self.progressBar.setFormat("Compressing Video %p%")
-                            movie.make_h264(full_path, movie_path)
+                        # The h264 is usually already made by the harvest, see peel.post_harvest
+                        self.progressBar.setFormat("Compressing Video %p%")
+                        movie_path = movie.proxy(full_path)
                     else:
                         movie_path = full_path
 
@@ -343,7 +337,8 @@ class UploadGui(QtWidgets.QDialog):
                     self.sg.upload("Version", result["id"], movie_path, "sg_uploaded_movie", movie_name)
 
                     if not has_thumb:
-                        self.sg.upload_thumbnail("MocapTake", row_id, peel.movie.make_thumb(movie_path))
+                        # From the original, a thumbnail of the proxy would be cached inside the cache
+                        self.sg.upload_thumbnail("MocapTake", row_id, peel.movie.make_thumb(full_path))
                         has_thumb = True
 
                     files += 1
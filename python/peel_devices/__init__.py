@@ -30,7 +30,12 @@ import os
 import logging
 import sys
 import time
-from peel import file_util
+import heapq
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from peel_devices import integrity, transfer
+from peel_devices.take_matcher import TakeMatcher
+from peel_devices.rtt import RttEstimator
 
 logger = logging.getLogger()
 logger.addHandler(logging.StreamHandler(sys.stdout))
@@ -41,7 +46,7 @@ try:
 except ImportError:
     print("Could not import peel app - this script needs to run with peel Capture")
 
-from peel_devices import device_util
+from peel_devices import device_util, http_client
 
 
 class BaseDeviceWidget(QtWidgets.QWidget):
@@ -259,6 +264,11 @@ class SimpleDeviceWidget(BaseDeviceWidget):
         return self.name.text()
 
 
+class SafeDict(dict):
+    def __missing__(self, key):
+        return "{" + key + "}"  # leave placeholder intact if missing
+
+
 class NameFormatter:
     """ Holds a dict of parameters to use to create a file name,
     e.g. { 'device' : 'kipro1',  'take': 'sc1_0100_t1' }
@@ -276,15 +286,95 @@ class NameFormatter:
 
     def format_take(self, take):
         """ format a take file name using {key} formatting """
-
-        class SafeDict(dict):
-            def __missing__(self, key):
-                return "{" + key + "}"  # leave placeholder intact if missing
-
         self.values['take'] = take
         return self.formatting.format_map(SafeDict(self.values))
 
 
+class ProgressMeter:
+    """ Smoothed transfer rate from a byte counter that only ever goes up.  The ui samples
+        the counter on its timer, the rate is an exponentially weighted average so a single
+        slow tick does not make it jump around.  half_life is in seconds.
+    """
+
+    def __init__(self, half_life=3.0):
+        self.half_life = half_life
+        self.rate = None
+        self.last_total = None
+        self.last_time = None
+
+    def reset(self):
+        self.rate = None
+        self.last_total = None
+        self.last_time = None
+
+    def sample(self, total):
+        """ Add a reading of the counter, returns the rate in bytes per second """
+        now = time.monotonic()
+        if self.last_time is None:
+            self.last_total = total
+            self.last_time = now
+            return 0
+
+        elapsed = now - self.last_time
+        if elapsed <= 0:
+            return self.rate or 0
+
+        instant = (total - self.last_total) / elapsed
+        if self.rate is None:
+            self.rate = instant
+        else:
+            alpha = 1 - 0.5 ** (elapsed / self.half_life)
+            self.rate += alpha * (instant - self.rate)
+
+        self.last_total = total
+        self.last_time = now
+        return self.rate
+
+    def eta(self, remaining):
+        """ Seconds to move remaining bytes at the current rate, None if it is not known """
+        if remaining is None or not self.rate or self.rate <= 0:
+            return None
+        return remaining / self.rate
+
+
+class RecordingGate(QtCore.QObject):
+    """ Tracks which devices are recording, from the states they report to the app (see
+        PeelDeviceBase.device_ref) so the harvest can get out of the way during a take.
+        Use the RECORDING instance. """
+
+    changed = QtCore.Signal(bool)  # True when the first device starts recording, False when the last stops
+
+    def __init__(self, parent=None):
+        super(RecordingGate, self).__init__(parent)
+        self.devices = set()
+        self.lock = threading.Lock()
+
+    def set_state(self, device, state):
+        with self.lock:
+            was_recording = bool(self.devices)
+            if state == "RECORDING":
+                self.devices.add(device)
+            else:
+                self.devices.discard(device)
+            recording = bool(self.devices)
+
+        if recording != was_recording:
+            self.changed.emit(recording)
+
+    def remove(self, device):
+        self.set_state(device, None)
+
+    def is_recording(self):
+        return bool(self.devices)
+
+    def names(self):
+        with self.lock:
+            return sorted(str(i.name) for i in self.devices)
+
+
+RECORDING = RecordingGate()
+
+
 class PeelDeviceBase(QtCore.QObject):
     """ Base class for all devices """
 
@@ -341,6 +431,7 @@ class PeelDeviceBase(QtCore.QObject):
         self.plugin_id = -1  # reference to a dll plugin created by cmd.createDevice(...)
         self.enabled = True
         self.formatting = NameFormatter(name)
+        self.rtt = RttEstimator()  # devices that talk request / response can add samples
 
     def __str__(self):
         return self.name
@@ -471,6 +562,12 @@ class PeelDeviceBase(QtCore.QObject):
         if info is None:
             info = self.get_info(reason)
 
+        RECORDING.set_state(self, state)
+
+        rtt = self.rtt.info()
+        if rtt:
+            info = f"{info} {rtt}" if info else rtt
+
         device = PeelApp.cmd.newDevice()  # CPP class from parent app
         device.deviceId = self.device_id
         if self.plugin_id == -1:
@@ -538,6 +635,12 @@ class PeelDeviceBase(QtCore.QObject):
         """
         return False
 
+    def has_background_harvest(self):
+        """ Return True if the last take can be harvested in the background after each stop,
+            while the device stays in use.  Defaults to has_harvest()
+        """
+        return self.has_harvest()
+
     def harvest(self, directory):
         """ Download the takes to the local storage directory
         """
@@ -613,6 +716,7 @@ class DeviceCollection(QtCore.QObject):
         """ Cleanly remove all devices """
         for d in self.devices:
             d.teardown()
+            RECORDING.remove(d)
         self.devices = []
 
     def remove(self, device_id):
@@ -620,6 +724,7 @@ class DeviceCollection(QtCore.QObject):
         device = self.from_id(device_id)
         if device:
             device.teardown()
+            RECORDING.remove(device)
             self.devices.remove(device)
 
     def update_all(self, reason):
@@ -650,6 +755,8 @@ class DeviceCollection(QtCore.QObject):
             except NotImplementedError as e:
                 print("Incomplete device  (teardown): " + d.name)
 
+        http_client.close_all()
+
     def get_data(self):
         """ get the key value data for all devices, used to save the json data """
         data = []
@@ -749,18 +856,27 @@ class FileItem(object):
         self.error = None
         self.complete = False
         self.status = status
+        self.hash = None  # integrity.ALGORITHM hex digest, set once the file is on disk
+        self.present = False  # already harvested when the plan was made
 
     def __str__(self):
         return str(self.local_file)
 
 
+class DeferredFile(Exception):
+    """ Raised by a fetch function for a file the worker will download another way later,
+        download_file() leaves it to the worker instead of counting it as failed """
+
+
 class DownloadThread(QtCore.QObject):
 
     """ Base class for harvest download threads.  Has functions to interface with ui """
 
     file_done = QtCore.Signal(str, int, str)  # Name, CopyState, error string
+    file_saved = QtCore.Signal(str)  # local path of a file that has been downloaded
     all_done = QtCore.Signal()
     message = QtCore.Signal(str)
+    start_requested = QtCore.Signal()  # emitted by the harvest scheduler, connected to process()
 
     COPY_FAIL = 0
     COPY_OK = 1
@@ -771,15 +887,23 @@ class DownloadThread(QtCore.QObject):
     STATUS_STOP = 2
     STATUS_FINISHED = 3
 
+    PLAN_TTL = 300  # seconds a listing made by plan() is used for instead of listing again
+    PAUSE_POLL = 0.25  # seconds between checks while paused
+    PRIORITY_WINDOW = 100  # files listed ahead of the downloads and ordered by priority
+
     def __init__(self, directory, formatting=None, parent=None):
         super(DownloadThread, self).__init__(parent)
         self.local_directory = directory
         self.status = self.STATUS_NONE
         self.current_index = None
         self.files = []
-        self.last_size = None
-        self.last_time = None
         self.bandwidth = None
+        self.meter = ProgressMeter()
+        self.bytes_total = 0  # bytes received since the download started, only goes up
+        self.started_time = None
+        self.finished_time = None
+        self.planning = False
+        self.planned_time = None  # time.monotonic() of the listing in self.files from plan()
         self.file_size = 0  # the size of the file we are currently downloading
         self.current_size = 0  # the size of the file we are writing to
         self.device_id = None
@@ -789,7 +913,21 @@ class DownloadThread(QtCore.QObject):
         self.valid_takes = None
         self.create_selects_folders = None
         self.match_mode = None
+        self.take_matcher = None  # built from valid_takes on first use
         self.formatting = formatting
+        self.rate_limit = None  # bytes per second, set by the harvest scheduler
+        self.throttle_time = None
+        self.paused = False  # set by the harvest scheduler while devices are recording
+        self.worker_count = 1  # files to download at once in download_files()
+        self.write_behind = False  # write to disk on a second thread while receiving, see transfer.FileSink
+        self.file_progress = False  # download_files() is running, progress is tracked per file
+        self.in_flight = []
+        self.counter_lock = threading.Lock()
+        self.ledger = None  # HarvestLedger for the harvest directory, set by the harvest dialog
+        self.ledger_device = None
+        self.verify_existing = False  # rehash files that are already on disk
+        self.hashed = []  # (file_item, local path, skipped) for the media hash list
+        self.priority = None  # HarvestPriority for the harvest, None to download in listing order
 
     def add_file(self, local_path, remote_path, take):
         select = cmd.selectStatusForTake(take)
@@ -804,31 +942,163 @@ class DownloadThread(QtCore.QObject):
 
     def add_bytes(self, value):
         """ Update the amount of bytes that have been transferred with a new chunk.  Value is the amount to add """
-        if self.last_size is None or self.last_time is None:
-            self.last_size = 0
-            self.last_time = time.time()
-        self.current_size += value
+        with self.counter_lock:
+            self.bytes_total += value
+            self.current_size += value
+            delay = self.throttle(value)
+
+        if delay > 0:
+            time.sleep(delay)
+
+        while self.paused and self.status == self.STATUS_RUNNING:
+            time.sleep(self.PAUSE_POLL)
+
+    def add_file_bytes(self, file_item, value):
+        """ add_bytes() for a transfer running in download_files(), tracks the progress of the file """
+        file_item.data_size = (file_item.data_size or 0) + value
+        self.add_bytes(value)
+
+    def set_ledger(self, ledger, device_name):
+        """ Use a HarvestLedger to skip files that were harvested before, device_name is the
+            key for this device's files in the ledger """
+        self.ledger = ledger
+        self.ledger_device = device_name
+
+    def ledger_key(self, file_item):
+        """ Name of the file on the device, unique for the device, used as the ledger key """
+        return file_item.remote_file
+
+    def ledger_path(self, file_item):
+        """ Local path of the file if the ledger shows it has already been harvested and is still
+            on disk, otherwise None.  Needs the size from the device listing, files without one
+            are always checked by the download.  Sets file_item.hash from the ledger """
+        if self.ledger is None:
+            return None
+        key = self.ledger_key(file_item)
+        if not self.ledger.has(self.ledger_device, key, file_item.file_size):
+            return None
+        file_item.hash = self.ledger.lookup(self.ledger_device, key)["hash"]
+        return self.ledger.local_path(self.ledger_device, key)
 
-    def calc_bandwidth(self):
-        """ Calculate the bandwidth of data being transferred """
-        if self.last_size is None or self.last_time is None:
-            self.last_size = self.current_size
-            self.last_time = time.time()
+    def ledger_record(self, file_item, local_path):
+        if self.ledger is None:
+            return
+        try:
+            self.ledger.record(self.ledger_device, self.ledger_key(file_item), local_path,
+                               hash_value=file_item.hash)
+        except Exception as e:
+            print(f"Could not update the harvest ledger for {local_path}: {e}")
+
+    def set_verify_existing(self, value):
+        """ Hash files that were already harvested again and check them against the ledger """
+        self.verify_existing = value
+
+    def manifest_add(self, file_item, local_path, skipped=False):
+        """ Add a file that is on disk to the media hash list written when the harvest finishes.
+            Files without a hash are hashed then """
+        with self.counter_lock:
+            self.hashed.append((file_item, local_path, skipped))
+
+    def write_manifest(self):
+        """ Hash any files that need it in a pool and write the media hash list for the device
+            folder.  Hashes are added to the ledger so the next harvest does not need to """
+        with self.counter_lock:
+            hashed = self.hashed
+            self.hashed = []
+
+        if not hashed:
+            return
+
+        if self.is_running():
+            check = [(item, path) for item, path, skipped in hashed
+                     if item.hash is None or (skipped and self.verify_existing)]
+            if check:
+                self.log(f"{self} hashing {len(check)} existing files")
+                results = integrity.hash_files(sorted(set(path for _, path in check)))
+                for item, path in check:
+                    value = results.get(path)
+                    if value is None:
+                        continue
+                    if item.hash is not None and item.hash != value:
+                        self.log(f"{self} hash mismatch, file has changed since it was harvested: {path}")
+                    item.hash = value
+                    self.ledger_record(item, path)
+
+        hash_list = integrity.HashList(self.local_directory)
+        for item, path, _ in hashed:
+            if item.hash is not None:
+                hash_list.add(path, item.hash)
+
+        if len(hash_list) == 0:
+            return
+
+        try:
+            mhl_path = hash_list.write()
+            self.log(f"{self} wrote hash list for {len(hash_list)} files: {mhl_path}")
+        except (OSError, ValueError) as e:
+            self.log(f"{self} could not write the hash list: {e}")
+
+    def set_rate_limit(self, bytes_per_second):
+        """ Limit the download speed, None for no limit.  Applied in add_bytes() so only
+            downloads that report their progress are limited """
+        self.rate_limit = bytes_per_second
+
+    def set_paused(self, value):
+        """ Hold the download in add_bytes() until unpaused, like set_rate_limit() """
+        self.paused = value
+
+    def throttle(self, value):
+        """ Returns how long the download thread should sleep to keep to the rate limit """
+        if not self.rate_limit:
+            self.throttle_time = None
             return 0
 
-        bytes_diff = self.current_size - self.last_size
-        time_diff = time.time() - self.last_time
+        now = time.monotonic()
+        if self.throttle_time is None:
+            self.throttle_time = now
 
-        if time_diff != 0:
-            self.bandwidth = bytes_diff / time_diff
-        else:
-            self.bandwidth = 0
-        self.last_size = self.current_size
-        self.last_time = time.time()
+        # The time the bytes so far are due to have finished by, allowing up to a second of burst
+        self.throttle_time = max(self.throttle_time, now - 1.0) + value / self.rate_limit
+        return self.throttle_time - now
+
+    def transferred(self):
+        """ Bytes received so far.  Read by the ui without a lock, the counter only goes up """
+        return self.bytes_total
+
+    def calc_bandwidth(self):
+        """ Sample the transfer counter, called on the ui timer.  Returns the smoothed rate """
+        self.bandwidth = self.meter.sample(self.transferred())
         return self.bandwidth
 
+    def remaining_bytes(self):
+        """ Bytes still to download, or None if the size of any file is not known yet """
+        remaining = 0
+        for file_item in list(self.files):
+            if not isinstance(file_item, FileItem):
+                return None
+            if file_item.complete or file_item.error:
+                continue
+            if file_item.file_size is None:
+                return None
+            remaining += file_item.file_size - (file_item.data_size or 0)
+        return remaining
+
+    def eta(self):
+        """ Estimated seconds to finish, None if not known """
+        if not self.is_running():
+            return None
+        return self.meter.eta(self.remaining_bytes())
+
     def progress(self):
 
+        if self.file_progress:
+            # Add the fraction of each file in flight.  Files may still be being listed.
+            if not self.files:
+                return 0
+            with self.counter_lock:
+                partial = sum((i.data_size or 0) / i.file_size for i in self.in_flight if i.file_size)
+            return (self.okay_count + partial) / len(self.files)
+
         if self.okay_count == 0:
             return 0
 
@@ -848,8 +1118,240 @@ class DownloadThread(QtCore.QObject):
         return p + fraction * (self.current_size / self.file_size)
 
     def process(self):
-        """ Subclass thread entry point """
-        return NotImplementedError
+        """ Thread entry point.  By default gets the files from list_files() and downloads them
+            with download_files(), subclasses with their own transfer loop replace this """
+        self.set_started()
+        self.create_local_dir()
+
+        if self.has_plan():
+            self.download_files()
+        else:
+            # Start downloading files as they are listed
+            self.files = []
+            try:
+                self.download_files(source=self.iter_files())
+            except Exception as e:
+                self.log(f"{self} could not get the list of files: {e}")
+
+        self.set_finished()
+
+    def plan(self):
+        """ Dry run - list the files that would be downloaded and check which are already here,
+            without downloading anything.  The listing is kept in self.files and used by
+            process() if it starts within PLAN_TTL.  Returns the files, or None if the device
+            can not list its files ahead of time.  May be called on any thread. """
+        self.planning = True
+        try:
+            files = self.list_files()
+        except NotImplementedError:
+            return None
+        finally:
+            self.planning = False
+
+        for file_item in files:
+            file_item.present = self.is_present(file_item)
+
+        self.files = files
+        self.planned_time = time.monotonic()
+        return files
+
+    def has_plan(self):
+        """ True if self.files is a listing from plan() that is recent enough to use """
+        if self.planned_time is None:
+            return False
+        return time.monotonic() - self.planned_time < self.PLAN_TTL
+
+    def is_present(self, file_item):
+        """ True if a file does not need to be downloaded again """
+        if self.ledger_path(file_item) is not None:
+            return True
+        local_path = self.local_path(file_item.local_file, file_item.status)
+        if not os.path.isfile(local_path) or os.path.isfile(local_path + transfer.PARTIAL_SUFFIX):
+            return False
+        return file_item.file_size is None or os.path.getsize(local_path) == file_item.file_size
+
+    def plan_summary(self):
+        """ Returns (files, files already here, bytes to download or None if not known) for the plan """
+        present = sum(1 for i in self.files if i.present)
+        sizes = [i.file_size for i in self.files if not i.present]
+        size = None if None in sizes else sum(sizes)
+        return len(self.files), present, size
+
+    def average_rate(self):
+        """ Average bytes per second over the whole download, None if it has not finished """
+        if self.started_time is None or self.finished_time is None:
+            return None
+        elapsed = self.finished_time - self.started_time
+        if elapsed <= 0:
+            return None
+        return self.transferred() / elapsed
+
+    def list_files(self):
+        """ Subclass returns a list of FileItems to download, used by the default process() """
+        raise NotImplementedError
+
+    def iter_files(self):
+        """ FileItems to download for the default process().  Subclasses that find their files
+            gradually (see crawler.DirectoryCrawler) can yield them as they go so downloading
+            starts before the listing is complete.  Defaults to list_files() """
+        return iter(self.list_files())
+
+    def fetch_file(self, file_item, local_path):
+        """ Subclass copies a single file to local_path for download_files().  Returns COPY_OK
+            or COPY_SKIP and raises an exception on failure.  Should set file_item.file_size and
+            report progress with add_file_bytes().  Runs on several threads at once when
+            worker_count is more than one. """
+        raise NotImplementedError
+
+    def file_display_name(self, file_item):
+        """ Name used in the harvest log for a file """
+        return f"{self}: {file_item.local_file}"
+
+    def set_priority(self, priority):
+        """ Download the files in the order of a harvest_priority.HarvestPriority """
+        self.priority = priority
+
+    def priority_key(self, file_item):
+        name = os.path.splitext(os.path.basename(file_item.local_file))[0]
+        take = self.match_take(name) or name
+        return self.priority.key(take, file_item)
+
+    def best_priority(self):
+        """ Key of the most important file still to download, None if not known yet """
+        if self.priority is None:
+            return None
+        keys = [self.priority_key(i) for i in list(self.files) if not i.complete and not i.present]
+        return min(keys) if keys else None
+
+    def prioritised(self, items=None, window=None):
+        """ (index, FileItem) for self.files, or items if given as (index, FileItem), most
+            important first.  The files that are left are sorted again whenever the priority
+            changes, e.g. a take was circled.  With a window items is read as files are taken
+            and only the next window of them is ordered, so a long listing does not have to
+            finish before the first download """
+        if items is None:
+            items = enumerate(self.files)
+        items = iter(items)
+        version = self.priority.version
+        heap = []
+        listing = True
+        while True:
+            while listing and (window is None or len(heap) < window):
+                try:
+                    i, f = next(items)
+                except StopIteration:
+                    listing = False
+                    break
+                heapq.heappush(heap, (self.priority_key(f), i, f))
+
+            if not heap:
+                return
+
+            if version != self.priority.version:
+                version = self.priority.version
+                heap = [(self.priority_key(f), i, f) for _, i, f in heap]
+                heapq.heapify(heap)
+            _, i, file_item = heapq.heappop(heap)
+            yield i, file_item
+
+    def download_files(self, fetch=None, source=None):
+        """ Download self.files, worker_count at a time, using fetch(file_item, local_path)
+            which defaults to fetch_file().  If source is given the files are taken from it
+            instead and added to self.files as they arrive.  Files are handed out one at a
+            time as workers become free, in priority order if set_priority() was called.  A
+            source is ordered PRIORITY_WINDOW files at a time, so a device that lists its
+            files slowly (e.g. a crawl) starts downloading early. """
+        if fetch is None:
+            fetch = self.fetch_file
+
+        def streamed():
+            for each in source:
+                with self.counter_lock:
+                    self.files.append(each)
+                    index = len(self.files) - 1
+                yield index, each
+
+        if source is not None:
+            items = streamed()
+            if self.priority is not None:
+                items = self.prioritised(items, self.PRIORITY_WINDOW)
+        elif self.priority is not None:
+            items = self.prioritised()
+        else:
+            items = enumerate(self.files)
+
+        self.file_progress = True
+        try:
+            if self.worker_count <= 1:
+                for i, file_item in items:
+                    if not self.is_running():
+                        break
+                    self.download_file(i, file_item, fetch)
+            else:
+                free = threading.Semaphore(self.worker_count)
+
+                def work(index, file_item):
+                    try:
+                        self.download_file(index, file_item, fetch)
+                    finally:
+                        free.release()
+
+                with ThreadPoolExecutor(max_workers=self.worker_count) as pool:
+                    for i, file_item in items:
+                        free.acquire()
+                        if not self.is_running():
+                            break
+                        pool.submit(work, i, file_item)
+        finally:
+            self.file_progress = False
+
+        self.set_current(len(self.files))
+
+    def download_file(self, index, file_item, fetch):
+        """ Download one file for download_files(), doing the ok/fail/skip accounting """
+        if not self.is_running():
+            return
+
+        name = self.file_display_name(file_item)
+
+        with self.counter_lock:
+            self.current_index = index
+            self.in_flight.append(file_item)
+
+        try:
+            local_path = self.ledger_path(file_item)
+            from_ledger = local_path is not None
+            if from_ledger:
+                ret = self.COPY_SKIP
+            else:
+                local_path = self.local_path(file_item.local_file, file_item.status)
+                local_dir = os.path.dirname(local_path)
+                if not os.path.isdir(local_dir):
+                    os.makedirs(local_dir, exist_ok=True)
+
+                ret = fetch(file_item, local_path)
+
+        except DeferredFile:
+            pass
+
+        except Exception as e:
+            file_item.error = str(e)
+            self.file_fail(name, str(e))
+
+        else:
+            if not from_ledger:
+                self.ledger_record(file_item, local_path)
+            self.manifest_add(file_item, local_path, ret == self.COPY_SKIP)
+            file_item.complete = True
+            if ret == self.COPY_SKIP:
+                self.file_skip(name)
+            else:
+                self.file_ok(name)
+                self.file_saved.emit(local_path)
+
+        finally:
+            with self.counter_lock:
+                self.in_flight.remove(file_item)
 
     def log(self, message):
         self.message.emit(message)
@@ -860,12 +1362,18 @@ class DownloadThread(QtCore.QObject):
 
     def set_finished(self):
         """ Status update when downloading has finished """
+        self.write_manifest()
+        self.finished_time = time.monotonic()
+        self.planned_time = None
         self.file_reset()
         self.status = self.STATUS_FINISHED
         self.all_done.emit()
 
     def set_started(self):
         """ Status update when downloading starts """
+        self.meter.reset()
+        self.started_time = time.monotonic()
+        self.finished_time = None
         self.status = self.STATUS_RUNNING
 
     def current_file(self):
@@ -881,29 +1389,35 @@ class DownloadThread(QtCore.QObject):
         self.current_index = index
 
     def file_ok(self, name):
-        self.okay_count += 1
-        self.file_reset()
+        with self.counter_lock:
+            self.okay_count += 1
+            self.file_reset()
         self.file_done.emit(name, self.COPY_OK, None)
 
     def file_fail(self, name, err):
-        self.file_reset()
+        with self.counter_lock:
+            self.file_reset()
         self.file_done.emit(name, self.COPY_FAIL, err)
 
     def file_skip(self, name):
-        self.okay_count += 1
-        self.file_reset()
+        with self.counter_lock:
+            self.okay_count += 1
+            self.file_reset()
         self.file_done.emit(name, self.COPY_SKIP, None)
 
     def file_reset(self):
-        self.last_size = None
+        if self.file_progress:
+            # Progress is tracked per file, other files may still be in flight
+            return
         self.file_size = 0
         self.current_size = 0
 
     def is_running(self):
-        return self.status is self.STATUS_RUNNING
+        return self.status is self.STATUS_RUNNING or self.planning
 
     def set_match_mode(self, match_mode):
         self.match_mode = match_mode
+        self.take_matcher = None
 
     def set_download_mode(self, mode, status=None):
         """
@@ -915,6 +1429,7 @@ class DownloadThread(QtCore.QObject):
         self.download_mode = mode
         self.download_status = status
         self.valid_takes = None
+        self.take_matcher = None
 
         if mode.startswith("Matching"):
             self.valid_takes = cmd.takes()
@@ -941,41 +1456,20 @@ class DownloadThread(QtCore.QObject):
         """
 
         if self.download_mode == "All":
-            print("Adding (all files): " + str(take_file_name))
             return True
 
-        if not self.valid_takes:
-            print("no takes")
-            return False
+        return self.match_take(take_file_name) is not None
 
-        fixed_file_name = file_util.fix_name(take_file_name)
+    def match_take(self, take_file_name):
+        """ Returns the take in valid_takes the file belongs to for the match mode, or None """
 
-        # For each take name considered for downloading
-        for each_take in self.valid_takes:
-
-            # Check if the take name has formatting applied
-            if self.formatting:
-                formatted_take = file_util.fix_name(self.formatting.format_take(each_take))
-            else:
-                formatted_take = file_util.fix_name(each_take)
-
-            if self.match_mode == "Exact":
-                # Exact name match
-                if formatted_take == fixed_file_name:
-                    print("Adding (exact): " + str(take_file_name))
-                    return True
-
-            if self.match_mode == "Starts With":
-                if fixed_file_name.startswith(formatted_take):
-                    print("Adding (starts with / formatted): " + str(take_file_name))
-                    return True
+        if not self.valid_takes:
+            return None
 
-            if self.match_mode == "Contains":
-                if fixed_file_name in formatted_take:
-                    print("Adding (contains): " + str(take_file_name))
-                    return True
+        if self.take_matcher is None:
+            self.take_matcher = TakeMatcher(self.valid_takes, self.match_mode, self.formatting)
 
-        return False
+        return self.take_matcher.match(take_file_name)
 
     def set_create_selects_folders(self, value):
         """ Create folders for take status, A/B/O etc """
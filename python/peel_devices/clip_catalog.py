@@ -0,0 +1,66 @@
+import os.path
+from peel import file_util
+
+
+def clip_key(name):
+    """ Normalised key for a clip file name - no folder or extension, case and separators ignored """
+    name = os.path.basename(name.replace("\\", "/"))
+    return file_util.fix_name(os.path.splitext(name)[0])
+
+
+class ClipCatalog:
+    """ Cached clip list for a playback device, so a take can be found without fetching
+        and parsing the full clip list from the device every time.
+
+        Clips are kept in device order and looked up by normalised name.  With prefixes
+        enabled a clip is also found by the leading parts of its name split on '_', so
+        take_01 finds take_01_1.mov and take_01_2.mov (e.g. Ki Pro quad / split files).
+
+        The device should call invalidate() whenever the clips may have changed (record,
+        stop, media change), the next lookup will then reload the list.
+    """
+
+    def __init__(self, prefixes=False):
+        self.prefixes = prefixes
+        self.names = []
+        self.values = []
+        self.by_key = {}
+        self.by_name = {}
+        self.valid = False
+
+    def __len__(self):
+        return len(self.names)
+
+    def invalidate(self):
+        self.valid = False
+
+    def load(self, clips):
+        """ Replace the catalog with an iterable of (clip name, value) in device order """
+        self.names = []
+        self.values = []
+        self.by_key = {}
+        self.by_name = {}
+
+        for name, value in clips:
+            index = len(self.names)
+            self.names.append(name)
+            self.values.append(value)
+            self.by_name.setdefault(name, index)
+
+            key = clip_key(name)
+            self.by_key.setdefault(key, []).append(index)
+
+            if self.prefixes:
+                parts = key.split("_")
+                for i in range(1, len(parts)):
+                    self.by_key.setdefault("_".join(parts[:i]), []).append(index)
+
+        self.valid = True
+
+    def find(self, take):
+        """ Returns the indexes of the clips for a take name, in device order """
+        return self.by_key.get(file_util.fix_name(take), [])
+
+    def position(self, name):
+        """ Index of a clip by its exact name as reported by the device, or None """
+        return self.by_name.get(name)
@@ -0,0 +1,99 @@
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+WORKERS = 4
+RETRIES = 2
+RETRY_DELAY = 0.5
+
+_DONE = object()
+
+
+class DirectoryCrawler:
+    """ Walks a remote directory tree, listing up to workers directories at once.
+
+        list_dir(path) returns (directories, files) for one directory, where directories are
+        paths to pass back to list_dir() and files are whatever the caller wants collected,
+        usually FileItems.  A directory that fails to list is retried a few times and then
+        skipped so one bad folder does not stop the harvest.
+
+        crawl() yields the files as they are found so downloading can start while the rest
+        of the tree is still being listed.  For http devices list_dir() should use the
+        HttpClient so the listing shares the device's pooled keep-alive connections.
+    """
+
+    def __init__(self, list_dir, workers=WORKERS, retries=RETRIES, is_running=None):
+        self.list_dir = list_dir
+        self.workers = max(1, workers)
+        self.retries = retries
+        self.is_running = is_running
+        self.failed = []  # directories that could not be listed
+
+    def running(self):
+        return self.is_running is None or self.is_running()
+
+    def list_with_retry(self, path):
+        attempt = 0
+        while True:
+            try:
+                return self.list_dir(path)
+            except Exception as e:
+                attempt += 1
+                if attempt > self.retries or not self.running():
+                    raise
+                print(f"Retrying listing {path}: {e}")
+                time.sleep(RETRY_DELAY * attempt)
+
+    def crawl(self, roots):
+        """ Generator of the files under roots, in the order they are found """
+
+        found = queue.Queue()
+        lock = threading.Lock()
+        pending = [1]  # held until all the roots are queued
+        stopped = threading.Event()
+        pool = ThreadPoolExecutor(max_workers=self.workers)
+
+        def submit(path):
+            with lock:
+                pending[0] += 1
+            pool.submit(visit, path)
+
+        def visit(path):
+            try:
+                if stopped.is_set() or not self.running():
+                    return
+                directories, files = self.list_with_retry(path)
+                for each in files:
+                    found.put(each)
+                # Children are queued before this directory is counted as done
+                for each in directories:
+                    submit(each)
+            except Exception as e:
+                print(f"Could not list {path}: {e}")
+                self.failed.append(path)
+            finally:
+                release()
+
+        def release():
+            with lock:
+                pending[0] -= 1
+                done = pending[0] == 0
+            if done:
+                found.put(_DONE)
+
+        try:
+            for root in roots:
+                submit(root)
+            release()
+
+            while True:
+                item = found.get()
+                if item is _DONE:
+                    break
+                yield item
+
+        finally:
+            stopped.set()
+            pool.shutdown(wait=True, cancel_futures=True)
@@ -24,10 +24,10 @@
 
 from PeelApp import cmd
 from PySide6 import QtWidgets
-import urllib.parse, urllib.request
 import re
 import os.path
-from peel_devices import PeelDeviceBase, SimpleDeviceWidget, DownloadThread, FileItem
+from peel_devices import PeelDeviceBase, SimpleDeviceWidget, DownloadThread, FileItem, RttEstimator
+from peel_devices.http_client import HttpClient
 import json
 import re
 
@@ -80,6 +80,8 @@ class Disguise(PeelDeviceBase):
         self.prefix_device_name = False
         self.currentShotName = None
         self.currentTake = 0
+        self.rtt = RttEstimator(initial=1.0, minimum=RttEstimator.LAN_MINIMUM)
+        self.http = HttpClient(self.host, rtt=self.rtt)
 
     @staticmethod
     def device():
@@ -93,6 +95,7 @@ class Disguise(PeelDeviceBase):
     def reconfigure(self, name, **kwargs):
         self.name = name
         self.host = kwargs.get("host", None)
+        self.http.set_host(self.host)
         self.prefix_device_name = kwargs.get("prefix_device_name", False)
         return True
 
@@ -123,7 +126,11 @@ class Disguise(PeelDeviceBase):
 
     def command(self, command, arg):
 
-        if command in ['set_data_directory', "takeNumber", "takeName", 'recording-ok']:
+        if command == "takeName":
+            self.http.warm("shotrecorder/recorders")
+            return
+
+        if command in ['set_data_directory', "takeNumber", 'recording-ok']:
             return
 
         if command in ["shotName"]:
@@ -150,8 +157,7 @@ class Disguise(PeelDeviceBase):
         if self.recording:
             return
         try:
-            url = "http://" + self.host + "/shotrecorder/record"
-            cmd.writeLog(url + "\n")
+            cmd.writeLog(self.http.url("shotrecorder/record") + "\n")
             data = json.dumps({
                 "engage": True,
                 "name": "peelcapture",
@@ -159,14 +165,10 @@ class Disguise(PeelDeviceBase):
                 "take": take
                 })
             data = data.encode('utf-8')
-            req = urllib.request.Request(url, data=data)
-            f = urllib.request.urlopen(req, timeout=1, method="POST")
-            resp = json.load(f.read())
+            resp = self.http.post("shotrecorder/record", data=data).json()
             if resp['success']:
-                url = "http://" + self.host + "/shotrecorder/recorders"
-                cmd.writeLog(url + "\n")
-                f = urllib.request.urlopen(url, timeout=1)
-                resp = json.load(f.read())
+                cmd.writeLog(self.http.url("shotrecorder/recorders") + "\n")
+                resp = self.http.get("shotrecorder/recorders").json()
                 for i in resp['recorders']:
                     if i['name'] == "peelcapture" and i['enagaged']:
                         return True
@@ -180,8 +182,7 @@ class Disguise(PeelDeviceBase):
             return
 
         try:
-            url = "http://" + self.host + "/shotrecorder/record"
-            cmd.writeLog(url + "\n")
+            cmd.writeLog(self.http.url("shotrecorder/record") + "\n")
             data = json.dumps({
                 "engage": False,
                 "name": "peelcapture",
@@ -189,14 +190,10 @@ class Disguise(PeelDeviceBase):
                 "take": take
                 })
             data = data.encode('utf-8')
-            req =  urllib.request.Request(url, data=data)
-            f = urllib.request.urlopen(req, timeout=1, method="POST")
-            resp = json.load(f.read())
+            resp = self.http.post("shotrecorder/record", data=data).json()
             if resp['success']:
-                url = "http://" + self.host + "/shotrecorder/recorders"
-                cmd.writeLog(url + "\n")
-                f = urllib.request.urlopen(url, timeout=1)
-                resp = json.load(f.read())
+                cmd.writeLog(self.http.url("shotrecorder/recorders") + "\n")
+                resp = self.http.get("shotrecorder/recorders").json()
                 for i in resp['recorders']:
                     if i['name'] == "peelcapture" and not i['enagaged']:
                         return True
@@ -210,7 +207,7 @@ class Disguise(PeelDeviceBase):
         return DisguiseDialog
 
     def connect_device(self):
-        pass
+        self.http.warm("shotrecorder/recorders")
 
     def list_takes(self):
         return []
@@ -89,9 +89,11 @@
 """
 
 from pythonosc import dispatcher, osc_server, udp_client
-from peel_devices import PeelDeviceBase, DownloadThread, FileItem, BaseDeviceWidget
+from peel_devices import PeelDeviceBase, DownloadThread, FileItem, BaseDeviceWidget, RttEstimator, integrity
+from peel_devices import transfer
 from PySide6 import QtWidgets, QtCore
-import threading, socket, struct
+import threading, socket, struct, time
+import queue
 import os
 import os.path
 import array
@@ -159,7 +161,8 @@ class AddWidget(BaseDeviceWidget):
 
         self.listen_port = QtWidgets.QLineEdit()
         self.listen_port.setText(settings.value("EpicPhoneListenPort", "6000"))
-        self.listen_port.setToolTip("Port to listen on PC, may need to be open on the firewall")
+        self.listen_port.setToolTip(f"Port to listen on PC, may need to be open on the firewall.  The harvest also "
+                                    f"listens on this port and the next {IPhoneDownloadThread.WINDOW - 1} (tcp)")
         form_layout.addRow("Listen Port", self.listen_port)
 
         self.format = QtWidgets.QLineEdit("Format")
@@ -240,8 +243,12 @@ class EpicIPhone(PeelDeviceBase):
         self.current_take = None
         self.current_name = None
         self.query = None
+        self.query_sent = None
         self.dispatcher = None
 
+        # Phones are on wifi, start relaxed and never go below the old fixed timeout
+        self.rtt = RttEstimator(initial=1.0, minimum=1.0, maximum=15.0)
+
     @staticmethod
     def device():
         return "epic-iphone"
@@ -351,6 +358,10 @@ class EpicIPhone(PeelDeviceBase):
 
         self.got_response = True
 
+        if command in ("/Battery", "/Thermals") and self.query_sent is not None:
+            self.rtt.add_sample(time.monotonic() - self.query_sent)
+            self.query_sent = None
+
         if command == "/OSCSetSendTargetConfirm":
             self.state = "ONLINE"
             self.push_state()
@@ -428,6 +439,7 @@ class EpicIPhone(PeelDeviceBase):
         self.got_response = False
 
         # Alternate query
+        self.query_sent = time.monotonic()
         if self.query != "Battery":
             self.client.send_message('/BatteryQuery', 1)
             self.query = "Battery"
@@ -479,36 +491,74 @@ class EpicIPhone(PeelDeviceBase):
 
 class IPhoneDownloadThread(DownloadThread):
 
+    """ Requests files from the phone with /Transport, the phone connects back to us and
+        sends the file.  Up to WINDOW requests are outstanding at once so the phone always
+        has the next file to send.  Each request gets its own listening port (listen_port,
+        listen_port + 1 ... listen_port + WINDOW - 1) so every connection is matched to the
+        file it was asked for.  The ports are held from when the worker is made until the
+        download finishes. """
+
+    WINDOW = 3
+
     def __init__(self, phone, directory, listen_port=8444):
         super(IPhoneDownloadThread, self).__init__(directory)
         self.phone = phone
         self.listen_port = listen_port
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.socket.settimeout(1)
+        self.write_behind = True
+        self.sockets = []
+        self.listeners = queue.Queue()
+
+        for port in range(listen_port, listen_port + self.WINDOW):
+            try:
+                self.sockets.append((self.make_socket(phone.listen_ip, port), port))
+            except OSError as e:
+                if port == listen_port:
+                    cmd.writeLog(f"{self} could not listen on port {port}: {e}\n")
+                    self.close_sockets()
+                    raise
+                cmd.writeLog(f"{self} could not listen on port {port}, fewer files will be requested at once: {e}\n")
+                break
+
+    @staticmethod
+    def make_socket(ip, port):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.settimeout(1)
+
+        # Set before listen() so accepted connections get the large window
+        transfer.tune_socket(sock)
 
         # Allow immediate reuse of the address after close
-        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         try:
-            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         except AttributeError:
             # Not all platforms support SO_REUSEPORT
             pass
 
-        self.socket.bind((phone.listen_ip, self.listen_port))
+        try:
+            sock.bind((ip, port))
+        except OSError:
+            sock.close()
+            raise
+
+        return sock
 
     def __str__(self):
         return str(self.phone) + " Downloader"
 
+    def close_sockets(self):
+        for sock, _ in self.sockets:
+            sock.close()
+        self.sockets = []
+
     def teardown(self):
-        if self.socket:
-            self.socket.close()
+        self.close_sockets()
         super(IPhoneDownloadThread, self).teardown()
 
-    def process(self):
+    def list_files(self):
+        """ Work out the files on the phone for the takes being harvested """
 
-        print("Iphone Process Started")
-        self.create_local_dir()
-        self.set_started()
+        self.files = []
 
         # get the generic form for the take name, in case we need to guess the filename later
         args_format = self.phone.generic_take_name()
@@ -517,7 +567,7 @@ class IPhoneDownloadThread(DownloadThread):
             cmd.writeLog("File template: {args_format}")
 
         # for each take consider for downloading
-        for take in self.valid_takes:
+        for take in self.valid_takes or []:
 
             take_file = self.phone.format_take(take)
 
@@ -575,86 +625,115 @@ class IPhoneDownloadThread(DownloadThread):
                 self.add_file(csv, take_file + ".csv", take)
                 self.add_file(mov, take_file + ".mov", take)
 
-        my_address = f"{self.phone.listen_ip}:{self.listen_port}"
+        return self.files
+
+    def process(self):
+
+        print("Iphone Process Started")
+        self.create_local_dir()
+        self.set_started()
+
+        if not self.has_plan():
+            self.list_files()
 
-        self.log(f"Downloading {len(self.files)} iphone files for {len(self.valid_takes)} takes")
+        self.log(f"Downloading {len(self.files)} iphone files for {len(self.valid_takes or [])} takes")
 
         try:
-            self.socket.listen()
+            for sock, port in self.sockets:
+                sock.listen()
+                self.listeners.put((sock, port))
 
-            for i, this_file in enumerate(self.files):
+            self.worker_count = self.listeners.qsize()
+            self.download_files(self.fetch_phone_file)
 
-                if not self.is_running():
-                    break
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            self.log("Exception:\n" + traceback.format_exc())
 
-                self.set_current(i)
+        finally:
+            # Free the ports for the next harvest, the worker may be kept around after it finishes
+            self.close_sockets()
 
-                this_name = f"{self.phone.name}:{this_file.local_file}"
+        print("Iphone finished")
+        self.set_finished()
 
-                # Skip existing
-                full_path = self.local_path(this_file.local_file, this_file.status)
+    def file_display_name(self, file_item):
+        return f"{self.phone.name}:{file_item.local_file}"
 
-                if os.path.isfile(full_path):
-                    self.file_skip(this_name)
-                    continue
+    def fetch_phone_file(self, this_file, full_path):
+        """ Ask the phone for a file on a free port and receive it, for download_files() """
 
-                out_dir = os.path.dirname(full_path)
-                if not os.path.isdir(out_dir):
-                    try:
-                        os.makedirs(out_dir)
-                    except OSError as e:
-                        self.file_fail(this_name, "Could not create directory")
-                        continue
+        if os.path.isfile(full_path):
+            return self.COPY_SKIP
 
-                # Tell the iphone we want it to send us a file
-                print(f"Iphone getting: {this_file.remote_file}")
-                self.phone.client.send_message("/Transport", (my_address, this_file.remote_file))
-                self.current_size = 0
+        sock, port = self.listeners.get()
+        try:
+            # Tell the iphone we want it to send us a file
+            print(f"Iphone getting: {this_file.remote_file}")
+            self.phone.client.send_message("/Transport", (f"{self.phone.listen_ip}:{port}", this_file.remote_file))
 
-                try:
-                    # Wait for the connection from the phone sending the file
-                    conn, addr = self.socket.accept()
-                except socket.timeout:
-                    self.log("No response for file: " + this_file.remote_file)
-                    self.file_fail(this_name, "Timeout")
-                    conn = None
+            try:
+                conn = self.accept(sock)
+            except IOError:
+                # Don't let a late connection for this file be taken as the next one on the port
+                sock = self.reopen(sock, port)
+                raise
 
-                if conn:
-                    try:
-                        conn.settimeout(1)
-                        linger = array.array("i", [1, 0])
-                        conn.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, linger)
+            try:
+                conn.settimeout(self.phone.rtt.timeout())
+                linger = array.array("i", [1, 0])
+                conn.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, linger)
 
-                        # Get the file
-                        with open(full_path, "wb") as local_fp:
-                            self.read(conn, this_file, local_fp)
+                # Get the file
+                self.read(conn, this_file, full_path)
 
-                        if this_file.complete == self.COPY_OK:
-                            self.file_ok(this_name)
-                        elif this_file.complete == self.COPY_FAIL:
-                            self.file_fail(this_name, this_file.error)
+            finally:
+                conn.close()
 
-                        if this_file.complete != self.COPY_OK:
-                            if os.path.exists(full_path):
-                                os.unlink(full_path)
+        finally:
+            self.listeners.put((sock, port))
 
-                    finally:
-                        conn.close()
+        if this_file.complete != self.COPY_OK:
+            if os.path.exists(full_path):
+                os.unlink(full_path)
+            raise IOError(this_file.error)
 
-            else:
-                self.set_current(len(self.files))
+        return self.COPY_OK
 
-        except Exception as e:
-            import traceback
-            traceback.print_exc()
-            self.log("Exception:\n" + traceback.format_exc())
+    def reopen(self, sock, port):
+        sock.close()
+        new_sock = self.make_socket(self.phone.listen_ip, port)
+        new_sock.listen()
+        self.sockets = [(new_sock if s is sock else s, p) for s, p in self.sockets]
+        return new_sock
 
-        print("Iphone finished")
-        self.set_finished()
+    def accept(self, sock):
+        """ Wait for the phone to connect.  Other requests may be ahead of this one, so only
+            give up once nothing has arrived on any connection for the rtt timeout """
+        sock.settimeout(0.25)
+        last_total = self.bytes_total
+        last_change = time.monotonic()
+
+        while True:
+            try:
+                conn, addr = sock.accept()
+                return conn
+            except socket.timeout:
+                pass
 
-    def read(self, conn, this_file, fp):
+            if not self.is_running():
+                raise IOError("Stopped")
 
-        buffer_size = 1024 * 1024
+            now = time.monotonic()
+            if self.bytes_total != last_total:
+                last_total = self.bytes_total
+                last_change = now
+            elif now - last_change > self.phone.rtt.timeout():
+                self.phone.rtt.add_timeout()
+                raise IOError("Timeout, no response from the phone")
+
+    def read(self, conn, this_file, full_path):
 
         # IOS device has connected, get the file
 
@@ -675,23 +754,23 @@ class IPhoneDownloadThread(DownloadThread):
                 this_file.error = "Zero sized file"
                 return
 
-            while self.is_running():
+            digest = integrity.new_hash()
 
+            def readinto(buffer):
                 try:
-                    data = conn.recv(buffer_size)
+                    return conn.recv_into(buffer)
                 except socket.timeout:
-                    break
-
-                if not data:
-                    break
+                    return 0
 
-                fp.write(data)
-                this_file.data_size += len(data)
-                self.add_bytes(len(data))
+            with transfer.FileSink(self, this_file, full_path, size=this_file.file_size, digest=digest,
+                                   write_behind=self.write_behind) as sink:
+                if self.is_running():
+                    sink.fill(readinto, this_file.file_size)
 
             if this_file.data_size != this_file.file_size:
                 this_file.error = "Incomplete data"
             else:
+                this_file.hash = digest.hexdigest()
                 this_file.complete = self.COPY_OK
 
         except Exception as e:
@@ -22,9 +22,10 @@
 # CONTRACT, TORT (INCLUDING NEGLIGENCE), OR OTHERWISE, REGARDLESS OF WHETHER SUCH DAMAGES WERE FORESEEABLE AND WHETHER
 # OR NOT THE LICENSOR WAS ADVISED OF THE POSSIBILITY OF SUCH DAMAGES.
 
-from peel_devices import SimpleDeviceWidget, PeelDeviceBase, DownloadThread, FileItem
+from peel_devices import SimpleDeviceWidget, PeelDeviceBase, DownloadThread, FileItem, RttEstimator, transfer
+from peel_devices.http_client import HttpClient
+from peel_devices.crawler import DirectoryCrawler
 from PySide6 import QtWidgets, QtCore
-import requests
 from requests.exceptions import ConnectionError, HTTPError
 import json
 import os
@@ -42,6 +43,8 @@ class FaceformCapture(PeelDeviceBase):
         self.actor = "Actor"
         self.json_args = None
         self.takes = []
+        self.rtt = RttEstimator(initial=2.0)
+        self.http = HttpClient(self.host, self.port, rtt=self.rtt)
 
     def as_dict(self):
         return {'name': self.name,
@@ -56,6 +59,7 @@ class FaceformCapture(PeelDeviceBase):
         self.port = kwargs.get('port')
         self.project = kwargs.get('project')
         self.actor = kwargs.get('actor')
+        self.http.set_host(self.host, self.port)
 
         return True
 
@@ -114,13 +118,9 @@ class FaceformCapture(PeelDeviceBase):
     def execute(self, method: str, command: str, args: json = None) -> json:
         try:
             if method == "GET":
-                response = requests.get(self.get_url(self.host, self.port, command),
-                                        json=args,
-                                        timeout=2)
+                response = self.http.get(self.get_url(self.host, self.port, command), json=args)
             elif method == "PUT":
-                response = requests.put(self.get_url(self.host, self.port, command),
-                                        json=args,
-                                        timeout=2)
+                response = self.http.put(self.get_url(self.host, self.port, command), json=args)
             else:
                 return None
 
@@ -215,73 +215,48 @@ class CaptureDownloadThread(DownloadThread):
         super(CaptureDownloadThread, self).__init__(directory)
         self.capture = capture
         self.takes = takes
+        # The recordings are served on the default http port rather than the api port
+        self.http = HttpClient(capture.host, rtt=capture.rtt)
+        self.worker_count = 4
 
     def __str__(self):
         return str(self.capture) + " Downloader"
 
+    def file_display_name(self, file_item):
+        return str(self.capture) + ": " + file_item.local_file
+
     def process(self):
-        self.set_started()
         self.log("Downloading files from " + str(self.capture))
+        super().process()
 
-        try:
-            self.enlist_files()
-        except Exception as e:
-            self.log("Error: " + str(e))
-            self.set_finished()
-            return
-
-        self.create_local_dir()
-
-        for file_index, file in enumerate(self.files):
-            self.set_current(file_index)
-
-            this_file = str(self.capture) + ": " + file.local_file
-
-            local_path = self.local_path(file.local_file)
-
-            try:
-                local_dir = os.path.dirname(local_path)
-                if not os.path.isdir(local_dir):
-                    os.makedirs(local_dir)
+    def list_files(self):
+        return list(self.iter_files())
 
-                response = requests.get(file.remote_file, stream=True)
-                with open(local_path, 'wb') as f:
-                    for chunk in response.iter_content(chunk_size=1048576):
-                        f.write(chunk)
+    def iter_files(self):
+        locations = [take.get("location", "") for take in self.takes]
+        crawler = DirectoryCrawler(self.list_dir, is_running=self.is_running)
+        return crawler.crawl(locations)
 
-                self.file_ok(this_file)
+    def fetch_file(self, file_item, local_path):
+        return transfer.fetch_http(self, self.http, file_item.remote_file, file_item, local_path,
+                                   existing="overwrite", timeout=(self.http.get_timeout(), 10))
 
-            except Exception as e:
-                self.file_fail(this_file, str(e))
-        else:
-            self.set_current(len(self.files))
-
-        self.set_finished()
-
-    def enlist_files(self):
-        self.files = []
+    def list_dir(self, file_path):
+        """ Sub directories and files to download in a take location, for the crawler """
         http_address = f"http://{self.capture.host}/records/"
-        for take in self.takes:
-            location = take.get("location", "")
-            files_relative = CaptureDownloadThread.scan_take_location(http_address, location)
-
-            for file in files_relative:
+        response = self.http.get(os.path.join(http_address, file_path), timeout=(self.http.get_timeout(), 10))
+        response.raise_for_status()
 
-                name = os.path.splitext(file)[0]
-                if not self.download_take_check(name):
-                    continue
-
-                self.files.append(FileItem(os.path.join(http_address, file), file))
-
-    @staticmethod
-    def scan_take_location(http_address, file_path):
+        directories = []
         files = []
-        response = requests.get(os.path.join(http_address, file_path), timeout=1).json()
-        for file in response:
+        for file in response.json():
             file_type = file.get("type", "")
             new_file_path = os.path.join(file_path, file.get("name", ""))
             if file_type == "file":
-                files.append(new_file_path.replace("\\", "/"))
+                relative = new_file_path.replace("\\", "/")
+                if self.download_take_check(os.path.splitext(relative)[0]):
+                    files.append(FileItem(os.path.join(http_address, relative), relative))
             elif file_type == "directory":
-                files += CaptureDownloadThread.scan_take_location(http_address, new_file_path)
-        return files
+                directories.append(new_file_path)
+
+        return directories, files
@@ -0,0 +1,81 @@
+from PeelApp import cmd
+import threading
+
+
+# Harvest orders for the ui, the keys used in turn to sort the files
+ORDERS = {
+    "Device Order": (),
+    "Selects First": ("select", "recent", "size"),
+    "Newest First": ("recent", "select", "size"),
+    "Smallest First": ("size", "select", "recent"),
+}
+
+
+class HarvestPriority:
+    """ Decides which files to download first, shared by all the devices in a harvest.
+
+        Files are sorted by each of keys in turn:
+            select - the take's select status, in the order of cmd.selectModes() so circled
+                     takes come first and takes without a status last
+            recent - the most recently recorded takes first
+            size   - smaller files first, so more takes arrive sooner
+
+        Select statuses can change during the harvest.  refresh() asks the app again and
+        bumps version if anything changed, the download threads then sort the files they
+        have left (see DownloadThread.prioritised) and the scheduler picks the device with
+        the most important file next.  refresh() is called from the ui thread, key() from
+        the download threads.
+    """
+
+    def __init__(self, keys):
+        self.keys = tuple(keys)
+        self.version = 0
+        self.lock = threading.Lock()
+        self.modes = []
+        self.recency = {}  # take -> position in the take list
+        self.status = {}  # take -> select status, for the takes seen so far
+        self.refresh()
+
+    def refresh(self):
+        """ Get the select statuses and take order from the app, returns True if they changed """
+        modes = list(cmd.selectModes())
+        takes = cmd.takes() or []
+        recency = {take: i for i, take in enumerate(takes)}
+
+        with self.lock:
+            known = list(self.status)
+        status = {take: cmd.selectStatusForTake(take) for take in known}
+
+        with self.lock:
+            changed = modes != self.modes or recency != self.recency \
+                or any(self.status.get(take) != value for take, value in status.items())
+            self.modes = modes
+            self.recency = recency
+            self.status.update(status)
+            if changed:
+                self.version += 1
+
+        return changed
+
+    def take_status(self, take):
+        with self.lock:
+            if take in self.status:
+                return self.status[take]
+
+        value = cmd.selectStatusForTake(take)
+        with self.lock:
+            self.status[take] = value
+        return value
+
+    def key(self, take, file_item):
+        """ Sort key for a file of a take, lower downloads first """
+        ret = []
+        for each in self.keys:
+            if each == "select":
+                status = self.take_status(take)
+                ret.append(self.modes.index(status) if status in self.modes else len(self.modes))
+            elif each == "recent":
+                ret.append(-self.recency.get(take, -1))
+            elif each == "size":
+                ret.append(file_item.file_size if file_item.file_size is not None else float("inf"))
+        return tuple(ret)
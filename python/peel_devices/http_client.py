@@ -0,0 +1,132 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+import socket
+import threading
+import time
+
+
+DEFAULT_TIMEOUT = 2
+POOL_SIZE = 8
+RECV_BUFFER = 4 * 1048576
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+class _Adapter(HTTPAdapter):
+    """ Asks for a large socket receive buffer so downloads are not held up by the reader """
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["socket_options"] = HTTPConnection.default_socket_options + [
+            (socket.SOL_SOCKET, socket.SO_RCVBUF, RECV_BUFFER)]
+        super().init_poolmanager(*args, **kwargs)
+
+
+def session(host):
+    """ Returns the shared keep-alive session for a host, creating it on first use.
+        Each host gets its own connection pool so a busy device does not hold up the others. """
+    with _sessions_lock:
+        ret = _sessions.get(host)
+        if ret is None:
+            ret = requests.Session()
+            adapter = _Adapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+            ret.mount("http://", adapter)
+            ret.mount("https://", adapter)
+            _sessions[host] = ret
+        return ret
+
+
+def close_all():
+    """ Close all the pooled connections, e.g. when the app is shutting down """
+    with _sessions_lock:
+        for each in _sessions.values():
+            each.close()
+        _sessions.clear()
+
+
+class HttpClient:
+
+    """ Makes http requests to a single device using the shared per-host connection pool.
+        Connections are kept alive between calls so commands do not pay for a tcp connect
+        (and dns lookup) each time.  Paths are relative to http://host:port/ unless a full
+        url is given.
+        If an rtt estimator is given (see PeelDeviceBase.rtt) each request adds a sample to
+        it and the default timeout comes from the estimate instead of the fixed value.
+    """
+
+    def __init__(self, host=None, port=None, timeout=DEFAULT_TIMEOUT, rtt=None):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.rtt = rtt
+
+    def set_host(self, host, port=None):
+        self.host = host
+        self.port = port
+
+    def netloc(self):
+        if self.port is None:
+            return str(self.host)
+        return f"{self.host}:{self.port}"
+
+    def url(self, path=""):
+        if path.startswith("http://") or path.startswith("https://"):
+            return path
+        return f"http://{self.netloc()}/{path.lstrip('/')}"
+
+    def get_timeout(self):
+        if self.rtt is None:
+            return self.timeout
+        return self.rtt.timeout()
+
+    def request(self, method, path="", timeout=None, **kwargs):
+        if timeout is None:
+            timeout = self.get_timeout()
+
+        start = time.monotonic()
+        try:
+            response = session(self.netloc()).request(method, self.url(path), timeout=timeout, **kwargs)
+        except requests.Timeout:
+            if self.rtt is not None:
+                self.rtt.add_timeout()
+            raise
+
+        if self.rtt is not None:
+            if kwargs.get("stream"):
+                # Time to the headers, the body has not been read yet
+                self.rtt.add_sample(response.elapsed.total_seconds())
+            else:
+                self.rtt.add_sample(time.monotonic() - start)
+
+        return response
+
+    def get(self, path="", **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def put(self, path="", **kwargs):
+        return self.request("PUT", path, **kwargs)
+
+    def post(self, path="", **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def head(self, path="", **kwargs):
+        return self.request("HEAD", path, **kwargs)
+
+    def warm(self, path="", background=True):
+        """ Open a connection to the device ahead of time, e.g. before recording, so the
+            first command goes out on an already connected socket """
+
+        def do_warm():
+            try:
+                self.head(path).close()
+            except requests.RequestException:
+                pass
+
+        if not self.host:
+            return
+
+        if background:
+            threading.Thread(target=do_warm, daemon=True).start()
+        else:
+            do_warm()
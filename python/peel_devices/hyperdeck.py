@@ -171,13 +171,17 @@ Multiline only commands:
 
 """
 from PeelApp import cmd
-from peel_devices import SimpleDeviceWidget, DownloadThread
+from peel_devices import SimpleDeviceWidget, DownloadThread, FileItem, RttEstimator, transfer
 from peel_devices.tcp import TcpDevice
+from PySide6.QtNetwork import QAbstractSocket
+from hyperdeck_protocol import HyperDeckProtocol
+from peel_devices.clip_catalog import ClipCatalog
 import os.path
 from ftplib import FTP
 import ftplib
 import re
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 class AddHyperDeckWidget(SimpleDeviceWidget):
     def __init__(self, settings):
@@ -192,88 +196,140 @@ class AddHyperDeckWidget(SimpleDeviceWidget):
 
 class HyperDeckDownloadThread(DownloadThread):
 
+    """ Downloads the clips from every slot (drive) on the deck.  Each slot gets its own
+        worker, queue and ftp connection and the slots are downloaded at the same time, so
+        a deck with two drives reads from both at once. """
+
     def __init__(self, deck, directory, formatting):
         super(HyperDeckDownloadThread, self).__init__(directory, formatting)
         self.deck = deck
         self.slots = []
+        self.write_behind = True
 
     def __str__(self):
         return str(self.deck) + " Downloader"
 
-    def add_slot(self, line):
-        pos = line.rfind(' ')
-        self.slots.append(line[pos+1:])
-
-    def add_file(self, line):
+    @staticmethod
+    def parse_list(line):
+        """ (name, is directory, size) from a LIST line, or None """
         parts = line.split(maxsplit=8)  # split into at most 9 parts
         if len(parts) < 9:
             cmd.writeLog("Skipping non-file: " + line)
-            return
-
-        file = parts[8]  # the 9th field = filename (can contain spaces intact)
-
-        # Filter files for downloading
-        if not self.download_take_check(os.path.splitext(file)[0]):
-            cmd.writeLog(f"Skipping: {file} for mode: {self.download_mode}")
-            return
-
-        self.files.append(file)
-
-    def process_slot(self, ftp, slot):
-
-        # for each deck slot (drive)
+            return None
 
-        self.create_local_dir()
+        try:
+            size = int(parts[4])
+        except ValueError:
+            size = None
 
-        cmd.writeLog("SLOT: " + str(slot))
+        # the 9th field = filename (can contain spaces intact)
+        return parts[8], line.startswith("d"), size
 
-        ftp.cwd('/' + slot)
+    def list_dir(self, ftp):
+        """ List the current directory as (name, is directory, size), with MLSD if the deck
+            supports it otherwise LIST """
+        try:
+            ret = []
+            for name, facts in ftp.mlsd(facts=["type", "size"]):
+                kind = facts.get("type")
+                if kind not in ("dir", "file"):
+                    continue
+                size = int(facts["size"]) if "size" in facts else None
+                ret.append((name, kind == "dir", size))
+            return ret
+        except ftplib.error_perm:
+            lines = []
+            ftp.retrlines('LIST', lines.append)
+            return [i for i in map(self.parse_list, lines) if i is not None]
+
+    def file_display_name(self, file_item):
+        return str(self.deck) + ":" + file_item.remote_file
+
+    def connect(self):
+        ftp = FTP()
+        ftp.connect(self.deck.host, timeout=self.deck.rtt.timeout())
+        ftp.login()
+
+        # The deck can stall briefly while busy, allow longer for transfers once connected
+        ftp.timeout = self.deck.rtt.timeout(minimum=2.0, maximum=30.0)
+        ftp.sock.settimeout(ftp.timeout)
+        return ftp
+
+    def list_slots(self, ftp):
+        """ List the files to download on every slot (drive) """
+
+        ftp.cwd('/')
 
-        # Clear files out for each slot
         self.files = []
+        self.slots = [name for name, _, _ in self.list_dir(ftp)]
 
-        ftp.retrlines('LIST', self.add_file)
-
-        for i, file in enumerate(self.files):
+        for slot in self.slots:
 
             if not self.is_running():
                 break
 
-            self.set_current(i)
+            cmd.writeLog("SLOT: " + str(slot))
+            ftp.cwd('/' + slot)
 
-            this_file = str(self.deck) + ":" + file
+            for name, is_dir, size in self.list_dir(ftp):
+                if is_dir:
+                    continue
 
-            local_file = self.local_path(file)
+                # Filter files for downloading
+                if not self.download_take_check(os.path.splitext(name)[0]):
+                    cmd.writeLog(f"Skipping: {name} for mode: {self.download_mode}")
+                    continue
 
-            if os.path.isfile(local_file):
-                # skip existing
-                self.file_skip(this_file)
-            else:
-                # download
-                cmd.writeLog("Hyperdeck downloading: " + str(file))
-                try:
+                # Clip names are only unique within a slot, the remote name includes it
+                file_item = FileItem(f"{slot}/{name}", name)
+                file_item.file_size = size
+                self.files.append(file_item)
 
-                    self.current_size = 0
-                    self.set_file_total_size(ftp.size(file))
+        return self.files
 
-                    with open(local_file, 'wb') as fp:
+    def list_files(self):
+        with self.connect() as ftp:
+            return self.list_slots(ftp)
 
-                        def write(data):
-                            fp.write(data)
-                            self.add_bytes(len(data))
+    def download_slot(self, slot, items):
+        """ Download the clips on one slot, [(index, FileItem)], in order on the slot's own
+            ftp connection so each drive keeps streaming independently of the others """
+        ftp = None
 
-                        ftp.retrbinary('RETR ' + file, write)
+        def fetch(file_item, local_file):
+            nonlocal ftp
+            if ftp is None:
+                ftp = self.connect()
+                ftp.cwd('/' + slot)
 
-                    self.file_ok(this_file)
-                except IOError as e:
-                    if os.path.exists(local_file):
-                        os.remove(local_file)
-                    self.file_fail(this_file, str(e))
-                except ftplib.all_errors as e:
-                    self.file_fail(this_file, str(e))
+            cmd.writeLog("Hyperdeck downloading: " + str(file_item.remote_file))
+            try:
+                name = file_item.remote_file.split("/", 1)[1]
+                return transfer.fetch_ftp(self, ftp, name, file_item, local_file, size=file_item.file_size)
+            except Exception:
+                # The connection may be in a bad state, start a new one for the next clip
+                self.close_ftp(ftp)
+                ftp = None
+                raise
 
-        else:
-            self.set_current(len(self.files))
+        if self.priority is not None:
+            items = self.prioritised(items)
+
+        try:
+            for index, file_item in items:
+                if not self.is_running():
+                    break
+                self.download_file(index, file_item, fetch)
+        finally:
+            if ftp is not None:
+                self.close_ftp(ftp)
+
+    @staticmethod
+    def close_ftp(ftp):
+        try:
+            ftp.close()
+        except ftplib.all_errors:
+            pass
 
     def process(self):
 
@@ -282,24 +338,28 @@ class HyperDeckDownloadThread(DownloadThread):
         self.create_local_dir()
 
         try:
-            with FTP(self.deck.host, timeout=2) as ftp:
+            if not self.has_plan():
+                self.list_files()
 
-                ftp.login()
-                ftp.cwd('/')
+            # One worker and queue per slot, so both drives are read at once
+            by_slot = {}
+            for index, file_item in enumerate(self.files):
+                by_slot.setdefault(file_item.remote_file.split("/", 1)[0], []).append((index, file_item))
 
-                self.slots = []
-                self.files = []
-
-                ftp.retrlines('LIST', self.add_slot)
-
-                for slot in self.slots:
-
-                    if not self.is_running():
-                        break
+            self.file_progress = True
+            try:
+                with ThreadPoolExecutor(max_workers=max(1, len(by_slot))) as pool:
+                    futures = [pool.submit(self.download_slot, slot, items) for slot, items in by_slot.items()]
+                for future in futures:
+                    future.result()
+            finally:
+                self.file_progress = False
 
-                    self.process_slot(ftp, slot)
+            self.set_current(len(self.files))
 
         except IOError as e:
+            if isinstance(e, TimeoutError):
+                self.deck.rtt.add_timeout()
             self.message.emit("HyperDeck FTP Error:" + str(e))
         except ftplib.all_errors as e:
             self.message.emit("HyperDeck FTP Error:" + str(e))
@@ -307,23 +367,21 @@ class HyperDeckDownloadThread(DownloadThread):
         self.set_finished()
 
 
-
 class HyperDeck(TcpDevice):
     """
     Hyperdeck Device
     - Request dispatch (run_action / enqueue / advance)
-    - TCP input framing (do_read)
-    - Response parsing (parse_status_line / parse_multiline_block)
-    - Message interpretation (handle_message_code)
-
-    Multi-line messages follow HyperDeck protocol:
-        <code> <message>:
-            <line>
-            <line>
-        <blank line>
+    - TCP input framing and response matching (HyperDeckProtocol)
+    - Message interpretation (read_message)
+
+    Commands are pipelined, several can be in flight at once and the responses are
+    matched back to the action that sent them.  Only actions listed in DEPENDS wait
+    for the earlier action to be answered before they are sent.
     """
 
-    STATUS_RE = re.compile(r"^([0-9]{3}) (.*)")
+    # action -> action it needs the result of
+    DEPENDS = {"set-clip": "ls"}
+
     CLIP_COUNT_RE = re.compile(r"^clip count: ([0-9]+)")
     CLIP_ID_RE = re.compile(r"^([0-9]+):")
     TIMECODE_RE = re.compile(r".*([0-9]{2}:[0-9]{2}:[0-9]{2}:[0-9]{2})$")
@@ -348,16 +406,19 @@ class HyperDeck(TcpDevice):
         self.speed = 100
         self.play_clip = None
         self.clip_id = None
+        self.cued_clip = None
 
         # Protocol parsing state
-        self.code = None
-        self.message = None
-        self.lines = []
-        self.multi_line = False
+        self.protocol = HyperDeckProtocol()
 
         # Command queue
         self.command_queue = None
 
+        # Clips on the deck, refreshed by ls when invalid
+        self.clips = ClipCatalog()
+
+        self.rtt = RttEstimator(initial=2.0, minimum=RttEstimator.LAN_MINIMUM)
+
     # ----------------------------------------------------------------------
     # Configuration / general overrides
     # ----------------------------------------------------------------------
@@ -410,64 +471,44 @@ class HyperDeck(TcpDevice):
     # TCP Reading + Parsing
     # ----------------------------------------------------------------------
 
-    def do_read(self):
-        """Read raw TCP bytes, split into lines, classify, collect."""
-        data = self.tcp.readAll().data().decode("utf8", errors="replace")
-
-        for raw in data.split("\n"):
-            line = raw.strip()
-
-            # --- End of multiline block ---
-            if not line:
-                if self.multi_line:
-                    self.multi_line = False
-                    self.read_message()
-                    self.lines.clear()
-                    self.advance()
-                continue
-
-            # --- Status line: "205 Something" ---
-            m = self.STATUS_RE.match(line)
-            if m:
-                self._start_new_message(m.group(1), m.group(2))
-                continue
+    def do_connected(self):
+        super().do_connected()
+        # The media may have changed while disconnected, ask to be told about slot changes
+        self.clips.invalidate()
+        self.enqueue("notify")
 
-            # --- Multi-line content ---
-            if self.multi_line:
-                self.lines.append(line)
-            else:
-                cmd.writeLog("Unparsed line: " + line)
+    def connect_tcp(self, host=None, port=None):
+        # Nothing in flight on the old connection will be answered
+        self.protocol.clear()
+        super().connect_tcp(host, port)
 
-    def _start_new_message(self, code, message):
-        """Begin new message block."""
+    def do_read(self):
+        """Read raw TCP bytes and handle each complete response."""
+        data = self.tcp.readAll().data()
 
-        self.code = code
-        self.message = message
-        self.lines.clear()
+        for response in self.protocol.feed(data):
+            if response.elapsed is not None:
+                self.rtt.add_sample(response.elapsed)
+            self.read_message(response.request, response.code, response.message, response.lines)
 
-        if message.endswith(":"):
-            # multi-line block begins, wait for blank line to finish
-            self.multi_line = True
-            return
-        else:
-            # single-line message – safe to handle immediately
-            self.read_message()
-            self.advance()
-            return
+        self.advance()
 
     # ----------------------------------------------------------------------
     # Message Handling
     # ----------------------------------------------------------------------
 
-    def read_message(self):
-        """Interpret status code + lines."""
-        code = int(self.code)
-        self.code = None  # reset
+    def read_message(self, action, code, message, lines):
+        """Interpret status code + lines.  action is the request this answers, or None
+        for asynchronous messages."""
 
         # --- Standard HyperDeck code handlers ---
         if 100 <= code < 199:
-            cmd.writeLog(f"HyperDeck protocol error during {self.current_action}: {self.message}")
-            self.set_error(self.message)
+            cmd.writeLog(f"HyperDeck protocol error during {action}: {message}")
+            self.set_error(message)
+            self.cued_clip = None
+            if action in self.DEPENDS.values():
+                # Anything waiting on this will not get a result
+                self.command_queue = None
             return
 
         if code == 201:  # busy
@@ -475,15 +516,17 @@ class HyperDeck(TcpDevice):
             self.do_update_state()
             return
 
-        if code == 202:  # recording time
-            for line in self.lines:
+        if code in (202, 502):  # slot info, 502 is the notification when a slot changes
+            if code == 502:
+                self.clips.invalidate()
+            for line in lines:
                 if line.startswith("recording time:"):
                     self.record_time = line[15:].strip()
             self.do_update_state()
             return
 
         if code == 208:  # input video format
-            for line in self.lines:
+            for line in lines:
                 if line.startswith("input video format:"):
                     self.resolution = line[19:].strip()
             self.do_update_state()
@@ -493,53 +536,54 @@ class HyperDeck(TcpDevice):
             self.set_error("No Media")
             return
 
-        if code == 502:
-            self.set_error("Bad Command")
-            return
 
         # Successful standard command (200 or 500)
         if code in (200, 500):
             self.error = None
-            if self.current_action == "record":
+            if action == "record":
                 self.do_update_state("RECORDING")
                 return
-            if self.current_action == "play":
+            if action == "play":
                 self.do_update_state("PLAYING")
                 return
             self.do_update_state("ONLINE")
             return
 
         # Special ls completion
-        if code == 205 and self.current_action == "ls":
+        if code == 205 and action == "ls":
 
+            self.load_clips(lines)
             self.clip_id = self.get_play_clip_id()
 
             if self.clip_id is None:
-                self.set_error("Clip not found")
+                if self.command_queue and "cued" in self.command_queue:
+                    # Selected take is not on this deck, nothing to cue
+                    cmd.writeLog(f"{self.name} has no clip to cue for: {self.play_clip}")
+                else:
+                    self.set_error("Clip not found")
                 self.command_queue = None
             return
 
         # Unknown
-        cmd.writeLog(f"Unknown HyperDeck response: {self.current_action} - {code} {self.message}")
+        cmd.writeLog(f"Unknown HyperDeck response: {action} - {code} {message}")
 
     # ----------------------------------------------------------------------
     # Clip listing / parsing
     # ----------------------------------------------------------------------
 
-    def get_play_clip_id(self):
-        """Parse a clip ID by matching clip name."""
-        if not self.lines:
+    def load_clips(self, lines):
+        """Parse a clips get response into the clip catalog (name -> clip id)."""
+        if not lines:
             cmd.writeLog("No lines for clip parsing")
-            return None
+            return False
 
         # First line: clip count
-        if not self.CLIP_COUNT_RE.match(self.lines[0]):
-            cmd.writeLog("Could not parse clip count: " + self.lines[0])
-            return None
-
-        cmd.writeLog(f"Searching for clip name: {self.play_clip}")
+        if not self.CLIP_COUNT_RE.match(lines[0]):
+            cmd.writeLog("Could not parse clip count: " + lines[0])
+            return False
 
-        for line in map(str.strip, self.lines[1:]):
+        clips = []
+        for line in map(str.strip, lines[1:]):
             id_match = self.CLIP_ID_RE.match(line)
             if not id_match:
                 continue
@@ -559,12 +603,21 @@ class HyperDeck(TcpDevice):
                 continue
             rest = rest[:-11].strip()
 
-            clip_name = os.path.splitext(rest)[0]
-            if clip_name == self.play_clip:
-                cmd.writeLog(f"Found clip id = {take_id}")
-                return take_id
+            clips.append((rest, take_id))
 
-        return None
+        self.clips.load(clips)
+        cmd.writeLog(f"{self.name} cached {len(self.clips)} clips")
+        return True
+
+    def get_play_clip_id(self):
+        """Look up the clip id for the clip to play in the catalog."""
+        cmd.writeLog(f"Searching for clip name: {self.play_clip}")
+        found = self.clips.find(self.play_clip)
+        if not found:
+            return None
+        take_id = self.clips.values[found[0]]
+        cmd.writeLog(f"Found clip id = {take_id}")
+        return take_id
 
     # ----------------------------------------------------------------------
     # Command Queue Management
@@ -579,14 +632,14 @@ class HyperDeck(TcpDevice):
 
         self.command_queue = list(commands)
         cmd.writeLog("COMMAND QUEUE: " + str(self.command_queue))
-        self.run_action(self.command_queue.pop(0))
+        self.advance()
 
     def advance(self):
-        """Continue queued command sequence."""
-        if not self.current_action:
-            return
-
-        if self.command_queue:
+        """Send queued commands until one needs the result of a command still in flight."""
+        while self.command_queue:
+            depends = self.DEPENDS.get(self.command_queue[0])
+            if depends and self.protocol.in_flight(depends):
+                return
             self.run_action(self.command_queue.pop(0))
 
     # ----------------------------------------------------------------------
@@ -598,32 +651,49 @@ class HyperDeck(TcpDevice):
         cmd.writeLog(f">>> Action: {action}")
         self.current_action = action
 
+        if action == "cued":
+            # Not sent, marks the end of a cue sequence
+            self.cued_clip = self.play_clip
+            return
+
         if action == "record":
-            self.send(f"record: name: {self.current_take}\n")
+            msg = f"record: name: {self.current_take}\n"
 
         elif action == "stop":
-            self.send("stop\n")
+            msg = "stop\n"
 
         elif action == "preview-enable":
-            self.send("preview: enable: true\n")
+            msg = "preview: enable: true\n"
 
         elif action == "ls":
-            self.send("clips get\n")
+            msg = "clips get\n"
 
         elif action == "set-clip":
-            self.send(f"playrange set: clip id: {self.clip_id}\n")
+            msg = f"playrange set: clip id: {self.clip_id}\n"
 
         elif action == "goto-start":
-            self.send("goto: clip: start\n")
+            msg = "goto: clip: start\n"
 
         elif action == "goto-end":
-            self.send("goto: clip: end\n")
+            msg = "goto: clip: end\n"
 
         elif action == "play":
-            self.send(f"play: loop: true speed: {self.speed}\n")
+            msg = f"play: loop: true speed: {self.speed}\n"
+
+        elif action == "notify":
+            msg = "notify: slot: true\n"
 
         elif action in ("transport info", "slot info"):
-            self.send(action + "\n")
+            msg = action + "\n"
+
+        else:
+            return
+
+        connected = self.tcp is not None and self.tcp.state() == QAbstractSocket.ConnectedState
+        self.send(msg)
+        if connected:
+            # Only expect a response if it actually went out
+            self.protocol.sent(action)
 
     # ----------------------------------------------------------------------
     # Public Command Interface
@@ -637,19 +707,38 @@ class HyperDeck(TcpDevice):
                        "set_data_directory", "takeId", "recording-ok"]:
             return
 
+        if command == "selectedTake":
+            if self.playback and arg and self.device_state != "RECORDING":
+                self.cue_clip(self.format_take(arg))
+            return
+
         if command == "record":
             self.current_take = self.format_take(arg)
+            self.clips.invalidate()
+            self.cued_clip = None
             self.enqueue(["transport info", "slot info", "record"])
             return
 
         if command == "stop":
             self.play_clip = None
+            self.cued_clip = None
+            self.clips.invalidate()
             self.enqueue(["stop", "preview-enable", "transport info", "slot info"])
             return
 
         if command == "play" and self.playback:
             self.play_clip = self.format_take(arg)
             self.speed = 100
+            if self.cued_clip == self.play_clip:
+                # Already loaded when the take was selected
+                self.cued_clip = None
+                self.enqueue("play")
+                return
+            if self.clips.valid:
+                self.clip_id = self.get_play_clip_id()
+                if self.clip_id is not None:
+                    self.enqueue(["set-clip", "goto-start", "play"])
+                    return
             self.enqueue(["ls", "set-clip", "goto-start", "play"])
             return
 
@@ -670,6 +759,19 @@ class HyperDeck(TcpDevice):
 
         cmd.writeLog(f"{self.name} ignored command: {command} {arg}")
 
+    def cue_clip(self, take):
+        """Load the clip for a take ready to play, so play only needs the transport command."""
+        self.play_clip = take
+        self.cued_clip = None
+
+        if self.clips.valid:
+            self.clip_id = self.get_play_clip_id()
+            if self.clip_id is None:
+                return
+            self.enqueue(["set-clip", "goto-start", "cued"])
+        else:
+            self.enqueue(["ls", "set-clip", "goto-start", "cued"])
+
     # ----------------------------------------------------------------------
 
     @staticmethod
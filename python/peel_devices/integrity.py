@@ -0,0 +1,119 @@
+import datetime
+import getpass
+import hashlib
+import os
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from xml.etree import ElementTree
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+
+CHUNK_SIZE = 4 * 1048576
+
+# Name of the hash in the media hash list.  xxhash is much faster, md5 is used when the
+# xxhash module is not installed.  Both are in the MHL 1.1 spec.
+ALGORITHM = "xxhash64be" if xxhash is not None else "md5"
+
+
+def new_hash():
+    """ Returns a hash object for the harvest algorithm, call update() as the data arrives """
+    if xxhash is not None:
+        return xxhash.xxh64()
+    return hashlib.md5()
+
+
+def hash_file(path, limit=None):
+    """ Hash a file on disk, or just the first limit bytes of it.  Returns the hash object so
+        a resumed download can carry on updating it """
+    h = new_hash()
+    remaining = limit
+    with open(path, "rb") as fp:
+        while remaining is None or remaining > 0:
+            size = CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining)
+            data = fp.read(size)
+            if not data:
+                break
+            h.update(data)
+            if remaining is not None:
+                remaining -= len(data)
+    return h
+
+
+def hash_files(paths, workers=None):
+    """ Hash files that are already on disk using several cores.  The hash functions release
+        the gil while they work so threads are enough, and avoid starting new processes from
+        inside the host application.  Returns {path: hex digest or None if it could not be read} """
+
+    def work(path):
+        try:
+            return path, hash_file(path).hexdigest()
+        except OSError as e:
+            print(f"Could not hash {path}: {e}")
+            return path, None
+
+    if workers is None:
+        workers = min(8, os.cpu_count() or 1)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return dict(pool.map(work, paths))
+
+
+def _date(timestamp=None):
+    if timestamp is None:
+        value = datetime.datetime.now(datetime.timezone.utc)
+    else:
+        value = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+    return value.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class HashList:
+    """ Media hash list (MHL 1.1) for the files harvested into a device folder, so the
+        media can be checked later without knowing how it was copied """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.start = _date()
+        self.entries = []
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, path, hash_value):
+        self.entries.append((path, hash_value))
+
+    def write(self):
+        """ Write the list to <directory>/<folder>_<date>.mhl, returns the path """
+
+        root = ElementTree.Element("hashlist", version="1.1")
+
+        info = ElementTree.SubElement(root, "creatorinfo")
+        ElementTree.SubElement(info, "username").text = getpass.getuser()
+        ElementTree.SubElement(info, "hostname").text = socket.gethostname()
+        ElementTree.SubElement(info, "tool").text = "PeelCapture"
+        ElementTree.SubElement(info, "startdate").text = self.start
+        ElementTree.SubElement(info, "finishdate").text = _date()
+
+        for path, hash_value in sorted(self.entries):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            item = ElementTree.SubElement(root, "hash")
+            rel = os.path.relpath(path, self.directory).replace("\\", "/")
+            ElementTree.SubElement(item, "file").text = rel
+            ElementTree.SubElement(item, "size").text = str(stat.st_size)
+            ElementTree.SubElement(item, "lastmodificationdate").text = _date(stat.st_mtime)
+            ElementTree.SubElement(item, ALGORITHM).text = hash_value
+            ElementTree.SubElement(item, "hashdate").text = _date()
+
+        name = os.path.basename(os.path.normpath(self.directory))
+        stamp = datetime.datetime.now().strftime("%Y-%m-%d_%H%M%S")
+        mhl_path = os.path.join(self.directory, f"{name}_{stamp}.mhl")
+
+        ElementTree.indent(root)
+        ElementTree.ElementTree(root).write(mhl_path, encoding="UTF-8", xml_declaration=True)
+        return mhl_path
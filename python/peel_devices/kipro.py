@@ -24,14 +24,17 @@
 
 from PeelApp import cmd
 from PySide6 import QtWidgets, QtCore
-import urllib.parse, urllib.request
+import urllib.parse
 import time
 import os.path
-from peel_devices import PeelDeviceBase, SimpleDeviceWidget, DownloadThread, FileItem
+from peel_devices import PeelDeviceBase, SimpleDeviceWidget, DownloadThread, FileItem, RttEstimator, transfer
+from peel_devices.http_client import HttpClient
+from peel_devices.clip_catalog import ClipCatalog
+import requests
 import json
 import re
 import traceback
-import socket
+import threading
 from peel import file_util
 
 # http://192.168.15.151/descriptors
@@ -72,93 +75,13 @@ class KiProDialog(SimpleDeviceWidget):
         return True
 
 
-class Downloader:
-    def __init__(self, url, outfile):
-        self.url = url
-        self.outfile = outfile
-        self.src = None
-        self.dest = None
-        self.read = 0
-        self.total = 0
-        self.initialize_download()
-
-    def initialize_download(self):
-        try:
-            print("Opening:", self.url)
-            self.src = urllib.request.urlopen(self.url, timeout=10)
-            self.total = int(self.src.getheader("Content-Length"))
-        except Exception as e:
-            print(f"Error opening URL: {e}")
-            raise
-
-    def exists(self):
-        if not os.path.isfile(self.outfile):
-            return False
-
-        stat = os.stat(self.outfile)
-        if stat.st_size == self.total:
-            return True
-
-        # Rename the existing file that is the wrong size
-        for i in range(100):
-            altname = f"{self.outfile}_{i}"
-            if not os.path.isfile(altname):
-                print(f"Renaming {self.outfile} to {altname}")
-                os.rename(self.outfile, altname)
-                return False
-
-        return False
-
-    def close(self):
-        if self.dest:
-            self.dest.close()
-        if self.src:
-            self.src.close()
-        print("Closing download streams.")
-        print("Finished: ", self.outfile)
-
-    def tick(self):
-        ret = 0
-
-        if self.dest is None:
-            try:
-                print("Writing to ", self.outfile)
-                self.dest = open(self.outfile, "wb")
-            except Exception as e:
-                print(f"Error opening file for writing: {e}")
-                self.close()
-                return False
-
-        try:
-            data = self.src.read(65536)
-            if not data:
-                self.close()
-                return False
-            self.dest.write(data)
-            self.read += len(data)
-            ret = len(data)
-
-        except Exception as e:
-            print(f"Error during download: {e}")
-            self.close()
-            return False
-
-        return ret
-
-    def progress(self):
-        if self.total > 0:
-            return float(self.read) / float(self.total)
-        return 0.0
-
-
 class KiProDownloadThread(DownloadThread):
 
     def __init__(self, kipro, directory, quad, formatting):
         super().__init__(directory, formatting)
         self.kipro = kipro
         self.quad = quad
-        self.incomplete = None
-        self.downloader = None
+        self.write_behind = True
 
     def __str__(self):
         return f"{self.kipro} Downloader"
@@ -172,7 +95,8 @@ class KiProDownloadThread(DownloadThread):
 
         try:
             self.kipro.datalan()
-            self.prepare_clips()
+            if not self.has_plan():
+                self.prepare_clips()
             self.download_clips()
         except Exception as e:
             cmd.writeLog(f"{self} - Ki pro process error: {e}\n")
@@ -203,70 +127,39 @@ class KiProDownloadThread(DownloadThread):
             if self.download_take_check(name):
                 self.files.append(FileItem(clip['clipname'], clip['clipname']))
 
-    def download_clips(self):
-
-        # bytes = 0
-
-        for i, clip in enumerate(self.files):
-
-            print(i, clip)
-
-            self.set_current(i)
-            if not self.is_running():
-                break
-
-            out = self.local_path(clip.local_file)
+    def list_files(self):
+        # The clip list is available in record/play mode, no need to switch to data lan
+        self.prepare_clips()
+        return self.files
 
-            try:
-                url = self.get_clip_url(clip.remote_file)
-                self.downloader = Downloader(url, out)
+    def file_display_name(self, file_item):
+        return str(self.kipro.name) + ":" + file_item.local_file
 
-                if self.downloader.exists():
-                    self.file_skip(str(self.kipro.name) + ":" + self.current_file().local_file)
-                    self.downloader.close()
-                    time.sleep(0.2)
-                    continue
-
-                self.file_size = self.downloader.total
+    def download_clips(self):
+        # One clip at a time (worker_count is 1), the ki pro does not cope with parallel requests
+        self.download_files(self.fetch_clip)
 
-                while self.is_running():
-                    sz = self.downloader.tick()
-                    if sz is False:
-                        break
+    def fetch_clip(self, clip, out):
 
-                    self.add_bytes(sz)
-                    pass
+        print(clip)
 
-                name = str(self.kipro.name) + ":" + self.current_file().local_file
-                if self.downloader.read != self.downloader.total:
-                    self.handle_incomplete_download(out)
-                else:
-                    self.current_file().complete = True
-                    self.file_ok(name)
+        url = self.get_clip_url(clip.remote_file)
 
-                # Ki pro crashes without this
+        ret = self.COPY_FAIL
+        try:
+            # Resumes an interrupted download, a different clip with the same name is moved aside
+            ret = transfer.fetch_http(self, self.kipro.http, url, clip, out, existing="size",
+                                      timeout=(self.kipro.http.get_timeout(), 10))
+            return ret
+        finally:
+            if ret != self.COPY_SKIP:
+                # Ki pro crashes without this after a transfer
                 time.sleep(1.0)
 
-            except IOError as e:
-                self.handle_download_error(e, out)
-
-        else:
-            self.set_current(len(self.files))
-
     def get_clip_url(self, remote_file):
         url = f"http://{self.kipro.host}/media/{urllib.parse.quote(remote_file)}"
         return url
 
-    def handle_incomplete_download(self, out):
-        self.current_file().error = "Incomplete download"
-        cmd.writeLog(f"Ki Pro Incomplete Download: {self.downloader.read} of {self.downloader.total}\n")
-        self.file_fail(str(self.kipro) + ":" + self.current_file().local_file, "Incomplete Download")
-
-    def handle_download_error(self, error, out):
-        cmd.writeLog(f"Ki Pro Download Error: {error}\n")
-        self.current_file().error = str(error)
-        self.file_fail(str(self.kipro) + ":" + self.current_file().local_file, str(error))
-
 
 class KiPro(PeelDeviceBase):
     eTCNoCommand = 0
@@ -307,6 +200,12 @@ class KiPro(PeelDeviceBase):
         self.desc = None
         self.playback = True
         self.storage = None
+        self.clip_catalog = ClipCatalog(prefixes=True)
+        self.cued = None
+        self.recording = False  # set by record without cue_lock, a pending cue gives up on it
+        self.cue_lock = threading.Lock()
+        self.rtt = RttEstimator(initial=1.0, minimum=RttEstimator.LAN_MINIMUM)
+        self.http = HttpClient(self.host, rtt=self.rtt)
 
     @staticmethod
     def device():
@@ -322,6 +221,7 @@ class KiPro(PeelDeviceBase):
         if not super().reconfigure(name, **kwargs):
             return False
         self.host = kwargs.get("host", None)
+        self.http.set_host(self.host)
         self.quad = kwargs.get('quad', False)
         if kwargs.get("prefix_device_name", False):
             self.formatting.set_format("{device}_{take}")
@@ -337,6 +237,7 @@ class KiPro(PeelDeviceBase):
         pass
 
     def connect_device(self):
+        self.http.warm("desc.json")
         self.query_state_delayed()
 
     def query_state_delayed(self):
@@ -345,11 +246,9 @@ class KiPro(PeelDeviceBase):
         QtCore.QTimer.singleShot(500, self.update_state)
 
     def get_desc(self):
-        url = f"http://{self.host}/desc.json"
         try:
-            with urllib.request.urlopen(url, timeout=1) as f:
-                self.desc = json.loads(f.read())
-        except (urllib.error.URLError, socket.timeout, json.JSONDecodeError):
+            self.desc = self.http.get("desc.json").json()
+        except (requests.RequestException, ValueError):
             self.desc = None
 
     def get_state(self, reason=None):
@@ -452,22 +351,39 @@ class KiPro(PeelDeviceBase):
 
         """ PeelCapture has something for the ki pro to do """
 
-        if command in ['set_data_directory', "takeNumber", "takeName", 'recording-ok']:
+        if command == "takeName":
+            # About to record, make sure there is a live connection for the record commands
+            self.http.warm("desc.json")
+            return
+
+        if command in ['set_data_directory', "takeNumber", 'recording-ok']:
             return
 
-        if command in ["shotName", "description", "takeId", "selectedTake"]:
+        if command in ["shotName", "description", "takeId"]:
+            return
+
+        if command == "selectedTake":
+            if self.playback and arg and not self.recording:
+                self.precue(self.format_take(arg))
             return
 
         if command == "record":
 
             name = self.format_take(arg)
+            self.clip_catalog.invalidate()
+
+            # Never wait on a cue in progress, it checks the flag between steps and gives up
+            self.recording = True
+            self.cued = None
 
             if not self.clip_name(name):
+                self.recording = False
                 cmd.writeLog(str(self) + " - Could not set clip name\n")
                 self.update_state("ERROR", self.error)
                 return
 
             if not self.record():
+                self.recording = False
                 cmd.writeLog(str(self) + " - Could not record\n")
                 self.update_state("ERROR", self.error)
                 return
@@ -477,7 +393,11 @@ class KiPro(PeelDeviceBase):
             return
 
         if command == "stop":
-            if self.stop():
+            self.clip_catalog.invalidate()
+            self.cued = None
+            ret = self.stop()
+            self.recording = False
+            if ret:
                 self.query_state_delayed()
                 self.error = ""
             else:
@@ -502,10 +422,10 @@ class KiPro(PeelDeviceBase):
             print("Downloading")
             return
         try:
-            url = "http://" + self.host + "/config?" + urllib.parse.urlencode(params)
-            cmd.writeLog(url + "\n")
-            with urllib.request.urlopen(url, timeout=1) as f:
-                return f.read()
+            cmd.writeLog(self.http.url("config") + "?" + urllib.parse.urlencode(params) + "\n")
+            response = self.http.get("config", params=params)
+            response.raise_for_status()
+            return response.content
         except Exception as e:
             print("KI PRO ERROR: " + str(e))
             return None
@@ -609,9 +529,9 @@ class KiPro(PeelDeviceBase):
 
         # Fetch the clip list from the Ki Pro device
         try:
-            url = f"http://{self.host}/clips"
-            response = urllib.request.urlopen(url, timeout=1)
-            response_text = response.read().decode("ascii")
+            response = self.http.get("clips")
+            response.raise_for_status()
+            response_text = response.content.decode("ascii")
         except IOError as error:
             print("Ki pro clips error: " + str(error))
             return
@@ -636,43 +556,98 @@ class KiPro(PeelDeviceBase):
 
             yield clip_dict
 
-    def play_clip(self, clip_name):
+    def load_clips(self):
+        """ Refresh the clip catalog from the device """
+        self.clip_catalog.load((i['clipname'], i) for i in self.clips() if 'clipname' in i)
+        cmd.writeLog(f"{self} cached {len(self.clip_catalog)} clips\n")
+
+    def find_clips(self, clip_name):
+        """ Indexes of the clips in the catalog for a take, reloading the catalog if it is out
+            of date or the take is not in it (e.g. the media was changed on the device) """
+        if self.clip_catalog.valid:
+            found = self.clip_catalog.find(clip_name)
+            if found:
+                return found
+
+        self.load_clips()
+        return self.clip_catalog.find(clip_name)
+
+    def goto_clip(self, name):
+        """ Cue a clip by name.  Jumps straight to it if the device supports it, otherwise
+            steps from the current clip using the positions in the catalog """
+        ret = self.call(paramid='eParamID_GoToClip', value=name, action='set')
+        if ret is not None and b'eParamID_GoToClip' in ret:
+            return True
+
+        current = self.get_param('eParamID_CurrentClip', "value")
+        current_id = self.clip_catalog.position(current)
+        play_id = self.clip_catalog.position(name)
+        if current_id is None or play_id is None:
+            print(f"Could not find the current clip: {current}")
+            return False
+
+        if play_id < current_id:
+            for i in range(current_id - play_id):
+                if self.recording:
+                    return False
+                self.prev_clip()
+
+        if play_id > current_id:
+            for i in range(play_id - current_id):
+                if self.recording:
+                    return False
+                self.next_clip()
+
+        return True
 
-        names = [i['clipname'] for i in self.clips()]
+    def cue_clip(self, clip_name):
+        """ Find a clip and load it ready to play, call with cue_lock held.  Gives up between
+            steps once a recording starts, record does not wait for the lock """
 
-        clip_name = file_util.fix_name(clip_name)
+        self.cued = None
 
-        found = []
-        for i, each_clip in enumerate(names):
-            if file_util.fix_name(each_clip).startswith(clip_name):
-                found.append(i)
+        found = self.find_clips(clip_name)
 
-        if not found:
+        if not found or self.recording:
             return False
 
         for i in found:
-            print(f"Found:  {i} {names[i]}")
-
-        current = self.get_param('eParamID_CurrentClip', "value")
-        current_id = names.index(current)
+            print(f"Found:  {i} {self.clip_catalog.names[i]}")
 
         if self.next_play >= len(found):
             self.next_play = 0
 
-        play_id = found[self.next_play]
+        play_name = self.clip_catalog.names[found[self.next_play]]
 
-        if play_id < current_id:
-            for i in range(current_id - play_id):
-                self.prev_clip()
+        if not self.goto_clip(play_name) or self.recording:
+            return False
 
-        if play_id > current_id:
-            for i in range(play_id - current_id):
-                self.next_clip()
+        self.cued = clip_name
+        return True
 
-        ret = self.play()
-        self.next_play += 1
+    def precue(self, clip_name):
+        """ Cue a clip in the background when a take is selected, so play is a single call """
 
-        return ret is not None
+        def do_cue():
+            with self.cue_lock:
+                if self.recording:
+                    return
+                if self.cue_clip(clip_name):
+                    cmd.writeLog(f"{self} cued {clip_name}\n")
+
+        threading.Thread(target=do_cue, daemon=True).start()
+
+    def play_clip(self, clip_name):
+
+        with self.cue_lock:
+            if self.cued != clip_name and not self.cue_clip(clip_name):
+                return False
+
+            self.cued = None
+            ret = self.play()
+            self.next_play += 1
+
+        return ret
 
     def is_download_allowed(self):
         ret = self.media_state()
@@ -683,6 +658,10 @@ class KiPro(PeelDeviceBase):
     def has_harvest(self):
         return True
 
+    def has_background_harvest(self):
+        # Downloading needs the deck in Data - LAN mode, it can not record like that
+        return False
+
     def harvest(self, directory):
         return KiProDownloadThread(self, directory, self.quad, self.formatting)
 
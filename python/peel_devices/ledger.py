@@ -0,0 +1,107 @@
+import os
+import sqlite3
+import threading
+import time
+
+
+class HarvestLedger:
+    """ Record of the files harvested into a data directory, kept in a sqlite database in
+        the directory.  Lets a repeat harvest skip files it has already copied without
+        asking the device about them or opening a connection.
+
+        The entries for a device are read into memory the first time the device is looked
+        up, so checks are a dictionary lookup and a stat of the local file.  Safe to use from
+        several download threads at once.
+    """
+
+    FILE_NAME = ".peel_harvest.db"
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.devices = {}  # device name -> {remote path: entry}
+        self.db = sqlite3.connect(os.path.join(directory, self.FILE_NAME), check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS files (
+                            device TEXT NOT NULL,
+                            remote TEXT NOT NULL,
+                            size INTEGER,
+                            mtime TEXT,
+                            hash TEXT,
+                            local TEXT,
+                            harvested REAL,
+                            PRIMARY KEY (device, remote))""")
+        self.db.commit()
+
+    def close(self):
+        with self.lock:
+            if self.db is not None:
+                self.db.close()
+                self.db = None
+
+    def entries(self, device):
+        """ All the entries for a device, call with the lock held """
+        ret = self.devices.get(device)
+        if ret is None:
+            ret = {}
+            if self.db is not None:
+                rows = self.db.execute("SELECT remote, size, mtime, hash, local FROM files WHERE device=?", (device,))
+                for remote, size, mtime, hash_value, local in rows:
+                    ret[remote] = {"size": size, "mtime": mtime, "hash": hash_value, "local": local}
+            self.devices[device] = ret
+        return ret
+
+    def lookup(self, device, remote):
+        with self.lock:
+            return self.entries(device).get(remote)
+
+    def has(self, device, remote, size=None, mtime=None):
+        """ True if the file has been harvested and the local copy is still there and complete.
+            size and mtime are checked against the entry if the device listing provides them.
+            With neither the name is all there is to go on, and a device that reuses clip
+            names (e.g. after the media is formatted) would have its new file skipped, so the
+            file is left for the download to check against the device """
+        if size is None and mtime is None:
+            return False
+
+        entry = self.lookup(device, remote)
+        if entry is None:
+            return False
+
+        if size is not None and entry["size"] is not None and size != entry["size"]:
+            return False
+
+        if mtime is not None and entry["mtime"] is not None and str(mtime) != entry["mtime"]:
+            return False
+
+        local = os.path.join(self.directory, entry["local"])
+        try:
+            return os.path.getsize(local) == entry["size"]
+        except OSError:
+            return False
+
+    def local_path(self, device, remote):
+        """ Full path of the local copy of a file in the ledger, or None """
+        entry = self.lookup(device, remote)
+        if entry is None or entry["local"] is None:
+            return None
+        return os.path.join(self.directory, entry["local"])
+
+    def record(self, device, remote, local_path, size=None, mtime=None, hash_value=None):
+        """ Add or update the entry for a file that has been harvested """
+        if size is None:
+            size = os.path.getsize(local_path)
+
+        local = os.path.relpath(local_path, self.directory)
+        if mtime is not None:
+            mtime = str(mtime)
+
+        with self.lock:
+            self.entries(device)[remote] = {"size": size, "mtime": mtime, "hash": hash_value, "local": local}
+            if self.db is None:
+                return
+            self.db.execute("INSERT OR REPLACE INTO files (device, remote, size, mtime, hash, local, harvested) "
+                            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            (device, remote, size, mtime, hash_value, local, time.time()))
+            self.db.commit()
@@ -22,11 +22,11 @@
 # CONTRACT, TORT (INCLUDING NEGLIGENCE), OR OTHERWISE, REGARDLESS OF WHETHER SUCH DAMAGES WERE FORESEEABLE AND WHETHER
 # OR NOT THE LICENSOR WAS ADVISED OF THE POSSIBILITY OF SUCH DAMAGES.
 from PeelApp import cmd
-from peel_devices import SimpleDeviceWidget, PeelDeviceBase, DownloadThread
-import requests
+from peel_devices import SimpleDeviceWidget, PeelDeviceBase, DownloadThread, FileItem, RttEstimator, transfer
+from peel_devices.http_client import HttpClient
+from peel_devices.crawler import DirectoryCrawler
 import time, os
 from requests.exceptions import ConnectionError, HTTPError
-from collections import deque
 
 
 class MugshotWidget(SimpleDeviceWidget):
@@ -44,6 +44,8 @@ class Mugshot(PeelDeviceBase):
         self.host = "192.168.1.100"
         self.state = "OFFLINE"
         self.info = ""
+        self.rtt = RttEstimator(initial=3.0)
+        self.http = HttpClient(self.host, rtt=self.rtt)
         self._update_state("OFFLINE", "")
         self.check_connection()
 
@@ -53,6 +55,7 @@ class Mugshot(PeelDeviceBase):
     def reconfigure(self, name, **kwargs):
         self.name = name
         self.host = kwargs.get('host', self.host)
+        self.http.set_host(self.host)
         self._update_state("OFFLINE", "")
         return True
 
@@ -80,7 +83,7 @@ class Mugshot(PeelDeviceBase):
         for attempt in range(max_retries):
             try:
                 print(f"Attempt {attempt + 1} to connect to host: {self.host}")
-                response = requests.get(f"http://{self.host}/control", timeout=3)
+                response = self.http.get("control")
                 response.raise_for_status()
                 self._update_state("ONLINE", "")
                 print("Connection successful.")
@@ -98,7 +101,7 @@ class Mugshot(PeelDeviceBase):
     def start_recording(self):
         try:
             params = {'cmd': 'startRecording'}
-            response = requests.get(f"http://{self.host}/control", params=params, timeout=3)
+            response = self.http.get("control", params=params)
             response.raise_for_status()
             self._update_state("RECORDING", "")
         except HTTPError as http_err:
@@ -109,7 +112,7 @@ class Mugshot(PeelDeviceBase):
     def stop_recording(self):
         try:
             params = {'cmd': 'stopRecording'}
-            response = requests.get(f"http://{self.host}/control", params=params, timeout=3)
+            response = self.http.get("control", params=params)
             response.raise_for_status()
             self._update_state("ONLINE", "")
         except HTTPError as http_err:
@@ -120,7 +123,7 @@ class Mugshot(PeelDeviceBase):
     def set_take_name(self, take_name):
         try:
             params = {'cmd': 'takename', 'param': take_name}
-            response = requests.get(f"http://{self.host}/control", params=params, timeout=3)
+            response = self.http.get("control", params=params)
             response.raise_for_status()
             # Assuming successful command execution doesn't change the device's overall state.
             # If it does, use _update_state accordingly.
@@ -135,6 +138,8 @@ class Mugshot(PeelDeviceBase):
             self.start_recording()
         elif command == "stop":
             self.stop_recording()
+        elif command == "takeName":
+            self.http.warm("control")
 
     @staticmethod
     def device():
@@ -156,64 +161,44 @@ class MugshotDownloadThread(DownloadThread):
     def __init__(self, mugshot, directory):
         super(MugshotDownloadThread, self).__init__(directory)
         self.mugshot = mugshot
+        self.worker_count = 4
 
     def __str__(self):
         return str(self.mugshot) + " Downloader"
 
-    def run(self):
-
-        print("mugshot downloading")
-
-        self.set_started()
-
-        self.create_local_dir()
-
-        try:
-            directories_to_explore = deque([""])  # Start with the root directory
-            # iteratively walk through Mugshot directories and download any .mov files
-            while directories_to_explore and self.is_running():
-                current_path = directories_to_explore.popleft()  # Get the next directory to explore
-                url = f"http://{self.mugshot.host}/ls/{current_path}"
-                response = requests.get(url)
-
-                if response.status_code == 200:
-                    response_data = response.json()
-                    contents = response_data.get('ls', [])
-                    for item in contents:
-                        name, item_type = item  # Unpack the name and type
-                        if item_type == 'd':  # 'd' indicates a directory
-                            # Add the directory to the queue, ensuring to append a slash for proper path formatting
-                            directories_to_explore.append(f"{current_path}{name}/")
-                        elif name.endswith('.mov'):
-
-                            if not self.download_take_check(name):
-                                continue
-
-                            src_path = f"{current_path}{name}"
-
-                            this_file = str(self.mugshot) + ":" + name
-                            local_file = self.local_path(name)
-
-                            if os.path.isfile(local_file):
-                                # skip existing
-                                self.file_skip(this_file)
-                            else:
-                                # download
-                                try:
-                                    print("Mugshot downloading: " + str(name))
-                                    url = f"http://{self.mugshot.host}/dl/{src_path}"
-                                    response = requests.get(url, stream=True)
-
-                                    with open(local_file, 'wb') as f:
-                                        for chunk in response.iter_content(chunk_size=1024):
-                                            f.write(chunk)
-                                    self.file_ok(this_file)
-                                except Exception as e:
-                                    self.file_fail(this_file, str(e))
-                else:
-                    print(
-                        f"Failed to retrieve directory content from {current_path}. Status code: {response.status_code}")
-
-        finally:
-            self.message.emit("mugshot finishing")
-            self.set_finished()
+    def file_display_name(self, file_item):
+        return str(self.mugshot) + ":" + os.path.basename(file_item.local_file)
+
+    def list_dir(self, current_path):
+        """ Directories and .mov files in a Mugshot folder, for the crawler """
+        response = self.mugshot.http.get(f"ls/{current_path}")
+        response.raise_for_status()
+
+        directories = []
+        files = []
+        for name, item_type in response.json().get('ls', []):
+            if item_type == 'd':  # 'd' indicates a directory
+                # Append a slash for proper path formatting
+                directories.append(f"{current_path}{name}/")
+            elif name.endswith('.mov'):
+                if self.download_take_check(os.path.splitext(name)[0]):
+                    files.append(FileItem(f"{current_path}{name}", name))
+
+        return directories, files
+
+    def iter_files(self):
+        print("mugshot listing files")
+        crawler = DirectoryCrawler(self.list_dir, is_running=self.is_running)
+        return crawler.crawl([""])  # Start with the root directory
+
+    def list_files(self):
+        return list(self.iter_files())
+
+    def fetch_file(self, file_item, local_path):
+        print("Mugshot downloading: " + str(file_item.remote_file))
+        # Skips existing files, resumes ones that were interrupted
+        return transfer.fetch_http(self, self.mugshot.http, f"dl/{file_item.remote_file}", file_item, local_path)
+
+    def process(self):
+        super().process()
+        self.message.emit("mugshot finishing")
@@ -23,14 +23,118 @@
 # OR NOT THE LICENSOR WAS ADVISED OF THE POSSIBILITY OF SUCH DAMAGES.
 
 
-from peel_devices import PeelDeviceBase, DownloadThread, SimpleDeviceWidget, udp, tcp
-from PySide6 import QtCore, QtNetwork
+from peel_devices import PeelDeviceBase, DownloadThread, DeferredFile, FileItem, SimpleDeviceWidget, udp, tcp, \
+    integrity, transfer
+from PySide6 import QtCore, QtNetwork, QtWidgets
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from peel import file_util
 import json
 import os
+import socket
 import struct
 import hashlib
+import time
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
 
 MAGIC_NUMBER = 0x45020003
+HEADER = struct.Struct('<IIIIQ')
+
+DATA_CONNECTIONS = 2  # separate connections to the recorder for file transfers
+PIPELINE = 2  # file requests kept outstanding on each data connection
+DATA_TIMEOUT = 10
+NEGOTIATE_TIMEOUT = 2
+MAX_CHUNK = 64 * 1048576  # largest decompressed chunk accepted from the recorder
+CHUNK_LENGTH = struct.Struct('<I')
+
+
+def pack_message(code, message=None):
+    encoded = message.encode('utf-8') if message else b''
+    return HEADER.pack(MAGIC_NUMBER, code, 0, len(encoded), 0) + encoded
+
+
+def compression_methods():
+    """ Compression the harvest can decode, best first.  zstd and lz4 need their modules
+        installed, zlib is always there """
+    ret = []
+    if zstandard is not None:
+        ret.append("zstd")
+    if lz4 is not None:
+        ret.append("lz4")
+    ret.append("zlib")
+    return ret
+
+
+def decompressor(method):
+    """ Function to decompress one chunk for a compression method """
+    if method == "zstd":
+        context = zstandard.ZstdDecompressor()
+        return lambda data: context.decompress(data, max_output_size=MAX_CHUNK)
+    if method == "lz4":
+        return lz4.frame.decompress
+    if method == "zlib":
+        return zlib.decompress
+    raise ValueError(f"Unknown compression: {method}")
+
+
+class RecorderCatalog:
+    """ Local copy of the recorder's file list, kept between harvests.
+
+        Recorders that number their changes send a "seq" with the list.  After that the
+        list request carries {"since": seq} and the recorder replies with only the files
+        added or changed since then, {"delta": true, "files": [...], "removed": [...],
+        "seq": n}, which is merged in.  A reply without "delta" (older recorders, or a
+        recorder that no longer knows the sequence number) replaces the whole list.
+        Entries are file names, or {"name": .., "size": ..} dicts.
+    """
+
+    def __init__(self):
+        self.files = {}  # name -> size or None, in the recorder's order
+        self.seq = None
+        self.changed = 0  # entries in the last reply
+
+    def __len__(self):
+        return len(self.files)
+
+    def reset(self):
+        self.files = {}
+        self.seq = None
+
+    def request(self):
+        """ Body for the file list request, None to ask for everything """
+        if self.seq is None:
+            return None
+        return json.dumps({"since": self.seq})
+
+    def apply(self, response):
+        """ Merge a file list reply from the recorder """
+        if not response.get("delta"):
+            self.files = {}
+
+        for name in response.get("removed", []):
+            self.files.pop(name, None)
+
+        entries = response.get("files", [])
+        for entry in entries:
+            if isinstance(entry, dict):
+                name, size = entry.get("name"), entry.get("size")
+            else:
+                name, size = entry, None
+            if name:
+                self.files[name] = size
+
+        self.seq = response.get("seq")
+        self.changed = len(entries)
 
 
 class Parser(tcp.TcpBase, QtCore.QObject):
@@ -46,9 +150,8 @@ class Parser(tcp.TcpBase, QtCore.QObject):
 
     # Harvest
     received_file_list = QtCore.Signal()
-    file_is_done = QtCore.Signal(str)
+    file_is_done = QtCore.Signal(str, str)  # file name, integrity hash
     file_has_failed = QtCore.Signal(str)
-    bytes_added = QtCore.Signal(int)
 
     def __init__(self, parent):
         super().__init__(parent)
@@ -58,6 +161,7 @@ class Parser(tcp.TcpBase, QtCore.QObject):
         self.data = b''
         self.recording = False
         self.file_list = None
+        self.catalog = RecorderCatalog()
 
         # File transfer state
         self.current_file = None
@@ -65,10 +169,12 @@ class Parser(tcp.TcpBase, QtCore.QObject):
         self.file_code = None
         self.file_size = 0
         self.file_received = 0
+        self.total_received = 0  # all file bytes received, only goes up, read by the harvest ui
         self.file_handle = None
         self.file_path = ""
         self.expected_hash = None
         self.hash_calc = hashlib.sha256()
+        self.digest = None  # integrity hash for the harvest hash list, the recorder checks sha256
         self.out_dir = None
 
     def reset(self):
@@ -94,7 +200,7 @@ class Parser(tcp.TcpBase, QtCore.QObject):
     def get_file_list(self, out_dir):
         print("Requesting file list")
         self.out_dir = out_dir
-        self.send(110)
+        self.send(110, self.catalog.request())
 
     def get_file(self, file_name):
         print("Transferring: " + str(file_name))
@@ -207,6 +313,7 @@ class Parser(tcp.TcpBase, QtCore.QObject):
         elif code == 111:
             print("Take list received")
             self.file_list = json.loads(blob)
+            self.catalog.apply(self.file_list)
             self.received_file_list.emit()
             return self.KEEP_PARSING
 
@@ -223,6 +330,7 @@ class Parser(tcp.TcpBase, QtCore.QObject):
         self.file_size = size
         self.file_received = 0
         self.hash_calc = hashlib.sha256()
+        self.digest = integrity.new_hash()
         self.file_path = os.path.join(self.out_dir, self.current_file)
 
         print(f"Transfer {self.file_path} size: {size}")
@@ -254,10 +362,11 @@ class Parser(tcp.TcpBase, QtCore.QObject):
 
         if self.file_handle is not None:
             self.hash_calc.update(file_data)
+            self.digest.update(file_data)
             self.file_handle.write(file_data)
 
         self.file_received += len(file_data)
-        self.bytes_added.emit(len(file_data))
+        self.total_received += len(file_data)
 
     def finish_file(self):
 
@@ -265,6 +374,7 @@ class Parser(tcp.TcpBase, QtCore.QObject):
             self.file_handle.close()
 
         actual_hash = self.hash_calc.digest()
+        digest = self.digest.hexdigest()
 
         okay = actual_hash == self.expected_hash
 
@@ -283,7 +393,7 @@ class Parser(tcp.TcpBase, QtCore.QObject):
 
         if okay:
             # print(f"File received and verified successfully: {self.file_path}")
-            self.file_is_done.emit(current)
+            self.file_is_done.emit(current, digest)
         else:
             print("Hash mismatch! File may be corrupted.")
             self.file_has_failed.emit(current)
@@ -321,42 +431,342 @@ class Parser(tcp.TcpBase, QtCore.QObject):
         return True
 
 
+class DataProtocolError(IOError):
+    """ The recorder sent something that is not part of the data connection protocol, e.g. an
+        older recorder that treats every connection as a control connection """
+
+
+class _Hashes:
+    """ The recorder's sha256 and the harvest integrity hash, updated together """
+
+    def __init__(self):
+        self.sha256 = hashlib.sha256()
+        self.digest = integrity.new_hash()
+
+    def update(self, data):
+        self.sha256.update(data)
+        self.digest.update(data)
+
+
+class DataConnection:
+    """ A connection to the recorder used only for file transfers, so the device's control
+        connection stays free for heartbeats and status while files stream.  Requests are
+        sent ahead of time so the recorder can start on the next file as soon as one ends,
+        the files come back in the order they were asked for.  Blocking, for harvest threads.
+
+        If compression is given (a list of methods, see compression_methods()) it is offered
+        with a 114 message when the connection opens and the recorder answers with 115
+        {"compression": method or null}.  Files are then sent as 116 instead of 113: the
+        same header and sha256 of the original data, followed by chunks that are each a
+        uint32 length and the chunk compressed on its own.  Raises if the recorder does not
+        answer, the caller should connect again without compression.
+
+        Recorders that do not support data connections either do not answer (socket.timeout)
+        or answer as if it was a control connection (DataProtocolError).
+    """
+
+    def __init__(self, thread, host, port, compression=None):
+        self.thread = thread
+        self.sock = socket.create_connection((host, port), timeout=DATA_TIMEOUT)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        transfer.tune_socket(self.sock)
+        self.requested = deque()
+        self.method = None
+        self.decompress = None
+        self.wire = 0  # bytes read from the socket for the current file
+
+        if compression:
+            try:
+                self.negotiate(compression)
+            except Exception:
+                self.close()
+                raise
+
+    def negotiate(self, compression):
+        self.sock.settimeout(NEGOTIATE_TIMEOUT)
+        self.sock.sendall(pack_message(114, json.dumps({"compression": compression})))
+        _, size = self.read_header((115,))
+        reply = json.loads(self.read_exact(size)) if size else {}
+        self.sock.settimeout(DATA_TIMEOUT)
+
+        method = reply.get("compression")
+        if method:
+            self.decompress = decompressor(method)
+            self.method = method
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+    def request(self, file_item):
+        self.sock.sendall(pack_message(112, file_item.remote_file))
+        self.requested.append(file_item)
+
+    def read_exact(self, size):
+        data = bytearray()
+        while len(data) < size:
+            chunk = self.sock.recv(size - len(data))
+            if not chunk:
+                raise IOError("Recorder closed the data connection")
+            data += chunk
+        return bytes(data)
+
+    def read_header(self, codes=(113, 116)):
+        """ Returns (code, size) for the next message with one of codes, answering heartbeats
+            while waiting for it """
+        while True:
+            magic, code, _, size, _ = HEADER.unpack(self.read_exact(HEADER.size))
+            if magic != MAGIC_NUMBER:
+                raise DataProtocolError(f"Bad header: {magic}")
+
+            if code in codes:
+                return code, size
+
+            if size:
+                self.read_exact(size)
+
+            if code == 1:
+                self.sock.sendall(pack_message(2))  # Heartbeat response
+            elif code not in (11, 12):
+                raise DataProtocolError(f"Unexpected code on data connection: {code}")
+
+    def receive(self, file_item, local_path):
+        """ Read the next file on the connection, which must be file_item, to local_path """
+        if not self.requested or self.requested[0] is not file_item:
+            raise IOError("Data connection is out of step")
+
+        code, size = self.read_header()
+        size -= 32
+        expected_hash = self.read_exact(32)
+        self.requested.popleft()
+
+        if code == 116 and self.decompress is None:
+            raise DataProtocolError("Compressed file on a connection without compression")
+
+        file_item.file_size = size
+        hashes = _Hashes()
+        start = time.monotonic()
+        self.wire = 0
+        with transfer.FileSink(self.thread, file_item, local_path, size=size, digest=hashes,
+                               write_behind=True) as sink:
+            if code == 116:
+                received = sink.fill(transfer.chunk_reader(self.chunks(size)), limit=size)
+            else:
+                received = sink.fill(self.sock.recv_into, limit=size)
+
+        if received < size:
+            raise IOError("Recorder closed the data connection")
+
+        if hashes.sha256.digest() != expected_hash:
+            os.unlink(local_path)
+            raise ValueError("Hash mismatch! File may be corrupted.")
+
+        if code == 116:
+            self.report(file_item, size, time.monotonic() - start)
+
+        file_item.hash = hashes.digest.hexdigest()
+        return DownloadThread.COPY_OK
+
+    def chunks(self, size):
+        """ The decompressed data of a 116 file, chunk by chunk """
+        done = 0
+        while done < size:
+            length, = CHUNK_LENGTH.unpack(self.read_exact(CHUNK_LENGTH.size))
+            data = self.decompress(self.read_exact(length))
+            self.wire += CHUNK_LENGTH.size + length
+            done += len(data)
+            yield data
+
+    def report(self, file_item, size, elapsed):
+        """ Log how well a compressed file transferred """
+        ratio = size / self.wire if self.wire else 0
+        rate = file_util.pretty_bytes(size / elapsed) if elapsed > 0 else "-"
+        self.thread.log(f"{file_item.remote_file}: {self.method} {ratio:.1f}:1, "
+                        f"{file_util.pretty_bytes(self.wire)} sent, {rate}/s")
+
+
 class PeelRecordDownloadThread(DownloadThread):
-    def __init__(self, directory, parser: Parser):
+
+    """ Gets the file list on the device's control connection, then downloads the files over
+        DATA_CONNECTIONS separate connections with PIPELINE requests outstanding on each.
+        Recorders that do not accept the extra connections are downloaded one file at a time
+        on the control connection.  So are the rest of the files if a data connection times out
+        or gets a protocol error before any file has come back on one, the recorder does not
+        support them and each file would otherwise wait out DATA_TIMEOUT. """
+
+    def __init__(self, directory, parser: Parser, compress=False):
         super().__init__(directory)
         self.parser = parser
+        self.compress = compress
         self.parser.reset()
         self.current_index = 0
+        self.data_supported = None  # True once a file has come back on a data connection
+        self.deferred = []  # files left for the control connection by the data connections
+        self.control_todo = deque()  # indexes of the files to get on the control connection
 
         parser.received_file_list.connect(self.got_file_list, QtCore.Qt.QueuedConnection)
         parser.file_is_done.connect(self.got_file, QtCore.Qt.QueuedConnection)
         parser.file_has_failed.connect(self.handle_file_failed, QtCore.Qt.QueuedConnection)
-        parser.bytes_added.connect(self.handle_bytes_added, QtCore.Qt.QueuedConnection)
+        self.parser_connected = True
         self.directory = directory
+        self.received_start = parser.total_received
 
-    def handle_bytes_added(self, sz):
-        self.add_bytes(sz)
+    def teardown(self):
+        # The parser belongs to the device and is used again by the next harvest
+        if self.parser_connected:
+            self.parser_connected = False
+            self.parser.received_file_list.disconnect(self.got_file_list)
+            self.parser.file_is_done.disconnect(self.got_file)
+            self.parser.file_has_failed.disconnect(self.handle_file_failed)
+        super().teardown()
+
+    def transferred(self):
+        # Files downloaded on the control connection are counted by the parser
+        return self.parser.total_received - self.received_start + self.bytes_total
 
     def got_file_list(self):
 
-        device_files = self.parser.file_list["files"]
+        catalog = self.parser.catalog
 
         self.files = []
-        for file_item in device_files:
-            if self.download_take_check(os.path.splitext(file_item)[0]):
+        for name, size in catalog.files.items():
+            if self.download_take_check(os.path.splitext(name)[0]):
+                file_item = FileItem(name, name)
+                file_item.file_size = size
                 self.files.append(file_item)
 
-        print(f"{len(self.files)} files to download of {len(device_files)}")
+        print(f"{len(self.files)} files to download of {len(catalog)}, {catalog.changed} listed by the recorder")
+
+        if self.priority is not None:
+            # Split between the data connections most important first
+            self.files.sort(key=self.priority_key)
         if len(self.files) == 0:
             print("No files on device")
             self.set_finished()
-        else:
-            # Get started
-            self.current_index = 0
-            self.parser.get_file(self.files[0])
+            return
+
+        try:
+            connection = self.open_connection()
+        except OSError as e:
+            print(f"Could not open a data connection, using the control connection: {e}")
+            self.download_control(range(len(self.files)))
+            return
 
-    def got_file(self, name):
+        self.download_streams(connection)
+
+        if self.deferred and self.is_running():
+            deferred = set(id(i) for i in self.deferred)
+            self.download_control(i for i, file_item in enumerate(self.files) if id(file_item) in deferred)
+            return
+
+        self.set_finished()
+
+    def download_control(self, indexes):
+        """ Download files one at a time on the device's control connection, got_file() and
+            handle_file_failed() ask for the next one """
+        self.control_todo = deque(indexes)
+        self.do_next()
+
+    def data_failed(self, error):
+        """ Stop using data connections for the rest of this harvest """
+        if self.data_supported is not False:
+            self.data_supported = False
+            self.log(f"Data connections are not supported, using the control connection: {error}")
+
+    def open_connection(self):
+        """ New data connection, offering compression if it is turned on and the recorder
+            has not failed to answer the offer before """
+        if self.compress:
+            try:
+                return DataConnection(self, self.parser.host, self.parser.port, compression_methods())
+            except (OSError, ValueError) as e:
+                print(f"Recorder did not agree compression, downloading without: {e}")
+                self.compress = False
+
+        return DataConnection(self, self.parser.host, self.parser.port)
+
+    def download_streams(self, connection):
+        """ Split the files between the data connections and download them """
+        count = min(DATA_CONNECTIONS, len(self.files))
+        groups = [list(enumerate(self.files))[i::count] for i in range(count)]
+        connections = [connection] + [None] * (count - 1)
+
+        self.file_progress = True
+        try:
+            with ThreadPoolExecutor(max_workers=count) as pool:
+                for items, each in zip(groups, connections):
+                    pool.submit(self.stream_files, items, each)
+        finally:
+            self.file_progress = False
+
+        self.set_current(len(self.files))
+
+    def stream_files(self, items, connection):
+        """ Download items, [(index, FileItem)], on one data connection, or a new one if
+            connection is None.  Keeps the next files requested while each one streams. """
+        todo = deque()
+        for index, file_item in items:
+            if self.ledger_path(file_item) is not None:
+                self.download_file(index, file_item, None)  # harvested before, skipped
+            else:
+                todo.append((index, file_item))
+
+        def fetch(file_item, local_path):
+            nonlocal connection
+
+            if self.data_supported is False:
+                self.deferred.append(file_item)
+                raise DeferredFile()
+
+            if connection is not None and connection.requested and connection.requested[0] is not file_item:
+                # Out of step, e.g. a file was not downloaded after it had been asked for
+                connection.close()
+                connection = None
+
+            try:
+                if connection is None:
+                    connection = self.open_connection()
+
+                if not connection.requested:
+                    connection.request(file_item)
+
+                # Files after this one that have not been asked for yet
+                while len(connection.requested) < PIPELINE and len(connection.requested) <= len(todo):
+                    connection.request(todo[len(connection.requested) - 1][1])
+
+                ret = connection.receive(file_item, local_path)
+                self.data_supported = True
+                return ret
+
+            except OSError as e:
+                if connection is not None:
+                    connection.close()
+                    connection = None
+                if self.data_supported is not True and isinstance(e, (socket.timeout, DataProtocolError)):
+                    # No file has come back on a data connection, the recorder does not support them
+                    self.data_failed(e)
+                    self.deferred.append(file_item)
+                    raise DeferredFile()
+                raise
+
+        try:
+            while todo and self.is_running():
+                index, file_item = todo.popleft()
+                self.download_file(index, file_item, fetch)
+        finally:
+            if connection is not None:
+                connection.close()
+
+    def got_file(self, name, hash_value):
+        file_item = FileItem(name, name)
+        file_item.hash = hash_value
+        local_path = os.path.join(self.directory, name)
+        self.ledger_record(file_item, local_path)
+        self.manifest_add(file_item, local_path)
         self.file_ok(name)
+        self.file_saved.emit(local_path)
         self.do_next()
 
     def handle_file_failed(self, name):
@@ -364,12 +774,12 @@ class PeelRecordDownloadThread(DownloadThread):
         self.do_next()
 
     def do_next(self):
-        self.current_index += 1
-        if self.current_index == len(self.files):
+        if not self.control_todo:
             self.set_finished()
             return
 
-        self.parser.get_file(self.files[self.current_index])
+        self.current_index = self.control_todo.popleft()
+        self.parser.get_file(self.files[self.current_index].remote_file)
 
     def process(self):
         # Called on a thread
@@ -383,6 +793,33 @@ class PeelRecorderWidget(SimpleDeviceWidget):
         super().__init__(settings, "PeelRecorder", has_host=True, has_port=True,
                          has_broadcast=False, has_listen_ip=False, has_listen_port=False)
 
+        self.compress_cb = QtWidgets.QCheckBox("")
+        self.compress_cb.setChecked(settings.value(self.title + "Compress") == "True")
+        self.compress_cb.setToolTip("Ask the recorder to compress files while harvesting, "
+                                    "for slow (e.g. wifi) links")
+        self.form_layout.addRow("Compress Harvest", self.compress_cb)
+
+    def populate_from_device(self, device):
+        super().populate_from_device(device)
+        self.compress_cb.setChecked(device.compress is True)
+
+    def update_device(self, device, data=None):
+        if data is None:
+            data = {}
+
+        data["compress"] = self.compress_cb.isChecked()
+
+        return super().update_device(device, data)
+
+    def do_add(self):
+
+        if not super().do_add():
+            return False
+
+        self.settings.setValue(self.title + "Compress", str(self.compress_cb.isChecked()))
+
+        return True
+
 
 class PeelRecorder(PeelDeviceBase):
 
@@ -395,6 +832,7 @@ class PeelRecorder(PeelDeviceBase):
         super().__init__(name)
         self.host = None
         self.port = 4455
+        self.compress = False
         self.parser = None
         self.running = False
         self.udp_listener = udp.UdpBroadcastListener(self)
@@ -456,6 +894,7 @@ class PeelRecorder(PeelDeviceBase):
         self.name = name
         self.host = kwargs.get("host", "")
         self.port = kwargs.get("port", self.port)
+        self.compress = kwargs.get("compress", self.compress)
         return True
 
     def connect_device(self):
@@ -473,7 +912,7 @@ class PeelRecorder(PeelDeviceBase):
 
     def as_dict(self):
         """ Return the parameters to the constructor as a dict, to be saved in the peelcap file """
-        return {'name': self.name, 'host': self.host, 'port': self.port}
+        return {'name': self.name, 'host': self.host, 'port': self.port, 'compress': self.compress}
 
     def get_info(self, reason=None):
         """ return a string to show the state of the device in the main ui """
@@ -526,7 +965,7 @@ class PeelRecorder(PeelDeviceBase):
 
     def harvest(self, directory):
         """ Copy all the take files from the device to directory """
-        return PeelRecordDownloadThread(directory, self.parser)
+        return PeelRecordDownloadThread(directory, self.parser, self.compress)
 
     def list_takes(self):
         return []
@@ -0,0 +1,59 @@
+class RttEstimator:
+    """ Keeps track of the round trip time to a device and provides a timeout to use for
+    requests, using the smoothed rtt + 4 x variance estimate that tcp uses (rfc 6298).
+    The initial value is used until the first sample arrives.  Each timeout doubles the
+    value until a good sample is seen, so a slow wifi device relaxes and a healthy lan
+    device tightens up.
+
+    The samples include the time the device takes to handle the request, not just the
+    network.  The default floor is rfc 6298's 1 second, wired lan devices that answer
+    quickly pass LAN_MINIMUM so their timeout can tighten below it.
+    """
+
+    ALPHA = 0.125
+    BETA = 0.25
+    MINIMUM = 1.0
+    LAN_MINIMUM = 0.2
+
+    def __init__(self, initial=1.0, minimum=MINIMUM, maximum=10.0):
+        self.initial = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.srtt = None
+        self.rttvar = None
+        self.backoff = 1
+        self.samples = 0
+
+    def add_sample(self, seconds):
+        """ A request to the device took this many seconds to complete """
+        if self.srtt is None:
+            self.srtt = seconds
+            self.rttvar = seconds / 2
+        else:
+            self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - seconds)
+            self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * seconds
+        self.backoff = 1
+        self.samples += 1
+
+    def add_timeout(self):
+        """ A request to the device timed out """
+        self.backoff = min(self.backoff * 2, 64)
+
+    def timeout(self, minimum=None, maximum=None):
+        """ Returns the timeout in seconds, optionally clamped tighter than the defaults """
+        if self.srtt is None:
+            value = self.initial
+        else:
+            value = self.srtt + max(0.01, 4 * self.rttvar)
+
+        value *= self.backoff
+
+        value = max(value, self.minimum if minimum is None else minimum)
+        value = min(value, self.maximum if maximum is None else maximum)
+        return value
+
+    def info(self):
+        """ Text for the device info, empty until there is something to show """
+        if self.srtt is None:
+            return ""
+        return f"rtt {self.srtt * 1000:.0f}ms"
@@ -36,6 +36,7 @@ except ImportError:
     cmd = None
 
 import time
+import threading
 import os.path, os
 """
 capture_services:
@@ -158,6 +159,10 @@ class ViconShogun(PeelDeviceBase):
         self.takes = []
         self.timecode = None
         self.subjects = None
+        self.cued = None
+        self.recording = False  # set by record without the lock, a pending cue checks it and gives up
+        # Playback is cued from a background thread, keep the review calls from overlapping
+        self.api_lock = threading.Lock()
 
     @staticmethod
     def device():
@@ -306,27 +311,59 @@ class ViconShogun(PeelDeviceBase):
             cmd.writeLog("Shogun: No client")
             return
 
+        if command == "selectedTake" and self.record_id is None and arg:
+            self.precue(arg)
+            return
+
         if command == "play" and self.record_id is None:
-            if self.play_id is not None:
-                self.playback.exit_review()
-                time.sleep(0.2)
-
-            if arg is None or len(arg) == 0:
-                self.playback.enter_live_review()
-                self.playback.play()
-                self.play_id = True
-            else:
-                self.playback.enter_capture_review(arg)
-                self.playback.play()
-                self.play_id = arg
+            with self.api_lock:
+                if arg and self.cued == arg:
+                    # Review was loaded when the take was selected
+                    self.playback.play()
+                    self.play_id = arg
+                    self.cued = None
+
+                else:
+                    self.cued = None
+                    if self.play_id is not None:
+                        self.playback.exit_review()
+                        time.sleep(0.2)
+
+                    if arg is None or len(arg) == 0:
+                        self.playback.enter_live_review()
+                        self.playback.play()
+                        self.play_id = True
+                    else:
+                        self.playback.enter_capture_review(arg)
+                        self.playback.play()
+                        self.play_id = arg
 
         if command == "record":
+            # Never wait on a cue, a cue in progress sees the flag and backs out of review itself
+            self.recording = True
+            if self.api_lock.acquire(blocking=False):
+                try:
+                    if self.play_id is not None:
+                        self.playback.exit_review()
+                        time.sleep(0.2)
+                    elif self.cued is not None:
+                        # Only cued, nothing is playing so there is nothing to wait for
+                        self.playback.exit_review()
+                    self.cued = None
+                    self.play_id = None
+                finally:
+                    self.api_lock.release()
+
             ret = self.capture.set_capture_name(arg)
             if not ret:
+                self.recording = False
                 cmd.writeLog("Could not set capture name for shogun")
                 self.error = "Capture Name Error"
                 return
             ret, self.record_id = self.capture.start_capture()
+            if not ret:
+                self.recording = False
+
             if not ret:
                 self.error = "Could not record"
                 cmd.writeLog("Shogun could not record")
@@ -343,9 +380,12 @@ class ViconShogun(PeelDeviceBase):
             if self.record_id:
                 ret = self.capture.stop_capture(self.record_id)
                 self.record_id = None
-            if self.play_id:
-                ret = self.playback.exit_review()
-                self.play_id = None
+            with self.api_lock:
+                self.recording = False
+                if self.play_id or self.cued:
+                    ret = self.playback.exit_review()
+                    self.play_id = None
+                    self.cued = None
 
             if not ret:
                 self.error = "Could not stop"
@@ -371,6 +411,34 @@ class ViconShogun(PeelDeviceBase):
             # state right away
             QtCore.QTimer.singleShot(500, self.do_update_state)
 
+    def precue(self, take):
+        """ Enter review for a take in the background when it is selected, so play only
+            needs to start playback """
+
+        def do_cue():
+            with self.api_lock:
+                # Record does not wait for the lock, so give up between steps once it starts
+                if self.recording:
+                    return
+                try:
+                    if self.play_id is not None or self.cued is not None:
+                        self.playback.exit_review()
+                        self.play_id = None
+                        self.cued = None
+                        time.sleep(0.2)
+                        if self.recording:
+                            return
+                    self.playback.enter_capture_review(take)
+                    self.cued = take
+                    if self.recording:
+                        # Recording started while the review loaded, go back to live
+                        self.cued = None
+                        self.playback.exit_review()
+                except Exception as e:
+                    cmd.writeLog(f"Shogun could not cue {take}: {e}\n")
+
+        threading.Thread(target=do_cue, daemon=True).start()
+
     def do_update_state(self):
         print("Getting shogun state")
         self.update_state(self.get_state(), self.get_info())
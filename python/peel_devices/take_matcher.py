@@ -0,0 +1,105 @@
+from collections import deque
+from peel import file_util
+
+
+class TakeMatcher:
+    """ Finds the take a device file belongs to, for the harvest match modes:
+            Exact       - the file name is the take name
+            Starts With - the file name starts with the take name
+            Contains    - the take name is somewhere in the file name
+
+        Take names are formatted for the device and normalised once when the matcher is
+        built, after that each lookup only walks the file name: a dict for exact matches,
+        a trie for prefixes and an Aho-Corasick automaton for contains.  Where several takes
+        match, the longest (most specific) one is returned.
+    """
+
+    def __init__(self, takes, match_mode, formatting=None):
+        self.match_mode = match_mode
+        self.takes = {}  # normalised, formatted name -> take
+
+        for take in takes:
+            name = formatting.format_take(take) if formatting else take
+            key = file_util.fix_name(name)
+            if key:
+                self.takes.setdefault(key, take)
+
+        # Trie nodes: children dict per node, output is the take ending at the node
+        self.children = [{}]
+        self.output = [None]
+        self.depth = [0]
+        self.fail = None
+        self.best = None
+
+        if match_mode in ("Starts With", "Contains"):
+            for key, take in self.takes.items():
+                self.insert(key, take)
+
+        if match_mode == "Contains":
+            self.build_links()
+
+    def __len__(self):
+        return len(self.takes)
+
+    def insert(self, key, take):
+        node = 0
+        for c in key:
+            nxt = self.children[node].get(c)
+            if nxt is None:
+                nxt = len(self.children)
+                self.children[node][c] = nxt
+                self.children.append({})
+                self.output.append(None)
+                self.depth.append(self.depth[node] + 1)
+            node = nxt
+        self.output[node] = take
+
+    def build_links(self):
+        """ Failure links for the automaton, and the node of the longest take ending at each node """
+        self.fail = [0] * len(self.children)
+        self.best = [i if take is not None else None for i, take in enumerate(self.output)]
+
+        queue = deque(self.children[0].values())
+        while queue:
+            node = queue.popleft()
+            for c, child in self.children[node].items():
+                f = self.fail[node]
+                while f and c not in self.children[f]:
+                    f = self.fail[f]
+                target = self.children[f].get(c, 0)
+                self.fail[child] = target if target != child else 0
+                if self.best[child] is None:
+                    self.best[child] = self.best[self.fail[child]]
+                queue.append(child)
+
+    def match(self, file_name):
+        """ Returns the take for a file name (no extension), or None """
+        key = file_util.fix_name(file_name)
+
+        if self.match_mode == "Exact":
+            return self.takes.get(key)
+
+        if self.match_mode == "Starts With":
+            found = None
+            node = 0
+            for c in key:
+                node = self.children[node].get(c)
+                if node is None:
+                    break
+                if self.output[node] is not None:
+                    found = self.output[node]
+            return found
+
+        if self.match_mode == "Contains":
+            found = None
+            node = 0
+            for c in key:
+                while node and c not in self.children[node]:
+                    node = self.fail[node]
+                node = self.children[node].get(c, 0)
+                best = self.best[node]
+                if best is not None and (found is None or self.depth[best] > self.depth[found]):
+                    found = best
+            return None if found is None else self.output[found]
+
+        return None
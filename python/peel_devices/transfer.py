@@ -0,0 +1,420 @@
+import ftplib
+import json
+import os
+import queue
+import re
+import socket
+import threading
+from peel_devices import integrity
+
+
+PARTIAL_SUFFIX = ".partial"
+CHUNK_SIZE = 1048576
+RECV_BUFFER = 4 * 1048576  # socket receive buffer for transfers
+WRITE_BEHIND_BUFFERS = 4
+
+
+class PartialFile:
+    """ Sidecar file (<local file>.partial) kept next to a download while it is in progress.
+        Records where the data came from and how big it should be, so a transfer that was
+        interrupted can carry on from the bytes already on disk.  Once the transfer finishes
+        the size is checked and the sidecar removed. """
+
+    def __init__(self, local_path):
+        self.local_path = local_path
+        self.path = local_path + PARTIAL_SUFFIX
+        self.remote = None
+        self.size = None
+        self.preallocated = False
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, "r") as fp:
+                data = json.load(fp)
+            self.remote = data.get("remote")
+            self.size = data.get("size")
+            self.preallocated = data.get("preallocated", False)
+        except (IOError, ValueError):
+            self.remote = None
+            self.size = None
+            self.preallocated = False
+
+    def exists(self):
+        return os.path.isfile(self.path)
+
+    def offset(self, remote, size=None):
+        """ Number of bytes on disk that can be kept for this remote file, 0 to start again """
+        if not self.exists() or self.remote != remote:
+            return 0
+
+        if size is not None and self.size is not None and size != self.size:
+            # The file on the device has changed
+            return 0
+
+        if self.preallocated:
+            # Stopped without trimming the file back to the data received
+            return 0
+
+        if not os.path.isfile(self.local_path):
+            return 0
+
+        on_disk = os.path.getsize(self.local_path)
+        if self.size is not None and on_disk > self.size:
+            return 0
+
+        return on_disk
+
+    def start(self, remote, size):
+        """ Record the transfer before any data is written """
+        self.remote = remote
+        self.size = size
+        self.preallocated = False
+        self.save()
+
+    def set_preallocated(self, value):
+        """ The local file is being extended to the full size before the data arrives, so its
+            size does not show how much has been received until the sink trims it """
+        if self.exists() and self.preallocated != value:
+            self.preallocated = value
+            self.save()
+
+    def save(self):
+        with open(self.path, "w") as fp:
+            json.dump({"remote": self.remote, "size": self.size, "preallocated": self.preallocated}, fp)
+
+    def complete(self):
+        """ Check the local file is the expected size and remove the sidecar.  Raises IOError and
+            keeps the sidecar (so the transfer can be resumed) if the file is short """
+        on_disk = os.path.getsize(self.local_path)
+        if self.size is not None and on_disk != self.size:
+            raise IOError(f"Incomplete download: {on_disk} of {self.size} bytes")
+        self.discard()
+
+    def discard(self):
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
+
+def tune_socket(sock, size=RECV_BUFFER):
+    """ Ask for a large receive buffer so the sender is not held up while we write to disk """
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, size)
+    except OSError:
+        pass
+
+
+class FileSink:
+    """ Writes a download to local_path for a DownloadThread.
+
+        Data is read straight into reusable buffers with a readinto(buffer) function (e.g.
+        socket.recv_into) rather than allocating for every read.  When the size is known the
+        file is extended to it up front so the filesystem can lay it out in one piece, and
+        trimmed back to the data received if the transfer does not finish.
+
+        With write_behind the disk writes (and hashing) happen on a second thread while the
+        next buffer is being received.
+
+        partial is the PartialFile for resumable transfers, its sidecar is marked while the
+        file is preallocated.  digest, if given, is updated with the data in order.
+    """
+
+    def __init__(self, thread, file_item, local_path, offset=0, size=None, digest=None,
+                 partial=None, write_behind=False, buffer_size=CHUNK_SIZE):
+        self.thread = thread
+        self.file_item = file_item
+        self.digest = digest
+        self.partial = partial
+        self.buffer_size = buffer_size
+        self.position = offset  # bytes of the file on disk
+        self.preallocated = False
+        self.error = None
+
+        if offset:
+            self.fp = open(local_path, "r+b")
+            self.fp.truncate(offset)
+        else:
+            self.fp = open(local_path, "wb")
+
+        if size and size > offset:
+            self.preallocate(size)
+        self.fp.seek(offset)
+
+        count = WRITE_BEHIND_BUFFERS if write_behind else 1
+        self.free = queue.Queue()
+        for _ in range(count):
+            self.free.put(memoryview(bytearray(buffer_size)))
+
+        self.full = None
+        self.writer = None
+        if write_behind:
+            self.full = queue.Queue()
+            self.writer = threading.Thread(target=self.write_loop, daemon=True)
+            self.writer.start()
+
+    def preallocate(self, size):
+        if self.partial is not None:
+            self.partial.set_preallocated(True)
+        try:
+            if hasattr(os, "posix_fallocate"):
+                os.posix_fallocate(self.fp.fileno(), self.position, size - self.position)
+            else:
+                self.fp.truncate(size)
+            self.preallocated = True
+        except OSError as e:
+            print(f"Could not preallocate {self.fp.name}: {e}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def fill(self, readinto, limit=None):
+        """ Read with readinto(buffer) until it returns 0 (or limit bytes have been read),
+            writing everything to the file.  Returns the number of bytes read """
+        received = 0
+        while limit is None or received < limit:
+            if not self.thread.is_running():
+                raise IOError("Stopped")
+
+            if self.error is not None:
+                raise self.error
+
+            buffer = self.free.get()
+            if limit is not None and limit - received < len(buffer):
+                view = buffer[:limit - received]
+            else:
+                view = buffer
+
+            try:
+                n = readinto(view)
+            except BaseException:
+                self.free.put(buffer)
+                raise
+
+            if not n:
+                self.free.put(buffer)
+                break
+
+            self.write(buffer, n)
+            received += n
+            self.thread.add_file_bytes(self.file_item, n)
+
+        return received
+
+    def write(self, buffer, n):
+        if self.full is not None:
+            self.full.put((buffer, n))
+            return
+        self.write_buffer(buffer, n)
+        self.free.put(buffer)
+
+    def write_buffer(self, buffer, n):
+        data = buffer[:n]
+        self.fp.write(data)
+        if self.digest is not None:
+            self.digest.update(data)
+        self.position += n
+
+    def write_loop(self):
+        while True:
+            item = self.full.get()
+            if item is None:
+                return
+            buffer, n = item
+            try:
+                if self.error is None:
+                    self.write_buffer(buffer, n)
+            except Exception as e:
+                self.error = e
+            self.free.put(buffer)
+
+    def close(self):
+        """ Finish the writes and close the file, trimming it to the data written """
+        if self.writer is not None:
+            self.full.put(None)
+            self.writer.join()
+            self.writer = None
+
+        if self.preallocated:
+            self.fp.truncate(self.position)
+            if self.partial is not None:
+                self.partial.set_preallocated(False)
+        self.fp.close()
+
+        if self.error is not None:
+            raise self.error
+
+
+def chunk_reader(chunks):
+    """ readinto() for FileSink.fill() over an iterable of bytes """
+    chunks = iter(chunks)
+    pending = memoryview(b"")
+
+    def readinto(buffer):
+        nonlocal pending
+        while not pending:
+            data = next(chunks, None)
+            if data is None:
+                return 0
+            pending = memoryview(data)
+        n = min(len(buffer), len(pending))
+        buffer[:n] = pending[:n]
+        pending = pending[n:]
+        return n
+
+    return readinto
+
+
+def move_aside(path):
+    """ Rename an existing file that is not the one being downloaded to path_0, path_1 ... """
+    for i in range(100):
+        alt_name = f"{path}_{i}"
+        if not os.path.isfile(alt_name):
+            print(f"Renaming {path} to {alt_name}")
+            os.rename(path, alt_name)
+            return
+    raise IOError("Could not rename existing file: " + path)
+
+
+def content_total(response):
+    """ Full size of the remote file from a 200 or 206 response, or None if not known """
+    if response.status_code == 206:
+        m = re.match(r"bytes \d+-\d+/(\d+)", response.headers.get("Content-Range", ""))
+        if m:
+            return int(m.group(1))
+        return None
+
+    length = response.headers.get("Content-Length")
+    return int(length) if length else None
+
+
+def fetch_http(thread, http, path, file_item, local_path, existing="skip", timeout=None):
+    """ Download path with an HttpClient to local_path for a DownloadThread, resuming with a
+        Range request if an earlier attempt was interrupted.
+
+        existing is what to do when local_path is already there without a sidecar:
+            "skip"      - it is complete, don't download
+            "size"      - skip if it is the same size as the remote file, otherwise move it aside
+            "overwrite" - download again
+
+        The data is hashed as it is written, file_item.hash is set when the file is complete.
+
+        Returns DownloadThread.COPY_OK or COPY_SKIP, raises IOError on failure.
+    """
+    partial = PartialFile(local_path)
+
+    if os.path.isfile(local_path) and not partial.exists() and existing == "skip":
+        return thread.COPY_SKIP
+
+    for attempt in range(2):
+
+        offset = partial.offset(path) if attempt == 0 else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+
+        with http.get(path, stream=True, headers=headers, timeout=timeout) as response:
+
+            if offset and response.status_code == 416 and offset == partial.size:
+                # Everything arrived last time, it just wasn't checked off
+                partial.complete()
+                file_item.hash = integrity.hash_file(local_path).hexdigest()
+                return thread.COPY_OK
+
+            if offset and response.status_code != 206:
+                if response.status_code != 200:
+                    # Could not resume, try again from the start
+                    continue
+                # Range was ignored, the whole file is coming
+                offset = 0
+
+            response.raise_for_status()
+            total = content_total(response)
+
+            if offset and total != partial.size:
+                # The file on the device has changed since the partial download
+                continue
+
+            if not offset and os.path.isfile(local_path) and not partial.exists():
+                if existing == "size" and total is not None and os.path.getsize(local_path) == total:
+                    return thread.COPY_SKIP
+                if existing != "overwrite":
+                    move_aside(local_path)
+
+            if not offset:
+                partial.start(path, total)
+
+            file_item.file_size = total
+            file_item.data_size = offset
+
+            # Only the part kept from an earlier attempt is read back
+            digest = integrity.hash_file(local_path, offset) if offset else integrity.new_hash()
+
+            if response.headers.get("Content-Encoding", "identity") == "identity":
+                # Read the body straight into the sink's buffers
+                reader = response.raw.readinto
+            else:
+                reader = chunk_reader(response.iter_content(chunk_size=CHUNK_SIZE))
+
+            with FileSink(thread, file_item, local_path, offset, total, digest, partial,
+                          write_behind=thread.write_behind) as sink:
+                sink.fill(reader)
+
+        partial.complete()
+        file_item.hash = digest.hexdigest()
+        return thread.COPY_OK
+
+    raise IOError("Could not resume the download of " + str(path))
+
+
+def fetch_ftp(thread, ftp, remote, file_item, local_path, existing="skip", size=None):
+    """ Download a file from an ftplib.FTP connection (already in the right directory) to
+        local_path for a DownloadThread, resuming with REST if an earlier attempt was
+        interrupted.  existing is as for fetch_http().  size is the remote file size if the
+        listing gave it, otherwise SIZE is sent. """
+
+    partial = PartialFile(local_path)
+
+    if os.path.isfile(local_path) and not partial.exists() and existing == "skip":
+        return thread.COPY_SKIP
+
+    total = size if size is not None else ftp.size(remote)
+    offset = partial.offset(remote, total)
+
+    if not offset:
+        if os.path.isfile(local_path) and not partial.exists():
+            if existing == "size" and total is not None and os.path.getsize(local_path) == total:
+                return thread.COPY_SKIP
+            if existing != "overwrite":
+                move_aside(local_path)
+        partial.start(remote, total)
+
+    file_item.file_size = total
+    file_item.data_size = offset
+
+    digest = integrity.hash_file(local_path, offset) if offset else integrity.new_hash()
+
+    if not offset or offset != total:
+        with FileSink(thread, file_item, local_path, offset, total, digest, partial,
+                      write_behind=thread.write_behind) as sink:
+
+            # retrbinary() allocates a new block for every read, receive into the sink instead
+            ftp.voidcmd("TYPE I")
+            with ftp.transfercmd("RETR " + remote, rest=offset or None) as conn:
+                tune_socket(conn)
+                try:
+                    sink.fill(conn.recv_into)
+                except BaseException:
+                    # The 226 reply would never be read and the next command on this
+                    # connection would get it, abort the transfer so the control
+                    # connection is left in a known state
+                    try:
+                        ftp.abort()
+                    except ftplib.all_errors:
+                        pass
+                    raise
+            ftp.voidresp()
+
+    partial.complete()
+    file_item.hash = digest.hexdigest()
+    return thread.COPY_OK
@@ -102,6 +102,85 @@ class XmlUdpListenThread(QtCore.QThread):
         self.listen = None
 
 
+class XmlUdpTriggerGroup:
+
+    """ Sends the start / stop packets for all the connected xml udp devices in one burst.
+        The first device to get the record or stop command renders the packets for every
+        device in the group and sends them back to back, the other devices then skip their
+        own send when the command reaches them.  Devices that would receive an identical
+        packet at the same address share a single datagram, so a broadcast host with the
+        same format only gets sent once.
+    """
+
+    def __init__(self):
+        self.devices = []
+        self.packet_id = 0
+        self.sent = {}  # device -> "start" / "stop" for devices already sent by the current burst
+
+    def add(self, device):
+        if device not in self.devices:
+            self.devices.append(device)
+
+    def remove(self, device):
+        if device in self.devices:
+            self.devices.remove(device)
+        self.sent.pop(device, None)
+
+    def fire(self, device, mode, take=None):
+
+        """ mode is "start" or "stop".  Sends the packets for the whole group unless this
+            device's packet has already gone out with the current burst. """
+
+        if self.sent.pop(device, None) == mode:
+            return
+
+        members = [i for i in self.devices if i.enabled and i.udp is not None]
+        if device not in members:
+            members.append(device)
+
+        # Use one packet id for the burst, so devices with the same format and take get
+        # the same payload and can share a datagram
+        self.packet_id += 1
+
+        packets = {}
+        for member in members:
+            member.packet_id = self.packet_id
+            if mode == "start":
+                member.current_take = take
+                msg = member.capture_start_message()
+            else:
+                msg = member.capture_stop_message()
+
+            key = (msg, member.host, member.port)
+            if member.listen_thread is not None:
+                # Replies come back to the socket that sent the packet, so keep it separate
+                key += (id(member),)
+            packets.setdefault(key, []).append(member)
+
+        error = None
+        for (msg, *_), targets in packets.items():
+            try:
+                targets[0].send(msg)
+            except (OSError, OverflowError) as e:
+                if device in targets:
+                    error = e
+            for other in targets[1:]:
+                # Shared the datagram, so show the same result as the device that sent it
+                other.error = targets[0].error
+                if other.error is not None:
+                    other.update_state("ERROR", other.error)
+                else:
+                    other.update_state()
+
+        self.sent = dict((i, mode) for i in members if i is not device)
+
+        if error is not None:
+            raise error
+
+
+TRIGGER_GROUP = XmlUdpTriggerGroup()
+
+
 class XmlUdpDeviceBase(peel_devices.PeelDeviceBase):
 
     """ Base class for devices that receive an xml udp packet to start and stop
@@ -189,6 +268,8 @@ class XmlUdpDeviceBase(peel_devices.PeelDeviceBase):
             if self.broadcast:
                 self.udp.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
 
+        TRIGGER_GROUP.add(self)
+
         self.update_state()
 
     def do_state(self):
@@ -223,6 +304,8 @@ class XmlUdpDeviceBase(peel_devices.PeelDeviceBase):
         self.teardown()
 
     def teardown(self):
+        TRIGGER_GROUP.remove(self)
+
         if self.udp is not None:
             self.udp.close()
             self.udp = None
@@ -235,13 +318,13 @@ class XmlUdpDeviceBase(peel_devices.PeelDeviceBase):
     def command(self, command, arg):
         print(command, arg)
         if command == "record":
-            self.capture_start(arg)
+            TRIGGER_GROUP.fire(self, "start", arg)
             self.recording = True
             self.update_state()
             return
 
         if command == "stop":
-            self.capture_stop()
+            TRIGGER_GROUP.fire(self, "stop")
             self.recording = False
             self.update_state()
             return
@@ -260,6 +343,11 @@ class XmlUdpDeviceBase(peel_devices.PeelDeviceBase):
         # print(f"{self.name} ignored the command: {command} {arg}")
 
     def capture_stop(self):
+        self.send(self.capture_stop_message())
+
+    def capture_stop_message(self):
+
+        """ Returns the xml packet to stop recording for this device's format """
 
         if self.format == "Blade":
             msg = '<?xml version="1.0" encoding="UTF-8" standalone="no" ?>'\
@@ -330,11 +418,15 @@ class XmlUdpDeviceBase(peel_devices.PeelDeviceBase):
                 + '      <Name VALUE="%s" />\n' % self.current_take \
                 + '</CaptureStop>\n'
 
-        self.send(msg)
+        return msg
 
     def capture_start(self, take):
-
         self.current_take = take
+        self.send(self.capture_start_message())
+
+    def capture_start_message(self):
+
+        """ Returns the xml packet to start recording self.current_take for this device's format """
 
         if self.format.lower() == "blade":
             msg = '<?xml version="1.0" encoding="UTF-8" standalone="no" ?>' + \
@@ -409,11 +501,11 @@ class XmlUdpDeviceBase(peel_devices.PeelDeviceBase):
         else:
             msg = '<?xml version="1.0" encoding="UTF-8" standalone="no" ?>\n' \
                 + '<CaptureStart>\n' \
-                + '\t<Name VALUE="%s"/>\n' % take \
+                + '\t<Name VALUE="%s"/>\n' % self.current_take \
                 + '\t<PacketID VALUE="%d"/>\n' % self.packet_id \
                 + '</CaptureStart>\n'
 
-        self.send(msg)
+        return msg
 
     def send(self, msg):
         if self.udp is None:
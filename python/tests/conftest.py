@@ -0,0 +1,33 @@
+""" Tests run outside PeelCapture, so the PeelApp module the application provides is
+    replaced by a stand-in.  When the packages can not be imported at all (e.g. PySide6
+    is not installed) their directories are registered as empty packages so the plain
+    python modules in them can still be tested, tests that need Qt are skipped. """
+
+import importlib
+import os
+import sys
+import types
+from unittest import mock
+
+PYTHON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if PYTHON_DIR not in sys.path:
+    sys.path.insert(0, PYTHON_DIR)
+
+try:
+    importlib.import_module("PeelApp")
+except ImportError:
+    app = types.ModuleType("PeelApp")
+    app.cmd = mock.MagicMock()
+    sys.modules["PeelApp"] = app
+
+try:
+    importlib.import_module("peel")
+except ImportError:
+    for name in list(sys.modules):
+        if name.split(".")[0] in ("peel", "peel_devices"):
+            del sys.modules[name]
+    for name in ("peel_devices", "peel"):
+        package = types.ModuleType(name)
+        package.__path__ = [os.path.join(PYTHON_DIR, name)]
+        sys.modules[name] = package
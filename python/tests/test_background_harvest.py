@@ -0,0 +1,68 @@
+import pytest
+
+background_harvest = pytest.importorskip("peel.background_harvest")
+from peel_devices import DownloadThread
+
+
+class FakeWorker:
+    def __init__(self, status):
+        self.status = status
+        self.torn_down = 0
+
+    def teardown(self):
+        self.torn_down += 1
+
+
+class FakeScheduler:
+    def __init__(self):
+        self.threads = {"thread": None}
+
+    def schedule(self):
+        pass
+
+    def teardown(self):
+        self.threads = {}
+
+
+def make_harvest(*workers):
+    harvest = background_harvest.BackgroundHarvest(None)
+    harvest.scheduler = FakeScheduler()
+    harvest.workers = list(workers)
+    return harvest
+
+
+def test_finished_workers_are_torn_down():
+    done = FakeWorker(DownloadThread.STATUS_FINISHED)
+    running = FakeWorker(DownloadThread.STATUS_RUNNING)
+    harvest = make_harvest(done, running)
+
+    harvest.do_update()
+
+    assert done.torn_down == 1
+    assert running.torn_down == 0
+    assert harvest.workers == [running]
+    assert harvest.scheduler.threads
+
+
+def test_idle_harvest_releases_the_threads():
+    done = FakeWorker(DownloadThread.STATUS_FINISHED)
+    harvest = make_harvest(done)
+
+    harvest.do_update()
+
+    assert done.torn_down == 1
+    assert not harvest.is_busy()
+    assert harvest.scheduler.threads == {}
+
+
+def test_cancel_stops_every_worker():
+    running = FakeWorker(DownloadThread.STATUS_RUNNING)
+    queued = FakeWorker(DownloadThread.STATUS_NONE)
+    harvest = make_harvest(running, queued)
+
+    harvest.cancel()
+
+    assert running.torn_down == 1
+    assert queued.torn_down == 1
+    assert not harvest.is_busy()
+    assert harvest.scheduler.threads == {}
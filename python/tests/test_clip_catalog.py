@@ -0,0 +1,38 @@
+from peel_devices.clip_catalog import ClipCatalog, clip_key
+
+
+def test_clip_key():
+    assert clip_key("/slot1/Take_01.mov") == clip_key("take_01")
+    assert clip_key("C:\\clips\\take_01.mov") == clip_key("take_01")
+
+
+def test_find_in_device_order():
+    catalog = ClipCatalog()
+    assert not catalog.valid
+    catalog.load([("take_02.mov", 2), ("take_01.mov", 1), ("take_01_1.mov", 3)])
+    assert catalog.valid
+    assert len(catalog) == 3
+
+    assert catalog.find("take_01") == [1]
+    assert catalog.find("take_03") == []
+    assert catalog.position("take_02.mov") == 0
+    assert catalog.position("missing.mov") is None
+
+    catalog.invalidate()
+    assert not catalog.valid
+
+
+def test_prefixes():
+    catalog = ClipCatalog(prefixes=True)
+    catalog.load([("take_01_1.mov", None), ("take_01_2.mov", None), ("take_012.mov", None)])
+    assert catalog.find("take_01") == [0, 1]
+    assert catalog.find("take_01_2") == [1]
+    assert catalog.find("take_012") == [2]
+
+
+def test_reload_replaces():
+    catalog = ClipCatalog()
+    catalog.load([("take_01.mov", 1)])
+    catalog.load([("take_02.mov", 2)])
+    assert catalog.find("take_01") == []
+    assert catalog.find("take_02") == [0]
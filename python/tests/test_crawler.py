@@ -0,0 +1,79 @@
+import threading
+import time
+
+from peel_devices import crawler
+
+
+TREE = {
+    "/": (["/a", "/b"], ["root.mov"]),
+    "/a": (["/a/c"], ["a1.mov", "a2.mov"]),
+    "/b": ([], ["b1.mov"]),
+    "/a/c": ([], ["c1.mov"]),
+}
+
+
+def test_crawl_everything():
+    dc = crawler.DirectoryCrawler(lambda path: TREE[path], workers=3)
+    assert sorted(dc.crawl(["/"])) == ["a1.mov", "a2.mov", "b1.mov", "c1.mov", "root.mov"]
+    assert dc.failed == []
+
+
+def test_several_roots():
+    dc = crawler.DirectoryCrawler(lambda path: TREE[path])
+    assert sorted(dc.crawl(["/a", "/b"])) == ["a1.mov", "a2.mov", "b1.mov", "c1.mov"]
+    assert list(dc.crawl([])) == []
+
+
+def test_retry_then_skip(monkeypatch):
+    monkeypatch.setattr(crawler, "RETRY_DELAY", 0)
+    attempts = {}
+
+    def list_dir(path):
+        attempts[path] = attempts.get(path, 0) + 1
+        if path == "/b":
+            raise IOError("always fails")
+        if path == "/a" and attempts[path] == 1:
+            raise IOError("fails once")
+        return TREE[path]
+
+    dc = crawler.DirectoryCrawler(list_dir, retries=2)
+    assert sorted(dc.crawl(["/"])) == ["a1.mov", "a2.mov", "c1.mov", "root.mov"]
+    assert dc.failed == ["/b"]
+    assert attempts["/a"] == 2
+    assert attempts["/b"] == 3
+
+
+def test_stop_early():
+    # The consumer stops after the first file, the directories still queued are dropped
+    # and the workers have finished by the time close() returns
+    listed = []
+    lock = threading.Lock()
+
+    def list_dir(path):
+        time.sleep(0.01)
+        with lock:
+            listed.append(path)
+        if path.count("/") > 6:
+            return [], [path + ".mov"]
+        return [path + "/x", path + "/y"], [path + ".mov"]
+
+    dc = crawler.DirectoryCrawler(list_dir, workers=2)
+    files = dc.crawl(["/r"])
+    assert next(files) == "/r.mov"
+    files.close()
+
+    count = len(listed)
+    assert count < 10  # of 127
+    time.sleep(0.05)
+    assert len(listed) == count
+
+
+def test_is_running():
+    running = [True]
+
+    def list_dir(path):
+        running[0] = False
+        return TREE[path]
+
+    dc = crawler.DirectoryCrawler(list_dir, is_running=lambda: running[0])
+    assert list(dc.crawl(["/"])) == ["root.mov"]
@@ -0,0 +1,56 @@
+import socket
+
+import pytest
+
+epiciphone = pytest.importorskip("peel_devices.epiciphone")
+
+
+class FakePhone:
+    listen_ip = "127.0.0.1"
+
+    def __str__(self):
+        return "phone"
+
+
+def free_port(count):
+    """ A port with count free ports from it """
+    for _ in range(20):
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            port = probe.getsockname()[1]
+        try:
+            for i in range(count):
+                with socket.socket() as s:
+                    s.bind(("127.0.0.1", port + i))
+            return port
+        except OSError:
+            continue
+    pytest.skip("no free ports")
+
+
+def test_listens_on_a_window_of_ports(tmp_path):
+    port = free_port(epiciphone.IPhoneDownloadThread.WINDOW)
+    worker = epiciphone.IPhoneDownloadThread(FakePhone(), str(tmp_path), port)
+    assert [p for _, p in worker.sockets] == list(range(port, port + worker.WINDOW))
+
+    worker.close_sockets()
+    assert worker.sockets == []
+
+
+def test_port_in_use(tmp_path):
+    port = free_port(epiciphone.IPhoneDownloadThread.WINDOW)
+    with socket.socket() as busy:
+        busy.bind(("127.0.0.1", port + 1))
+        busy.listen()
+
+        # Fewer requests at once when a later port is taken
+        worker = epiciphone.IPhoneDownloadThread(FakePhone(), str(tmp_path), port)
+        assert [p for _, p in worker.sockets] == [port]
+        worker.close_sockets()
+
+    with socket.socket() as busy:
+        busy.bind(("127.0.0.1", port))
+        busy.listen()
+
+        with pytest.raises(OSError):
+            epiciphone.IPhoneDownloadThread(FakePhone(), str(tmp_path), port)
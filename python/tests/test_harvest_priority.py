@@ -0,0 +1,120 @@
+import importlib
+import sys
+import types
+
+import pytest
+
+
+class FakeCmd:
+    """ The PeelApp cmd calls HarvestPriority makes """
+
+    def __init__(self):
+        self.modes = ["Circled", "Maybe", "NG"]
+        self.take_list = []
+        self.status = {}
+
+    def selectModes(self):
+        return self.modes
+
+    def takes(self):
+        return self.take_list
+
+    def selectStatusForTake(self, take):
+        return self.status.get(take)
+
+
+class File:
+    def __init__(self, file_size):
+        self.file_size = file_size
+
+
+@pytest.fixture
+def cmd(monkeypatch):
+    fake = FakeCmd()
+    monkeypatch.setitem(sys.modules, "PeelApp", types.SimpleNamespace(cmd=fake))
+    monkeypatch.delitem(sys.modules, "peel_devices.harvest_priority", raising=False)
+    return fake
+
+
+def order(priority, files):
+    """ Takes of files, [(take, file_size)], in download order """
+    return [take for take, size in sorted(files, key=lambda f: priority.key(f[0], File(f[1])))]
+
+
+def test_orders(cmd):
+    harvest_priority = importlib.import_module("peel_devices.harvest_priority")
+    cmd.take_list = ["a", "b", "c", "d"]
+    cmd.status = {"a": "NG", "b": "Circled", "d": "Maybe"}
+    files = [("a", 10), ("b", 30), ("c", None), ("d", 20)]
+
+    selects = harvest_priority.HarvestPriority(harvest_priority.ORDERS["Selects First"])
+    assert order(selects, files) == ["b", "d", "a", "c"]
+
+    newest = harvest_priority.HarvestPriority(harvest_priority.ORDERS["Newest First"])
+    assert order(newest, files) == ["d", "c", "b", "a"]
+
+    smallest = harvest_priority.HarvestPriority(harvest_priority.ORDERS["Smallest First"])
+    assert order(smallest, files) == ["a", "d", "b", "c"]
+
+    device = harvest_priority.HarvestPriority(harvest_priority.ORDERS["Device Order"])
+    assert order(device, files) == ["a", "b", "c", "d"]
+
+
+def test_refresh(cmd):
+    harvest_priority = importlib.import_module("peel_devices.harvest_priority")
+    cmd.take_list = ["b", "a"]
+    priority = harvest_priority.HarvestPriority(harvest_priority.ORDERS["Selects First"])
+    files = [("a", 1), ("b", 1)]
+    assert order(priority, files) == ["a", "b"]
+    assert not priority.refresh()
+
+    # The select status changed during the harvest
+    cmd.status["b"] = "Circled"
+    version = priority.version
+    assert priority.refresh()
+    assert priority.version == version + 1
+    assert order(priority, files) == ["b", "a"]
+
+    cmd.take_list = ["b", "a", "c"]
+    assert priority.refresh()
+
+
+class SizePriority:
+    """ Smallest first, like ORDERS["Smallest First"] without the select status """
+    version = 0
+
+    def key(self, take, file_item):
+        return (file_item.file_size,)
+
+
+def test_streamed_source_is_ordered_in_a_window(tmp_path, monkeypatch):
+    peel_devices = pytest.importorskip("peel_devices")
+    monkeypatch.setattr(peel_devices.DownloadThread, "PRIORITY_WINDOW", 3)
+
+    worker = peel_devices.DownloadThread(str(tmp_path))
+    worker.set_download_mode("All")
+    worker.priority = SizePriority()
+    worker.set_started()
+
+    listed = []
+
+    def source():
+        for size in [5, 3, 4, 1, 2, 6]:
+            item = peel_devices.FileItem(f"take_{size}.mov", f"take_{size}.mov")
+            item.file_size = size
+            listed.append(size)
+            yield item
+
+    downloads = []
+
+    def fetch(file_item, local_path):
+        downloads.append((file_item.file_size, len(listed)))
+        return worker.COPY_OK
+
+    worker.download_files(fetch, source())
+
+    # Smallest of the next three listed, the listing never runs more than the window ahead
+    assert [size for size, _ in downloads] == [3, 1, 2, 4, 5, 6]
+    assert downloads[0][1] == 3
+    assert all(count - i <= 3 for i, (_, count) in enumerate(downloads))
+    assert len(worker.files) == 6
@@ -0,0 +1,21 @@
+import pytest
+
+hyperdeck = pytest.importorskip("peel_devices.hyperdeck")
+
+
+def test_reconnect_drops_the_stale_queue():
+    deck = hyperdeck.HyperDeck("deck")
+
+    # set-clip is waiting for a clip list that was asked for on the old connection
+    deck.protocol.sent("ls")
+    deck.enqueue(["set-clip", "goto-start", "play"])
+    assert deck.command_queue == ["set-clip", "goto-start", "play"]
+
+    # What connect_tcp() does for the new connection, without opening a socket
+    deck.protocol.clear()
+    deck.do_connected()
+
+    # The clip list will never be answered, so nothing is left waiting on it
+    assert deck.command_queue is None
+    assert deck.protocol.in_flight("ls") == 0
+    assert not deck.clips.valid
@@ -0,0 +1,60 @@
+from hyperdeck_protocol import HyperDeckProtocol
+
+
+def test_responses_match_in_order():
+    protocol = HyperDeckProtocol()
+    protocol.sent("transport info")
+    protocol.sent("ls")
+    assert protocol.in_flight() == 2
+    assert protocol.in_flight("ls") == 1
+
+    ret = protocol.feed(b"200 ok\r\n")
+    assert [(r.code, r.request) for r in ret] == [(200, "transport info")]
+    assert ret[0].elapsed is not None
+
+    ret = protocol.feed(b"205 clips info:\r\nclip count: 1\r\n1: take_01.mov 00:00:00:00 00:00:01:00\r\n\r\n")
+    assert len(ret) == 1
+    assert ret[0].request == "ls"
+    assert ret[0].lines == ["clip count: 1", "1: take_01.mov 00:00:00:00 00:00:01:00"]
+    assert protocol.in_flight() == 0
+
+
+def test_partial_reads():
+    protocol = HyperDeckProtocol()
+    protocol.sent("slot info")
+    assert protocol.feed(b"202 slot in") == []
+    assert protocol.feed(b"fo:\r\nslot id: 1\r\n") == []
+    ret = protocol.feed(b"\r\n")
+    assert ret[0].request == "slot info"
+    assert ret[0].lines == ["slot id: 1"]
+
+
+def test_notifications_are_not_matched():
+    protocol = HyperDeckProtocol()
+    protocol.sent("record")
+    ret = protocol.feed(b"502 slot info:\r\nslot id: 2\r\n\r\n200 ok\r\n")
+    assert [(r.code, r.request) for r in ret] == [(502, None), (200, "record")]
+    assert ret[0].is_async()
+    assert protocol.in_flight() == 0
+
+
+def test_error_response():
+    protocol = HyperDeckProtocol()
+    protocol.sent("play")
+    ret = protocol.feed("102 unsupported\n")
+    assert ret[0].is_error()
+    assert ret[0].request == "play"
+
+
+def test_clear():
+    # On a new connection nothing sent before is answered, the first reply is for the
+    # first command sent after it
+    protocol = HyperDeckProtocol()
+    protocol.sent("ls")
+    protocol.feed(b"205 clips info:\r\nclip count")
+    protocol.clear()
+    assert protocol.in_flight("ls") == 0
+
+    protocol.sent("notify")
+    ret = protocol.feed(b"200 ok\r\n")
+    assert [(r.code, r.request) for r in ret] == [(200, "notify")]
@@ -0,0 +1,54 @@
+import os
+from xml.etree import ElementTree
+
+from peel_devices import integrity
+
+
+def test_hash_file_limit(tmp_path):
+    path = tmp_path / "data.bin"
+    path.write_bytes(b"0123456789")
+
+    whole = integrity.new_hash()
+    whole.update(b"0123456789")
+    assert integrity.hash_file(str(path)).hexdigest() == whole.hexdigest()
+
+    # A resumed download carries on from the hash of the bytes already on disk
+    resumed = integrity.hash_file(str(path), 4)
+    resumed.update(b"456789")
+    assert resumed.hexdigest() == whole.hexdigest()
+
+
+def test_hash_files(tmp_path):
+    path = tmp_path / "data.bin"
+    path.write_bytes(b"abc")
+    missing = str(tmp_path / "missing.bin")
+
+    ret = integrity.hash_files([str(path), missing], workers=2)
+    assert ret[str(path)] == integrity.hash_file(str(path)).hexdigest()
+    assert ret[missing] is None
+
+
+def test_mhl(tmp_path):
+    device = tmp_path / "cam"
+    (device / "sub").mkdir(parents=True)
+    clip = device / "sub" / "take01.mov"
+    clip.write_bytes(b"abc")
+
+    hashes = integrity.HashList(str(device))
+    hashes.add(str(clip), "1234")
+    hashes.add(str(device / "missing.mov"), "5678")
+    assert len(hashes) == 2
+
+    path = hashes.write()
+    assert os.path.dirname(path) == str(device)
+    assert os.path.basename(path).startswith("cam_") and path.endswith(".mhl")
+
+    root = ElementTree.parse(path).getroot()
+    assert root.tag == "hashlist" and root.get("version") == "1.1"
+    assert root.find("creatorinfo/tool").text == "PeelCapture"
+
+    items = root.findall("hash")
+    assert len(items) == 1
+    assert items[0].find("file").text == "sub/take01.mov"
+    assert items[0].find("size").text == "3"
+    assert items[0].find(integrity.ALGORITHM).text == "1234"
@@ -0,0 +1,38 @@
+import pytest
+
+kipro = pytest.importorskip("peel_devices.kipro")
+
+
+def test_cue_gives_up_once_recording():
+    deck = kipro.KiPro("deck")
+    deck.clip_catalog.load([("take_01", {}), ("take_02", {}), ("take_03", {})])
+
+    steps = []
+    deck.call = lambda **params: None  # no GoToClip, step through the clips instead
+    deck.get_param = lambda *args: "take_01"
+
+    def next_clip():
+        steps.append("next")
+        # Record starts while the cue is stepping, it does not wait for cue_lock
+        deck.recording = True
+
+    deck.next_clip = next_clip
+
+    with deck.cue_lock:
+        assert not deck.cue_clip("take_03")
+
+    assert steps == ["next"]
+    assert deck.cued is None
+
+
+def test_cue_without_recording():
+    deck = kipro.KiPro("deck")
+    deck.clip_catalog.load([("take_01", {}), ("take_02", {})])
+    deck.call = lambda **params: None
+    deck.get_param = lambda *args: "take_01"
+    deck.next_clip = lambda: None
+
+    with deck.cue_lock:
+        assert deck.cue_clip("take_02")
+
+    assert deck.cued == "take_02"
@@ -0,0 +1,69 @@
+import os
+
+from peel_devices.ledger import HarvestLedger
+
+
+def write(path, size):
+    with open(path, "wb") as fp:
+        fp.write(b"x" * size)
+
+
+def test_record_and_has(tmp_path):
+    local = tmp_path / "cam" / "take01.mov"
+    local.parent.mkdir()
+    write(local, 100)
+
+    ledger = HarvestLedger(str(tmp_path))
+    ledger.record("cam", "/slot1/take01.mov", str(local), mtime=1234, hash_value="abc")
+
+    assert ledger.has("cam", "/slot1/take01.mov", size=100)
+    assert ledger.has("cam", "/slot1/take01.mov", mtime=1234)
+    assert ledger.has("cam", "/slot1/take01.mov", size=100, mtime=1234)
+    assert not ledger.has("cam", "/slot1/take01.mov", size=101)
+    assert not ledger.has("cam", "/slot1/take01.mov", mtime=999)
+    assert not ledger.has("cam", "/slot1/take02.mov")
+    assert not ledger.has("other", "/slot1/take01.mov")
+    assert ledger.local_path("cam", "/slot1/take01.mov") == str(local)
+    ledger.close()
+
+
+def test_local_file_changed(tmp_path):
+    local = tmp_path / "take01.mov"
+    write(local, 100)
+
+    ledger = HarvestLedger(str(tmp_path))
+    ledger.record("cam", "take01.mov", str(local))
+
+    write(local, 50)
+    assert not ledger.has("cam", "take01.mov", size=100)
+
+    os.remove(local)
+    assert not ledger.has("cam", "take01.mov", size=100)
+    ledger.close()
+
+
+def test_reopen(tmp_path):
+    local = tmp_path / "take01.mov"
+    write(local, 10)
+
+    ledger = HarvestLedger(str(tmp_path))
+    ledger.record("cam", "take01.mov", str(local), hash_value="abc")
+    ledger.close()
+
+    ledger = HarvestLedger(str(tmp_path))
+    assert ledger.has("cam", "take01.mov", size=10)
+    assert ledger.lookup("cam", "take01.mov")["hash"] == "abc"
+    ledger.close()
+
+
+def test_name_only(tmp_path):
+    local = tmp_path / "A001C003.mov"
+    write(local, 100)
+
+    ledger = HarvestLedger(str(tmp_path))
+    ledger.record("kipro", "A001C003.mov", str(local))
+
+    # Without a size or time from the device a new clip with the same name looks the same
+    assert not ledger.has("kipro", "A001C003.mov")
+    assert ledger.has("kipro", "A001C003.mov", size=100)
+    ledger.close()
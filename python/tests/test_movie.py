@@ -0,0 +1,48 @@
+import os
+
+import pytest
+
+movie = pytest.importorskip("peel.movie")
+
+
+def write(text):
+    def make(dest):
+        with open(dest, "w") as fp:
+            fp.write(text)
+        return 0
+    return make
+
+
+def test_make_cached(tmp_path):
+    source = tmp_path / "take.mov"
+    source.write_bytes(b"movie")
+
+    temps = []
+
+    def make(dest):
+        temps.append(dest)
+        return write("thumb")(dest)
+
+    made = movie.make_cached(str(source), ".png", make)
+    assert open(made).read() == "thumb"
+    assert os.path.dirname(temps[0]) == os.path.dirname(made)
+    assert temps[0] != made and not os.path.exists(temps[0])
+
+    # Cached, make is not called again
+    assert movie.make_cached(str(source), ".png", make) == made
+    assert len(temps) == 1
+
+
+def test_make_cached_failure(tmp_path):
+    source = tmp_path / "take.mov"
+    source.write_bytes(b"movie")
+
+    with pytest.raises(RuntimeError):
+        movie.make_cached(str(source), ".png", lambda dest: 1)
+
+    with pytest.raises(RuntimeError):
+        # ffmpeg returned 0 without writing anything
+        movie.make_cached(str(source), ".png", lambda dest: 0)
+
+    # Nothing left behind to be mistaken for a cached file
+    assert os.listdir(tmp_path / movie.CACHE_DIR) == []
@@ -0,0 +1,159 @@
+import contextlib
+import hashlib
+import json
+import socket
+import threading
+
+import pytest
+
+peel_recorder = pytest.importorskip("peel_devices.peel_recorder")
+
+
+def test_catalog_full_list():
+    catalog = peel_recorder.RecorderCatalog()
+    assert catalog.request() is None
+
+    catalog.apply({"files": ["a.mov", {"name": "b.mov", "size": 10}, {"size": 1}], "seq": 4})
+    assert catalog.files == {"a.mov": None, "b.mov": 10}
+    assert catalog.changed == 3
+    assert json.loads(catalog.request()) == {"since": 4}
+
+
+def test_catalog_delta_merge():
+    catalog = peel_recorder.RecorderCatalog()
+    catalog.apply({"files": ["a.mov", "b.mov", "c.mov"], "seq": 1})
+
+    catalog.apply({"delta": True, "files": [{"name": "b.mov", "size": 5}, "d.mov"],
+                   "removed": ["a.mov", "missing.mov"], "seq": 2})
+    assert list(catalog.files) == ["b.mov", "c.mov", "d.mov"]
+    assert catalog.files["b.mov"] == 5
+    assert catalog.changed == 2
+    assert json.loads(catalog.request()) == {"since": 2}
+
+
+def test_catalog_without_delta_replaces():
+    # An older recorder, or one that lost the sequence, sends the whole list
+    catalog = peel_recorder.RecorderCatalog()
+    catalog.apply({"files": ["a.mov", "b.mov"], "seq": 1})
+    catalog.apply({"files": ["c.mov"]})
+    assert list(catalog.files) == ["c.mov"]
+    assert catalog.request() is None
+
+
+def test_catalog_reset():
+    catalog = peel_recorder.RecorderCatalog()
+    catalog.apply({"files": ["a.mov"], "seq": 3})
+    catalog.reset()
+    assert len(catalog) == 0
+    assert catalog.request() is None
+
+
+def test_teardown_disconnects_the_parser():
+    parser = peel_recorder.Parser(None)
+    worker = peel_recorder.PeelRecordDownloadThread("harvest", parser)
+    assert parser.receivers("2received_file_list()") == 1
+
+    worker.teardown()
+    worker.teardown()
+
+    # The parser lives on with the device, the next harvest connects to it again
+    assert parser.receivers("2received_file_list()") == 0
+    assert parser.receivers("2file_is_done(QString)") == 0
+
+
+class FakeRecorder:
+    """ Accepts data connections on localhost.  "data" answers file requests the way a
+        recorder that supports data connections does, "silent" never answers and "control"
+        answers with a status message like an older recorder's control connection. """
+
+    def __init__(self, mode, files):
+        self.mode = mode
+        self.files = files
+        self.server = socket.create_server(("127.0.0.1", 0))
+        self.port = self.server.getsockname()[1]
+        self.connections = 0
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                return
+            self.connections += 1
+            threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+
+    def handle(self, conn):
+        with conn, contextlib.suppress(OSError):
+            reader = conn.makefile("rb")
+            while True:
+                header = reader.read(peel_recorder.HEADER.size)
+                if len(header) < peel_recorder.HEADER.size:
+                    return
+                _, code, _, size, _ = peel_recorder.HEADER.unpack(header)
+                name = reader.read(size).decode("utf8")
+                if self.mode == "data" and code == 112:
+                    data = self.files[name]
+                    conn.sendall(peel_recorder.HEADER.pack(peel_recorder.MAGIC_NUMBER, 113, 0, 32 + len(data), 0)
+                                 + hashlib.sha256(data).digest() + data)
+                elif self.mode == "control":
+                    conn.sendall(peel_recorder.pack_message(300, "status"))
+
+    def close(self):
+        self.server.close()
+
+
+def harvest(tmp_path, recorder):
+    parser = peel_recorder.Parser(None)
+    parser.host = "127.0.0.1"
+    parser.port = recorder.port
+    requested = []
+    parser.get_file = requested.append
+
+    worker = peel_recorder.PeelRecordDownloadThread(str(tmp_path), parser)
+    worker.set_download_mode("All")
+    parser.catalog.apply({"files": [{"name": name, "size": len(data)}
+                                    for name, data in recorder.files.items()], "seq": 1})
+    worker.set_started()
+    worker.got_file_list()
+    return worker, requested
+
+
+FILES = {"take_01.wav": b"one" * 1000, "take_02.wav": b"two" * 1000, "take_03.wav": b"three"}
+
+
+def test_data_connections(tmp_path):
+    recorder = FakeRecorder("data", FILES)
+    try:
+        worker, requested = harvest(tmp_path, recorder)
+    finally:
+        recorder.close()
+
+    assert worker.data_supported is True
+    assert worker.status == peel_recorder.DownloadThread.STATUS_FINISHED
+    assert requested == []
+    for name, data in FILES.items():
+        assert (tmp_path / name).read_bytes() == data
+
+
+@pytest.mark.parametrize("mode", ["silent", "control"])
+def test_falls_back_to_the_control_connection(tmp_path, monkeypatch, mode):
+    monkeypatch.setattr(peel_recorder, "DATA_TIMEOUT", 0.2)
+    recorder = FakeRecorder(mode, FILES)
+    try:
+        worker, requested = harvest(tmp_path, recorder)
+    finally:
+        recorder.close()
+
+    # Every file waits for the control connection instead of a timeout each
+    assert worker.data_supported is False
+    assert recorder.connections <= peel_recorder.DATA_CONNECTIONS
+    assert worker.status == peel_recorder.DownloadThread.STATUS_RUNNING
+    assert sorted(i.remote_file for i in worker.deferred) == sorted(FILES)
+    assert len(requested) == 1
+
+    # The parser reports each file done on the control connection, the next one is asked for
+    for _ in FILES:
+        worker.handle_file_failed(requested[-1])
+    assert sorted(requested) == sorted(FILES)
+    assert worker.status == peel_recorder.DownloadThread.STATUS_FINISHED
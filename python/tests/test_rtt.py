@@ -0,0 +1,47 @@
+from peel_devices.rtt import RttEstimator
+
+
+def test_initial_until_first_sample():
+    rtt = RttEstimator(initial=2.0)
+    assert rtt.timeout() == 2.0
+    assert rtt.info() == ""
+
+
+def test_minimum():
+    rtt = RttEstimator()
+    for _ in range(20):
+        rtt.add_sample(0.01)
+    assert rtt.timeout() == RttEstimator.MINIMUM
+    assert rtt.timeout(minimum=0.1) == 0.1
+
+
+def test_lan_floor_tightens():
+    rtt = RttEstimator(minimum=RttEstimator.LAN_MINIMUM)
+    for _ in range(50):
+        rtt.add_sample(0.02)
+    assert rtt.timeout() == RttEstimator.LAN_MINIMUM
+
+
+def test_timeout_follows_samples():
+    rtt = RttEstimator(minimum=0.0)
+    for _ in range(50):
+        rtt.add_sample(0.5)
+    assert 0.5 <= rtt.timeout() < 0.6
+    assert rtt.info() == "rtt 500ms"
+
+
+def test_backoff_doubles_and_resets():
+    rtt = RttEstimator(initial=1.0, maximum=100.0)
+    rtt.add_timeout()
+    assert rtt.timeout() == 2.0
+    rtt.add_timeout()
+    assert rtt.timeout() == 4.0
+    rtt.add_sample(1.0)
+    assert rtt.backoff == 1
+
+
+def test_maximum():
+    rtt = RttEstimator(initial=8.0, maximum=10.0)
+    rtt.add_timeout()
+    assert rtt.timeout() == 10.0
+    assert rtt.timeout(maximum=5.0) == 5.0
@@ -0,0 +1,52 @@
+from peel_devices.take_matcher import TakeMatcher
+
+
+class Formatting:
+    def format_take(self, take):
+        return "cam_" + take
+
+
+TAKES = ["shot-01", "shot-01 alt", "shot-02"]
+
+
+def test_exact():
+    matcher = TakeMatcher(TAKES, "Exact")
+    assert len(matcher) == 3
+    assert matcher.match("SHOT_01") == "shot-01"
+    assert matcher.match("shot_01_alt") == "shot-01 alt"
+    assert matcher.match("shot_01_1") is None
+
+
+def test_starts_with_longest():
+    matcher = TakeMatcher(TAKES, "Starts With")
+    assert matcher.match("shot_01_0001") == "shot-01"
+    assert matcher.match("shot_01_alt_0001") == "shot-01 alt"
+    assert matcher.match("a_shot_01") is None
+    assert matcher.match("shot") is None
+
+
+def test_contains_take_in_file_name():
+    # The take name is somewhere in the file name, not the other way around
+    matcher = TakeMatcher(TAKES, "Contains")
+    assert matcher.match("day1_shot_02_cam_a") == "shot-02"
+    assert matcher.match("day1_shot_01_alt_cam_a") == "shot-01 alt"
+    assert matcher.match("x_shot_01") == "shot-01"
+    assert matcher.match("shot_0") is None
+    assert matcher.match("shot") is None
+
+
+def test_contains_overlapping():
+    matcher = TakeMatcher(["abc", "bcd", "b"], "Contains")
+    assert matcher.match("xabcd") in ("abc", "bcd")
+    assert matcher.match("xbx") == "b"
+    assert matcher.match("xyz") is None
+
+
+def test_formatting():
+    matcher = TakeMatcher(["shot_01"], "Exact", Formatting())
+    assert matcher.match("cam_shot_01") == "shot_01"
+    assert matcher.match("shot_01") is None
+
+
+def test_unknown_mode():
+    assert TakeMatcher(TAKES, "Other").match("shot_01") is None
@@ -0,0 +1,126 @@
+import pytest
+
+from peel_devices import integrity, transfer
+
+
+class FakeThread:
+    """ The parts of a DownloadThread that FileSink uses """
+
+    def __init__(self):
+        self.running = True
+        self.received = 0
+
+    def is_running(self):
+        return self.running
+
+    def add_file_bytes(self, file_item, n):
+        self.received += n
+
+
+DATA = bytes(range(256)) * 64
+
+
+def test_partial_offset(tmp_path):
+    local = tmp_path / "file.bin"
+    local.write_bytes(DATA[:100])
+    partial = transfer.PartialFile(str(local))
+    assert partial.offset("remote.bin") == 0  # no sidecar
+
+    partial.start("remote.bin", len(DATA))
+    partial = transfer.PartialFile(str(local))
+    assert partial.offset("remote.bin", len(DATA)) == 100
+    assert partial.offset("other.bin", len(DATA)) == 0
+    assert partial.offset("remote.bin", len(DATA) + 1) == 0  # changed on the device
+
+    local.write_bytes(DATA + b"x")
+    assert partial.offset("remote.bin", len(DATA)) == 0  # more on disk than the file
+
+    local.write_bytes(DATA[:100])
+    partial.set_preallocated(True)
+    assert transfer.PartialFile(str(local)).offset("remote.bin", len(DATA)) == 0
+
+
+def test_partial_complete(tmp_path):
+    local = tmp_path / "file.bin"
+    local.write_bytes(DATA[:100])
+    partial = transfer.PartialFile(str(local))
+    partial.start("remote.bin", len(DATA))
+
+    # Short, the sidecar is kept so the transfer can be resumed
+    with pytest.raises(IOError):
+        partial.complete()
+    assert partial.exists()
+
+    local.write_bytes(DATA)
+    partial.complete()
+    assert not partial.exists()
+
+
+def test_move_aside(tmp_path):
+    local = tmp_path / "file.bin"
+    local.write_bytes(b"old")
+    (tmp_path / "file.bin_0").write_bytes(b"older")
+
+    transfer.move_aside(str(local))
+    assert not local.exists()
+    assert (tmp_path / "file.bin_1").read_bytes() == b"old"
+
+
+def fetch(local_path, data, offset=0, write_behind=False, chunks=None):
+    """ Write data[offset:] to local_path the way the fetch functions do """
+    partial = transfer.PartialFile(local_path)
+    if not offset:
+        partial.start("remote.bin", len(data))
+    digest = integrity.hash_file(local_path, offset) if offset else integrity.new_hash()
+    thread = FakeThread()
+    with transfer.FileSink(thread, None, local_path, offset, len(data), digest, partial,
+                           write_behind=write_behind, buffer_size=1000) as sink:
+        sink.fill(transfer.chunk_reader(chunks or [data[offset:]]))
+    partial.complete()
+    return digest, thread
+
+
+@pytest.mark.parametrize("write_behind", [False, True])
+def test_file_sink(tmp_path, write_behind):
+    local = str(tmp_path / "file.bin")
+    digest, thread = fetch(local, DATA, write_behind=write_behind, chunks=[DATA[:700], DATA[700:]])
+
+    with open(local, "rb") as fp:
+        assert fp.read() == DATA
+    assert thread.received == len(DATA)
+    assert digest.hexdigest() == integrity.hash_file(local).hexdigest()
+    assert not transfer.PartialFile(local).exists()
+
+
+def test_interrupted_and_resumed(tmp_path):
+    local = str(tmp_path / "file.bin")
+    partial = transfer.PartialFile(local)
+    partial.start("remote.bin", len(DATA))
+
+    def broken(buffer):
+        raise IOError("connection lost")
+
+    thread = FakeThread()
+    with pytest.raises(IOError):
+        with transfer.FileSink(thread, None, local, 0, len(DATA), integrity.new_hash(), partial) as sink:
+            sink.fill(transfer.chunk_reader([DATA[:3000]]), limit=3000)
+            sink.fill(broken)
+
+    # Trimmed back to the data received, which is kept for the next attempt
+    partial = transfer.PartialFile(local)
+    assert not partial.preallocated
+    assert partial.offset("remote.bin", len(DATA)) == 3000
+
+    digest, _ = fetch(local, DATA, offset=3000)
+    with open(local, "rb") as fp:
+        assert fp.read() == DATA
+    assert digest.hexdigest() == integrity.hash_file(local).hexdigest()
+
+
+def test_stopped(tmp_path):
+    local = str(tmp_path / "file.bin")
+    thread = FakeThread()
+    thread.running = False
+    with pytest.raises(IOError):
+        with transfer.FileSink(thread, None, local, 0, len(DATA)) as sink:
+            sink.fill(transfer.chunk_reader([DATA]))